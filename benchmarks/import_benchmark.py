@@ -0,0 +1,120 @@
+import argparse
+import importlib.util
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+src_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+
+#the entry points first, then the stage modules which are imported only when a run uses them
+pipeline_modules = ['pipeline_starter', 'batch_runner', 'pipeline_service', 'pdb_parser', 'structure_reader', 'accessibility_scorer', 'centrality_scorer', 'residue_table', 'stage_cache',
+	'domains_splitter', 'patch_evaluator', 'parallel_scorer', 'remote_fetcher', 'result_store', 'bio_pdb_parser']
+optional_modules = ['pymol']
+
+class ImportBenchmark:
+	"""
+	Measures the cold import cost of every pipeline module in a fresh interpreter with `python -X importtime`,
+	and reports its total import time and the dependencies that take most of it.
+	"""
+
+	def get_parsed_args(self):
+		parser = argparse.ArgumentParser(description='Report the import cost of the pipeline modules.')
+		parser.add_argument('--repeat', type=int, default=5, help='Number of fresh interpreters per module, the median is reported. (default: 5)')
+		parser.add_argument('--modules', type=str, nargs='+', default=None, help='Modules to measure. (default: all the pipeline modules)')
+		parser.add_argument('--json', type=str, default=None, help='Save the results in this JSON file.')
+		parser.add_argument('--baseline', type=str, default=None, help='JSON results of a previous run, exit with an error if a module became slower than it.')
+		parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed relative slow-down against the baseline. (default: 0.25)')
+		parser.add_argument('--min_slowdown', type=float, default=20, help='Slow-downs under this many milliseconds are ignored as noise. (default: 20)')
+		return parser.parse_args()
+
+	def measure(self, module):
+		"""
+		Imports the module once in a fresh interpreter and returns its cumulative import time and the cumulative times of its direct imports, in milliseconds.
+		"""
+		result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module], cwd=src_path, capture_output=True, text=True)
+		if result.returncode != 0:
+			raise ImportError(result.stderr.strip().splitlines()[-1])
+
+		#the lines are "import time: self [us] | cumulative | imported package", nested imports are indented and printed before their parent
+		imports = []
+		for line in result.stderr.splitlines():
+			if not line.startswith('import time:') or 'cumulative' in line:
+				continue
+			_, cumulative, name = line[len('import time:'):].split('|')
+			imports.append((len(name) - len(name.lstrip()), name.strip(), int(cumulative)/1000))
+
+		#the direct imports of the module are the lines one level deeper right above it, the interpreter start-up imports come before them
+		module_line = max(i for i, (indentation, name, _) in enumerate(imports) if indentation == 1 and name == module)
+		total = imports[module_line][2]
+		dependencies = {}
+		for indentation, name, cumulative in reversed(imports[:module_line]):
+			if indentation == 1:
+				break
+			if indentation == 3:
+				dependencies[name] = dependencies.get(name, 0) + cumulative
+		return total, dependencies
+
+	def run(self, modules, repeat):
+		results = {}
+		for module in modules:
+			if importlib.util.find_spec(module) is None and not os.path.exists(os.path.join(src_path, module + '.py')):
+				continue
+			try:
+				#the first import fills the OS file cache and is not counted
+				self.measure(module)
+				measures = [self.measure(module) for _ in range(repeat)]
+			except ImportError as e:
+				results[module] = {'error': str(e)}
+				continue
+			dependencies = {}
+			for _, module_dependencies in measures:
+				for name, cumulative in module_dependencies.items():
+					dependencies.setdefault(name, []).append(cumulative)
+			heaviest = sorted(((statistics.median(times), name) for name, times in dependencies.items()), reverse=True)[:5]
+			results[module] = {'import_ms': statistics.median([total for total, _ in measures]), 'heaviest_imports_ms': {name: time for time, name in heaviest}}
+		return results
+
+	def print_results(self, results):
+		print('%-22s %10s   %s' % ('module', 'import ms', 'heaviest imports (ms)'))
+		for module, result in results.items():
+			if 'error' in result:
+				print('%-22s %10s   %s' % (module, 'error', result['error']))
+			else:
+				print('%-22s %10.1f   %s' % (module, result['import_ms'], ', '.join('%s %.1f' % item for item in result['heaviest_imports_ms'].items())))
+
+	def compare(self, results, baseline, tolerance, min_slowdown):
+		"""
+		Returns the modules whose import became slower than the baseline.
+		"""
+		regressions = []
+		for module, result in results.items():
+			if module not in baseline or 'import_ms' not in result or 'import_ms' not in baseline[module]:
+				continue
+			slowdown = result['import_ms'] - baseline[module]['import_ms']
+			if slowdown > min_slowdown and result['import_ms'] > baseline[module]['import_ms']*(1 + tolerance):
+				regressions.append((module, baseline[module]['import_ms'], result['import_ms']))
+		return regressions
+
+	def main(self):
+		args = self.get_parsed_args()
+		results = self.run(args.modules or pipeline_modules + optional_modules, args.repeat)
+		self.print_results(results)
+
+		if args.json:
+			with open(args.json, 'w') as fl:
+				json.dump(results, fl, indent=1)
+
+		if args.baseline:
+			with open(args.baseline) as fl:
+				baseline = json.load(fl)
+			regressions = self.compare(results, baseline, args.tolerance, args.min_slowdown)
+			for module, before, after in regressions:
+				print('REGRESSION: importing %s takes %.1f ms, it took %.1f ms in the baseline' % (module, after, before))
+			if regressions:
+				sys.exit(1)
+
+if __name__ == "__main__":
+	importBenchmarkObj = ImportBenchmark()
+	importBenchmarkObj.main()
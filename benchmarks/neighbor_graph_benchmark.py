@@ -0,0 +1,136 @@
+import argparse
+import json
+import logging
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from synthetic_inputs import SyntheticInputsGenerator
+from pdb_parser import StructureContext
+from accessibility_scorer import AccessibilityScorer
+from centrality_scorer import CentralityScorer
+from contact_graph import ContactGraphBuilder, compare_neighbor_graphs
+from residue_table import build_residue_table
+
+class NeighborGraphBenchmark:
+	"""
+	Compares the residue contact graph (KD-tree, within a heavy atom cutoff) with the Delaunay surface neighbors: the time to build them, the agreement
+	of their edges and the agreement of the first patch found by the centrality scores on each of them, for every chain/domain of every input.
+	"""
+
+	def get_parsed_args(self):
+		parser = argparse.ArgumentParser(description='Compare the contact graph with the Delaunay neighbors on synthetic inputs of increasing size or on a structure.')
+		parser.add_argument('--residues', type=int, nargs='+', default=[500, 1000, 2000], help='Numbers of residues of the synthetic structures. (default: 500 1000 2000)')
+		parser.add_argument('--chains', type=int, default=1, help='Number of chains of the synthetic structures. (default: 1)')
+		parser.add_argument('--pdb_file', type=str, default=None, help='Run on this structure file instead of synthetic structures, with --conservations_file.')
+		parser.add_argument('--conservations_file', type=str, default=None, help='The conservations file of --pdb_file.')
+		parser.add_argument('--cutoffs', type=float, nargs='+', default=[4.0, 4.5, 5.0], help='Heavy atom cutoffs of the contact graph, in angstroms. (default: 4.0 4.5 5.0)')
+		parser.add_argument('--number_of_iterations', type=int, default=1, help='Number of centrality iterations to compare the patches of. (default: 1)')
+		parser.add_argument('--repeat', type=int, default=3, help='Number of runs of every timing, the median is reported. (default: 3)')
+		parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic inputs. (default: 0)')
+		parser.add_argument('--json', type=str, default=None, help='Save the results in this JSON file.')
+		return parser.parse_args()
+
+	def time_call(self, function, repeat):
+		"""
+		Returns the median wall time of the function and its result.
+		"""
+		times = []
+		for _ in range(repeat):
+			start = time.perf_counter()
+			result = function()
+			times.append(time.perf_counter() - start)
+		return statistics.median(times), result
+
+	def get_patches(self, chain_cons, accessible_residues, direct_neighbors, number_of_iterations):
+		residue_table = build_residue_table(chain_cons, accessible_residues, direct_neighbors)
+		CentralityScorer().eigenvector_centrality({'A': {'1': residue_table}}, number_of_iterations, logging)
+		return [set(residue_table.residue_keys[i] for i in patch.tolist()) for patch in residue_table.patches]
+
+	def run_structure(self, pdb_file, conservations_file, args):
+		"""
+		Returns the comparison records of every cutoff, summed over the chains of the structure.
+		"""
+		structure_context = StructureContext(pdb_file)
+		with open(conservations_file) as fl:
+			conservations = json.load(fl)['data']
+
+		units = []
+		delaunay_seconds = 0
+		for pdb_chain in structure_context.get_chain_ids():
+			coords, atm_keys = structure_context.get_clean_coordinates(pdb_chain, None)
+			seconds, (accessible_residues, direct_neighbors) = self.time_call(lambda: AccessibilityScorer(coords, atm_keys).get_accessible_residues_and_their_neighbors(), args.repeat)
+			delaunay_seconds += seconds
+			chain_cons = conservations[pdb_chain] if pdb_chain in conservations else conservations
+			units.append((coords, atm_keys, chain_cons, accessible_residues, direct_neighbors, self.get_patches(chain_cons, accessible_residues, direct_neighbors, args.number_of_iterations)))
+
+		results = []
+		for cutoff in args.cutoffs:
+			contactGraphBuilderObj = ContactGraphBuilder(cutoff)
+			contact_seconds = 0
+			agreement = {'edges': 0, 'reference_edges': 0, 'common_edges': 0}
+			patch_agreement = []
+			for coords, atm_keys, chain_cons, accessible_residues, direct_neighbors, patches in units:
+				seconds, contact_neighbors = self.time_call(lambda: contactGraphBuilderObj.get_direct_neighbors(coords, atm_keys, accessible_residues), args.repeat)
+				contact_seconds += seconds
+				for name, value in compare_neighbor_graphs(contact_neighbors, direct_neighbors).items():
+					if name in agreement:
+						agreement[name] += value
+				contact_patches = self.get_patches(chain_cons, accessible_residues, contact_neighbors, args.number_of_iterations)
+				for patch, contact_patch in zip(patches, contact_patches):
+					patch_agreement.append(len(patch & contact_patch)/len(patch | contact_patch))
+
+			all_edges = agreement['edges'] + agreement['reference_edges'] - agreement['common_edges']
+			results.append({
+				'structure': os.path.basename(pdb_file),
+				'atoms': len(structure_context.model),
+				'cutoff': cutoff,
+				'delaunay_seconds': delaunay_seconds,
+				#the contact graph is built on the accessible residues of the Delaunay accessibility, so the contacts cost both
+				'kdtree_seconds': contact_seconds,
+				'contact_seconds': delaunay_seconds + contact_seconds,
+				**agreement,
+				'jaccard': agreement['common_edges']/all_edges if all_edges else 1.0,
+				'precision': agreement['common_edges']/agreement['edges'] if agreement['edges'] else 1.0,
+				'recall': agreement['common_edges']/agreement['reference_edges'] if agreement['reference_edges'] else 1.0,
+				'patch_jaccard': statistics.mean(patch_agreement) if patch_agreement else None
+			})
+		return results
+
+	def print_results(self, results):
+		print('%-28s %8s %7s %10s %10s %10s %8s %8s %8s %8s %8s' % ('structure', 'atoms', 'cutoff', 'delaunay', '+kd-tree', 'contacts', 'edges', 'jaccard', 'prec.', 'recall', 'patches'))
+		for result in results:
+			patch_jaccard = '%8.3f' % result['patch_jaccard'] if result['patch_jaccard'] is not None else '%8s' % '-'
+			print('%-28s %8d %7.2f %10.4f %10.4f %10.4f %8d %8.3f %8.3f %8.3f %s' % (result['structure'], result['atoms'], result['cutoff'], result['delaunay_seconds'], result['kdtree_seconds'], result['contact_seconds'],
+				result['edges'], result['jaccard'], result['precision'], result['recall'], patch_jaccard))
+
+	def main(self):
+		args = self.get_parsed_args()
+		logging.basicConfig(level=logging.WARNING, format='%(levelname)s: %(message)s')
+		results = []
+		if args.pdb_file:
+			if not args.conservations_file:
+				sys.exit('--conservations_file is required with --pdb_file.')
+			results += self.run_structure(args.pdb_file, args.conservations_file, args)
+		else:
+			input_path = tempfile.mkdtemp(prefix='benchmark_input_')
+			try:
+				for residues in args.residues:
+					pdb_file, conservations_file, _ = SyntheticInputsGenerator(residues, args.chains, seed=args.seed).write(input_path)
+					results += self.run_structure(pdb_file, conservations_file, args)
+			finally:
+				shutil.rmtree(input_path, ignore_errors=True)
+		self.print_results(results)
+
+		if args.json:
+			with open(args.json, 'w') as fl:
+				json.dump(results, fl, indent=1)
+
+if __name__ == "__main__":
+	neighborGraphBenchmarkObj = NeighborGraphBenchmark()
+	neighborGraphBenchmarkObj.main()
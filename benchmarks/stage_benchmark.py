@@ -0,0 +1,166 @@
+import argparse
+import importlib.util
+import json
+import logging
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from synthetic_inputs import SyntheticInputsGenerator
+from pipeline_starter import PipelineStarter
+from pdb_parser import StructureContext
+from accessibility_scorer import AccessibilityScorer
+from domains_splitter import AlphafoldDomainsSplitter
+#the pipeline imports these stages when they run, import them here so that the first timings do not include it
+import patch_evaluator
+import result_store
+
+class StageBenchmark:
+	"""
+	Times every pipeline stage on its own and the whole pipeline end to end, on synthetic inputs of increasing size.
+	Every input size is generated once, every stage runs on the output of the previous stages, and the median of the repeats is reported.
+	"""
+
+	def get_parsed_args(self):
+		parser = argparse.ArgumentParser(description='Time the pipeline stages on synthetic inputs of increasing size.')
+		parser.add_argument('--residues', type=int, nargs='+', default=[500, 1000, 2000], help='Numbers of residues per chain to run. (default: 500 1000 2000)')
+		parser.add_argument('--chains', type=int, nargs='+', default=[1], help='Numbers of chains to run. (default: 1)')
+		parser.add_argument('--domain_size', type=int, default=250, help='Number of residues per domain of the synthetic structures. (default: 250)')
+		parser.add_argument('--number_of_iterations', type=int, default=20, help='Maximum number of iterations per chain/domain. (default: 20)')
+		parser.add_argument('--workers', type=int, default=1, help='Number of worker processes of the end to end run. (default: 1)')
+		parser.add_argument('--repeat', type=int, default=3, help='Number of runs of every stage, the median is reported. (default: 3)')
+		parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic inputs. (default: 0)')
+		parser.add_argument('--input', type=str, default=None, help='Directory where the synthetic inputs are written and kept. (default: a temporary directory)')
+		parser.add_argument('--json', type=str, default=None, help='Save the results in this JSON file.')
+		parser.add_argument('--baseline', type=str, default=None, help='JSON results of a previous run, exit with an error if a stage became slower than it.')
+		parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed relative slow-down against the baseline. (default: 0.25)')
+		parser.add_argument('--min_slowdown', type=float, default=0.05, help='Slow-downs under this many seconds are ignored as noise. (default: 0.05)')
+		return parser.parse_args()
+
+	def time_stage(self, stage, repeat, prepare=None):
+		"""
+		Returns the median and the minimum wall time of the stage function, and its result.
+			:param prepare: optional function run before every repeat and not timed, its result is passed to the stage.
+		"""
+		times = []
+		for _ in range(repeat):
+			prepared = prepare() if prepare else None
+			start = time.perf_counter()
+			result = stage(prepared) if prepare else stage()
+			times.append(time.perf_counter() - start)
+		return statistics.median(times), min(times), result
+
+	def get_pipeline_args(self, input_path, output_path, pdb_file, conservations_file, pae_file, number_of_iterations, workers):
+		parser = argparse.ArgumentParser()
+		pipelineStarterObj = PipelineStarter()
+		pipelineStarterObj.add_pipeline_arguments(parser)
+		args = parser.parse_args(['--input', input_path, '--output', output_path, '--pdb_file', os.path.basename(pdb_file), '--conservations_file', os.path.basename(conservations_file),
+			'--predicted_aligned_error_file', os.path.basename(pae_file), '--number_of_iterations', str(number_of_iterations), '--workers', str(workers),
+			'--cache_size', '0', '--create_pymol_session', 'false'])
+		pipelineStarterObj.check_args(args)
+		return args
+
+	def run_size(self, residues, chains, args, input_path):
+		"""
+		Generates the inputs of one size and returns the timings of its stages.
+		"""
+		pdb_file, conservations_file, pae_file = SyntheticInputsGenerator(residues, chains, args.domain_size, args.seed).write(input_path)
+		pipelineStarterObj = PipelineStarter()
+		splitterObj = AlphafoldDomainsSplitter()
+		pae_cache_file = splitterObj.get_pae_cache_file(pae_file)
+		timings = {}
+
+		def remove_pae_cache():
+			if os.path.exists(pae_cache_file):
+				os.remove(pae_cache_file)
+
+		timings['read_structure'] = self.time_stage(lambda: StructureContext(pdb_file), args.repeat)
+		structure_context = timings['read_structure'][2]
+		atoms = len(structure_context.model)
+
+		#the domains splitter keeps a .npy copy of the matrix for later runs, remove it to time the JSON parsing
+		timings['split_domains'] = self.time_stage(lambda _: splitterObj.domains_from_pae_matrix_louvain(pae_file, structure_context.atoms), args.repeat, remove_pae_cache)
+		domains = timings['split_domains'][2] or [None]
+		timings['split_domains_cached_pae'] = self.time_stage(lambda: splitterObj.domains_from_pae_matrix_louvain(pae_file, structure_context.atoms), args.repeat)
+
+		units = [(pdb_chain, domain) for pdb_chain in structure_context.get_chain_ids() for domain in domains]
+		timings['clean_coordinates'] = self.time_stage(lambda: [structure_context.get_clean_coordinates(pdb_chain, domain) for pdb_chain, domain in units], args.repeat)
+		if importlib.util.find_spec('Bio') is not None:
+			#the Biopython reader and cleaner, which StructureContext replaces in the pipeline
+			from bio_pdb_parser import read_clean_pdb
+			timings['read_clean_pdb'] = self.time_stage(lambda: [read_clean_pdb(pdb_file, pdb_chain, domain) for pdb_chain, domain in units], args.repeat)
+
+		unit_coordinates = timings['clean_coordinates'][2]
+		timings['accessibility'] = self.time_stage(lambda: [AccessibilityScorer(coords, atm_keys).get_accessible_residues_and_their_neighbors() for coords, atm_keys in unit_coordinates], args.repeat)
+		accessibility_data = pipelineStarterObj.get_accessibility(structure_context, domains)
+
+		#the centrality stage adds the scores to the residue tables, so every repeat starts from new tables
+		timings['centrality'] = self.time_stage(lambda merged_data: pipelineStarterObj.run_centrality_iterations(merged_data, args.number_of_iterations) or merged_data, args.repeat,
+			lambda: pipelineStarterObj.merge_conservations(conservations_file, accessibility_data))
+		merged_data = timings['centrality'][2]
+		timings['patch_evaluation'] = self.time_stage(lambda: pipelineStarterObj.run_patch_evaluation(merged_data, args.number_of_iterations), args.repeat)
+
+		output_path = tempfile.mkdtemp(prefix='benchmark_output_')
+		try:
+			def run_pipeline(_):
+				run_path = tempfile.mkdtemp(dir=output_path)
+				PipelineStarter().run(self.get_pipeline_args(input_path, output_path, pdb_file, conservations_file, pae_file, args.number_of_iterations, args.workers), run_path)
+			timings['end_to_end'] = self.time_stage(run_pipeline, args.repeat, remove_pae_cache)
+		finally:
+			shutil.rmtree(output_path, ignore_errors=True)
+		remove_pae_cache()
+
+		return [{'residues': residues, 'chains': chains, 'atoms': atoms, 'units': len(units), 'stage': stage, 'seconds': median, 'min_seconds': minimum} for stage, (median, minimum, _) in timings.items()]
+
+	def print_results(self, results):
+		print('%9s %7s %9s %6s  %-25s %10s %10s' % ('residues', 'chains', 'atoms', 'units', 'stage', 'seconds', 'min'))
+		for result in results:
+			print('%9d %7d %9d %6d  %-25s %10.3f %10.3f' % (result['residues'], result['chains'], result['atoms'], result['units'], result['stage'], result['seconds'], result['min_seconds']))
+
+	def compare(self, results, baseline, tolerance, min_slowdown):
+		"""
+		Returns the (size, stage) results which became slower than the baseline.
+		"""
+		baseline_seconds = {(result['residues'], result['chains'], result['stage']): result['seconds'] for result in baseline}
+		regressions = []
+		for result in results:
+			before = baseline_seconds.get((result['residues'], result['chains'], result['stage']))
+			if before is not None and result['seconds'] - before > min_slowdown and result['seconds'] > before*(1 + tolerance):
+				regressions.append((result, before))
+		return regressions
+
+	def main(self):
+		args = self.get_parsed_args()
+		logging.basicConfig(level=logging.WARNING, format='%(levelname)s: %(message)s')
+		input_path = args.input or tempfile.mkdtemp(prefix='benchmark_input_')
+		results = []
+		try:
+			for chains in args.chains:
+				for residues in args.residues:
+					results += self.run_size(residues, chains, args, input_path)
+		finally:
+			if not args.input:
+				shutil.rmtree(input_path, ignore_errors=True)
+		self.print_results(results)
+
+		if args.json:
+			with open(args.json, 'w') as fl:
+				json.dump(results, fl, indent=1)
+
+		if args.baseline:
+			with open(args.baseline) as fl:
+				baseline = json.load(fl)
+			regressions = self.compare(results, baseline, args.tolerance, args.min_slowdown)
+			for result, before in regressions:
+				print('REGRESSION: %s of %d residues x %d chains takes %.3f s, it took %.3f s in the baseline' % (result['stage'], result['residues'], result['chains'], result['seconds'], before))
+			if regressions:
+				sys.exit(1)
+
+if __name__ == "__main__":
+	stageBenchmarkObj = StageBenchmark()
+	stageBenchmarkObj.main()
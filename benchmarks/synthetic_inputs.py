@@ -0,0 +1,196 @@
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from accessibility_scorer import rad_siz
+
+#the heavy atoms of every residue type, in the order of the radii table
+residue_atoms = {}
+for residue_atom in rad_siz:
+	residue_atoms.setdefault(residue_atom[:3], []).append(residue_atom[3:])
+residue_names = sorted(residue_atoms)
+
+#volume per residue of a folded domain, in cubic angstroms
+residue_volume = 130
+ca_distance = 3.8
+linker_length = 10
+chains_spacing = 50
+
+class SyntheticInputsGenerator():
+	"""
+	Generates a synthetic AlphaFold-like input set of any size: a structure of globular domains joined by linkers (in PDB format), its predicted aligned error
+	matrix (low within the domains, high between them) and a conservations file with conserved surface regions on every domain.
+	The chains are copies of the same fold placed apart, and the same seed gives the same files.
+	"""
+
+	def __init__(self, residues, chains=1, domain_size=250, seed=0, integer_pae=False):
+		"""
+			:param residues: number of residues per chain.
+			:param chains: number of chains.
+			:param domain_size: number of residues per globular domain, the residues between domains are linkers.
+			:param seed: seed of the random generator.
+			:param integer_pae: write the predicted aligned error as integers with a 0 diagonal, like the older files of the AlphaFold database.
+		"""
+		self.residues = residues
+		self.chains = chains
+		self.domain_size = domain_size
+		self.integer_pae = integer_pae
+		self.rng = np.random.default_rng(seed)
+		self.domain_labels = self.get_domain_labels()
+		self.ca, self.centers = self.get_ca_trace()
+
+	def get_domain_labels(self):
+		"""
+		Returns the domain index of every residue of a chain, -1 for the linker residues.
+		"""
+		labels = np.full(self.residues, -1)
+		domain_indx = 0
+		start = 0
+		while start < self.residues:
+			stop = min(start + self.domain_size, self.residues)
+			labels[start:stop] = domain_indx
+			domain_indx += 1
+			start = stop + linker_length
+		return labels
+
+	def random_directions(self, count):
+		directions = self.rng.normal(size=(count, 3))
+		return directions/np.linalg.norm(directions, axis=1, keepdims=True)
+
+	def get_ca_trace(self):
+		"""
+		Returns the CA coordinates of a chain and the center of the domain (or linker) of every residue. Every domain is a random walk confined
+		to a sphere of the volume of its residues, and the domains are placed one after the other along the x axis.
+		"""
+		ca = np.zeros((self.residues, 3))
+		centers = np.zeros((self.residues, 3))
+		position = np.zeros(3)
+		domain_center = None
+		for i in range(self.residues):
+			label = self.domain_labels[i]
+			if label >= 0 and (i == 0 or self.domain_labels[i-1] != label):
+				size = (self.domain_labels == label).sum()
+				radius = (3*residue_volume*size/(4*np.pi))**(1/3)
+				domain_center = position + np.array([radius, 0, 0])
+			if label < 0:
+				#the linkers head along the x axis to the next domain
+				step = np.array([ca_distance, 0, 0]) + self.rng.normal(scale=0.5, size=3)
+				position = position + step/np.linalg.norm(step)*ca_distance
+				centers[i] = position
+			else:
+				size = (self.domain_labels == label).sum()
+				radius = (3*residue_volume*size/(4*np.pi))**(1/3)
+				if i > 0 and self.domain_labels[i-1] == label:
+					#take the first random step which stays in the sphere and does not fold back on the previous residue
+					candidates = position + self.random_directions(32)*ca_distance
+					valid = np.linalg.norm(candidates - domain_center, axis=1) <= radius
+					if i > 1:
+						valid &= np.linalg.norm(candidates - ca[i-2], axis=1) >= 4.5
+					position = candidates[np.argmax(valid)] if valid.any() else position + (domain_center - position)/np.linalg.norm(domain_center - position)*ca_distance
+				else:
+					position = domain_center + self.random_directions(1)[0]*radius*0.9
+				centers[i] = domain_center
+			ca[i] = position
+		return ca, centers
+
+	def get_chain_atoms(self, ca, centers):
+		"""
+		Returns the residue names and the (name, coordinates) atoms of every residue: the backbone around the CA, and the side chain
+		pointing away from the domain center.
+		"""
+		names = self.rng.choice(residue_names, size=self.residues)
+		residues = []
+		for i in range(self.residues):
+			outward = ca[i] - centers[i]
+			norm = np.linalg.norm(outward)
+			outward = outward/norm if norm > 0 else self.random_directions(1)[0]
+			backbone = self.random_directions(2)
+			atoms = [('N', ca[i] + backbone[0]*1.46), ('CA', ca[i]), ('C', ca[i] + backbone[1]*1.52), ('O', ca[i] + backbone[1]*2.4 + self.rng.normal(scale=0.3, size=3))]
+			side_chain = [atom for atom in residue_atoms[names[i]] if atom not in ('N', 'CA', 'C', 'O')]
+			direction = outward + self.rng.normal(scale=0.4, size=3)
+			direction = direction/np.linalg.norm(direction)
+			for atom_indx, atom in enumerate(side_chain):
+				atoms.append((atom, ca[i] + direction*1.5*(atom_indx+1) + self.rng.normal(scale=0.3, size=3)))
+			residues.append(atoms)
+		return names, residues
+
+	def write_structure(self, pdb_file):
+		names, residues = self.get_chain_atoms(self.ca, self.centers)
+		#AlphaFold keeps the pLDDT in the B-factor column, the domains splitter uses it to weight the residues
+		plddt = np.where(self.domain_labels >= 0, 90.0, 40.0)
+		serial = 1
+		with open(pdb_file, 'w') as fl:
+			for chain_indx in range(self.chains):
+				chain_id = chr(ord('A') + chain_indx)
+				offset = np.array([0, chain_indx*(2*(3*residue_volume*self.domain_size/(4*np.pi))**(1/3) + chains_spacing), 0])
+				for i, atoms in enumerate(residues):
+					for atom, coord in atoms:
+						x, y, z = coord + offset
+						atom_name = atom if len(atom) == 4 else ' ' + atom
+						fl.write('ATOM  %5d %-4s %3s %1s%4d    %8.3f%8.3f%8.3f%6.2f%6.2f          %2s\n' % (serial, atom_name, names[i], chain_id, i+1, x, y, z, 1.0, plddt[i], atom[0]))
+						serial += 1
+				fl.write('TER'.ljust(80) + '\n')
+			fl.write('END'.ljust(80) + '\n')
+
+	def write_predicted_aligned_error(self, pae_file):
+		labels = self.domain_labels
+		same_domain = (labels[:, None] == labels[None, :]) & (labels[:, None] >= 0)
+		pae = np.where(same_domain, self.rng.uniform(0.5, 4, size=same_domain.shape), self.rng.uniform(15, 30, size=same_domain.shape))
+		if self.integer_pae:
+			np.fill_diagonal(pae, 0)
+			values = np.round(pae).astype(int).tolist()
+		else:
+			#AlphaFold reports a small error on the diagonal too
+			np.fill_diagonal(pae, 0.2)
+			values = np.round(pae, 2).tolist()
+		with open(pae_file, 'w') as fl:
+			json.dump([{'predicted_aligned_error': values, 'max_predicted_aligned_error': 31.75}], fl)
+
+	def write_conservations(self, conservations_file):
+		"""
+		Writes the conservations in the format of SLiM tools: a background of low scores, and three conserved regions around surface residues of every domain.
+		The chains have the same scores, under their chain ids when there is more than one chain.
+		"""
+		scores = self.rng.beta(2, 5, size=self.residues)
+		for label in range(self.domain_labels.max() + 1):
+			members = np.flatnonzero(self.domain_labels == label)
+			for center in self.rng.choice(members, size=min(3, len(members)), replace=False):
+				distance = np.linalg.norm(self.ca[members] - self.ca[center], axis=1)
+				scores[members] = np.maximum(scores[members], 0.9*np.exp(-distance**2/(2*6**2)) + self.rng.uniform(0, 0.1, size=len(members)))
+		chain_scores = {str(i+1): float(score) for i, score in enumerate(scores)}
+		data = chain_scores if self.chains == 1 else {chr(ord('A') + chain_indx): chain_scores for chain_indx in range(self.chains)}
+		with open(conservations_file, 'w') as fl:
+			json.dump({'status': 'Success', 'data': data}, fl)
+
+	def write(self, output_path, name=None):
+		"""
+		Writes <name>.pdb, <name>.conservations.json and <name>.predicted_aligned_error.json into the output directory and returns their paths.
+		"""
+		name = name or 'synthetic_%dx%d' % (self.residues, self.chains)
+		os.makedirs(output_path, exist_ok=True)
+		pdb_file = os.path.join(output_path, name + '.pdb')
+		conservations_file = os.path.join(output_path, name + '.conservations.json')
+		pae_file = os.path.join(output_path, name + '.predicted_aligned_error.json')
+		self.write_structure(pdb_file)
+		self.write_predicted_aligned_error(pae_file)
+		self.write_conservations(conservations_file)
+		return pdb_file, conservations_file, pae_file
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Generate a synthetic structure, predicted aligned error and conservations file for benchmarks.')
+	parser.add_argument('--residues', type=int, default=1000, help='Number of residues per chain. (default: 1000)')
+	parser.add_argument('--chains', type=int, default=1, help='Number of chains. (default: 1)')
+	parser.add_argument('--domain_size', type=int, default=250, help='Number of residues per domain. (default: 250)')
+	parser.add_argument('--seed', type=int, default=0, help='Seed of the random generator. (default: 0)')
+	parser.add_argument('--integer_pae', action='store_true', help='Write the predicted aligned error as integers with a 0 diagonal, like the older files of the AlphaFold database.')
+	parser.add_argument('--output', type=str, required=True, help='Directory where the files are written, e.g. a temporary directory (the files are large, and the input directory is shared with real runs).')
+	args = parser.parse_args()
+
+	syntheticInputsGeneratorObj = SyntheticInputsGenerator(args.residues, args.chains, args.domain_size, args.seed, args.integer_pae)
+	for file_path in syntheticInputsGeneratorObj.write(args.output):
+		print(file_path)
@@ -1,5 +1,5 @@
-from scipy.spatial.distance import euclidean
 from scipy.spatial import Delaunay
+from collections import deque
 
 import numpy as np
 
@@ -7,58 +7,59 @@ import numpy as np
 #Detection of Functionally Important Regions in “Hypothetical Proteins” of Known Structure
 
 rad_siz = {'ALAN':1.65, 'ALACA':1.87, 'ALAC':1.76, 'ALAO':1.40, 'ALACB':1.87, 'ARGN':1.65, 'ARGCA':1.87, 'ARGC':1.76, 'ARGO':1.40, 'ARGCB':1.87, 'ARGCG':1.87, 'ARGCD':1.87, 'ARGNE':1.65, 'ARGCZ':1.76, 'ARGNH1': 1.65, 'ARGNH2': 1.65, 'ASPN':1.65, 'ASPCA':1.87, 'ASPC':1.76, 'ASPO':1.40, 'ASPCB':1.87, 'ASPCG':1.76, 'ASPOD1': 1.40, 'ASPOD2': 1.40, 'ASNN':1.65, 'ASNCA':1.87, 'ASNC':1.76, 'ASNO':1.40, 'ASNCB':1.87, 'ASNCG':1.76, 'ASNOD1': 1.40, 'ASNND2': 1.65, 'CYSN':1.65, 'CYSCA':1.87, 'CYSC':1.76, 'CYSO':1.40, 'CYSCB':1.87, 'CYSSG':1.85, 'GLUN':1.65, 'GLUCA':1.87, 'GLUC':1.76, 'GLUO':1.40, 'GLUCB':1.87, 'GLUCG':1.87, 'GLUCD':1.76, 'GLUOE1': 1.40, 'GLUOE2': 1.40, 'GLNN':1.65, 'GLNCA':1.87, 'GLNC':1.76, 'GLNO':1.40, 'GLNCB':1.87, 'GLNCG':1.87, 'GLNCD':1.76, 'GLNOE1': 1.40, 'GLNNE2': 1.65, 'GLYN':1.65, 'GLYCA':1.87, 'GLYC':1.76, 'GLYO':1.40, 'HISN':1.65, 'HISCA':1.87, 'HISC':1.76, 'HISO':1.40, 'HISCB':1.87, 'HISCG':1.76, 'HISND1': 1.65, 'HISCD2': 1.76, 'HISCE1': 1.76, 'HISNE2': 1.65, 'ILEN':1.65, 'ILECA':1.87, 'ILEC':1.76, 'ILEO':1.40, 'ILECB':1.87, 'ILECG1': 1.87, 'ILECG2': 1.87, 'ILECD1': 1.87, 'LEUN':1.65, 'LEUCA':1.87, 'LEUC':1.76, 'LEUO':1.40, 'LEUCB':1.87, 'LEUCG':1.87, 'LEUCD1': 1.87, 'LEUCD2': 1.87, 'LYSN':1.65, 'LYSCA':1.87, 'LYSC':1.76, 'LYSO':1.40, 'LYSCB':1.87, 'LYSCG':1.87, 'LYSCD':1.87, 'LYSCE':1.87, 'LYSNZ':1.50, 'METN':1.65, 'METCA':1.87, 'METC':1.76, 'METO':1.40, 'METCB':1.87, 'METCG':1.87, 'METSD':1.85, 'METCE':1.87, 'PHEN':1.65, 'PHECA':1.87, 'PHEC':1.76, 'PHEO':1.40, 'PHECB':1.87, 'PHECG':1.76, 'PHECD1': 1.76, 'PHECD2': 1.76, 'PHECE1': 1.76, 'PHECE2': 1.76, 'PHECZ':1.76, 'PRON':1.65, 'PROCA':1.87, 'PROC':1.76, 'PROO':1.40, 'PROCB':1.87, 'PROCG':1.87, 'PROCD':1.87, 'SERN':1.65, 'SERCA':1.87, 'SERC':1.76, 'SERO':1.40, 'SERCB':1.87, 'SEROG':1.40, 'THRN':1.65, 'THRCA':1.87, 'THRC':1.76, 'THRO':1.40, 'THRCB':1.87, 'THROG1': 1.40, 'THRCG2': 1.87, 'TRPN':1.65, 'TRPCA':1.87, 'TRPC':1.76, 'TRPO':1.40, 'TRPCB':1.87, 'TRPCG':1.76, 'TRPCD1': 1.76, 'TRPCD2': 1.76, 'TRPNE1': 1.65, 'TRPCE2': 1.76, 'TRPCE3': 1.76, 'TRPCZ2': 1.76, 'TRPCZ3': 1.76, 'TRPCH2': 1.76, 'TYRN':1.65, 'TYRCA':1.87, 'TYRC':1.76, 'TYRO':1.40, 'TYRCB':1.87, 'TYRCG':1.76, 'TYRCD1': 1.76, 'TYRCD2': 1.76, 'TYRCE1': 1.76, 'TYRCE2': 1.76, 'TYRCZ':1.76, 'TYROH':1.40, 'VALN':1.65, 'VALCA':1.87, 'VALC':1.76, 'VALO':1.40, 'VALCB':1.87, 'VALCG1': 1.87, 'VALCG2': 1.87}
+#the four faces of a sorted tetrahedron, in the order of the dropped vertex (0, 1, 2, 3)
+face_vertices = np.array([[1, 2, 3], [0, 2, 3], [0, 1, 3], [0, 1, 2]])
+
 class AccessibilityScorer():
 	def __init__(self, coords, atm_keys):
-		self.faces = {}
-		self.faces_tetrahedrons1 = {}
-		self.faces_tetrahedrons2 = {}
-		self.removed_faces = {}
+		#face table: one row per unique triangle (sorted int32 vertex triple), in order of first appearance
+		self.faces = None
+		self.faces_count = None
+		self.faces_tetrahedrons1 = None
+		self.faces_tetrahedrons2 = None
+		self.removed_faces = None
+		#the four face ids of every tetrahedron
+		self.tetrahedrons_faces = None
+		#sizes of the last run, reported by get_stats
+		self.peeled_tetrahedrons = 0
+		self.peeling_steps = 0
 		
 		self.coords = coords
 		self.atm_keys = atm_keys
+		
+		#split the atom keys once: residue key, residue name and atom name of every atom
+		atm_fields = [atm_key.split('_') for atm_key in atm_keys]
+		self.res_keys = [fields[0] for fields in atm_fields]
+		self.atm_names = [fields[2] for fields in atm_fields]
+		self.radii = np.array([rad_siz.get(fields[1]+fields[2], 1.7) for fields in atm_fields])
+	
+	def set_coordinates(self, coords):
+		"""
+		Replaces the coordinates with those of another frame of the same atoms, keeping the atom keys, residue keys and radii.
+		"""
+		if len(coords) != len(self.atm_keys):
+			raise ValueError('the frame has %d atoms, the topology has %d.' % (len(coords), len(self.atm_keys)))
+		self.coords = coords
 	
 	def get_accessible_residues_and_their_neighbors(self):
 		
 		accessible_residues = {}
 		direct_neighbors = {}
 		tri = Delaunay(self.coords)
-		updated_cavity_set = True
-		
-		for indx, tetrahedron in enumerate(tri.simplices):
-			tetrahedron.sort()
-			for i in range(4):
-				mask = np.ones(4, np.bool)
-				mask[i] = 0
-				self.fill_data_dicts(" ".join(np.char.mod('%d', tetrahedron[mask])), indx)
-		
-		while updated_cavity_set:
-			updated_cavity_set = False
-			for face, num_tetrahedrons in self.faces.items():
-				if num_tetrahedrons == 1:
-					a, b, c = face.split()
-					if self.VDW_distance(a, b) >=2.8 or self.VDW_distance(a, c) >= 2.8 or self.VDW_distance(c, b) >= 2.8:
-						tetrahedron = tri.simplices[self.faces_tetrahedrons1[face]]
-						tetrahedron_indx = self.faces_tetrahedrons1[face]
-						for i in range(4):
-							mask = np.ones(4, np.bool)
-							mask[i] = 0
-							self.update_data_dicts(" ".join(np.char.mod('%d', tetrahedron[mask])), tetrahedron_indx)
-						updated_cavity_set = True
-		
-		for face, num_tetrahedrons in self.faces.items():
-			if num_tetrahedrons == 1 or self.removed_faces[face] == 1:
-				a, b, c = face.split()
-				self.add_accessible_atm(a, accessible_residues)
-				self.add_accessible_atm(b, accessible_residues)
-				self.add_accessible_atm(c, accessible_residues)
+		
+		self.build_face_table(tri.simplices)
+		self.peel_cavities()
+		
+		for a, b, c in self.faces[(self.faces_count == 1) | self.removed_faces].tolist():
+			self.add_accessible_atm(a, accessible_residues)
+			self.add_accessible_atm(b, accessible_residues)
+			self.add_accessible_atm(c, accessible_residues)
 		
 		#get tri direct neighbors
-		for face, num_tetrahedrons in self.faces.items():
-			if num_tetrahedrons == 1:
-				a, b, c = face.split()
-				self.connect_neighbor_atms(a, b, direct_neighbors)
-				self.connect_neighbor_atms(a, c, direct_neighbors)
-				self.connect_neighbor_atms(b, c, direct_neighbors)
+		for a, b, c in self.faces[self.faces_count == 1].tolist():
+			self.connect_neighbor_atms(a, b, direct_neighbors)
+			self.connect_neighbor_atms(a, c, direct_neighbors)
+			self.connect_neighbor_atms(b, c, direct_neighbors)
 				
 		#sets to lists to make them compatible with json format
 		for res_key in accessible_residues:
@@ -68,34 +69,93 @@ class AccessibilityScorer():
 		
 		return accessible_residues, direct_neighbors
 
-	def fill_data_dicts(self, face, indx):
-		if face in self.faces:
-	   		self.faces[face]+=1
-	   		self.faces_tetrahedrons2[face] = indx
+	def build_face_table(self, simplices):
+		simplices = np.sort(simplices, axis=1).astype(np.int32)
+		num_tetrahedrons = len(simplices)
+		all_faces = simplices[:, face_vertices].reshape(-1, 3)
+		owners = np.repeat(np.arange(num_tetrahedrons, dtype=np.int32), 4)
+		
+		#deduplicate the faces in bulk through a single int64 key per sorted vertex triple (the vertices are cast first, the int32
+		#products would wrap), or through the vertex triples themselves when the keys of that many atoms do not fit in int64
+		n = len(self.coords)
+		if n**3 <= np.iinfo(np.int64).max:
+			vertices = all_faces.astype(np.int64)
+			face_keys = (vertices[:, 0]*n + vertices[:, 1])*n + vertices[:, 2]
+			_, first, inverse, counts = np.unique(face_keys, return_index=True, return_inverse=True, return_counts=True)
 		else:
-	   		self.faces[face]=1
-	   		self.faces_tetrahedrons1[face] = indx
-	   		self.faces_tetrahedrons2[face] = -1
-	   		self.removed_faces[face] = 0
-
-	def VDW_rad(self, indx):
-		res_key, res_name, atm = self.atm_keys[int(indx)].split('_')
-		rad_key = res_name+atm
-		return rad_siz[rad_key] if rad_key in rad_siz else 1.7
+			_, first, inverse, counts = np.unique(all_faces, axis=0, return_index=True, return_inverse=True, return_counts=True)
+		
+		#keep the faces in order of their first appearance in the triangulation
+		order = np.argsort(first, kind='stable')
+		rank = np.empty_like(order)
+		rank[order] = np.arange(len(order))
+		face_ids = rank[inverse.ravel()].astype(np.int32)
 		
-	def VDW_distance(self, atm1_indx, atm2_indx):
-		return euclidean(self.coords[int(atm1_indx)], self.coords[int(atm2_indx)])-self.VDW_rad(atm1_indx)-self.VDW_rad(atm2_indx)
+		self.faces = all_faces[first[order]]
+		self.faces_count = counts[order].astype(np.int8)
+		self.faces_tetrahedrons1 = owners[first[order]]
+		self.faces_tetrahedrons2 = np.full(len(order), -1, dtype=np.int32)
+		second_owner = np.ones(len(all_faces), dtype=bool)
+		second_owner[first] = False
+		self.faces_tetrahedrons2[face_ids[second_owner]] = owners[second_owner]
+		self.removed_faces = np.zeros(len(order), dtype=bool)
+		self.tetrahedrons_faces = face_ids.reshape(num_tetrahedrons, 4)
+
+	def VDW_gaps(self):
+		"""
+		Flags the faces having at least one edge with a VDW gap (distance minus both VDW radii) of 2.8 or more
+		"""
+		has_gap = np.zeros(len(self.faces), dtype=bool)
+		for atm1, atm2 in ((0, 1), (0, 2), (2, 1)):
+			a, b = self.faces[:, atm1], self.faces[:, atm2]
+			distance = np.linalg.norm(self.coords[a]-self.coords[b], axis=1)
+			has_gap |= distance-self.radii[a]-self.radii[b] >= 2.8
+		return has_gap
+
+	def peel_cavities(self):
+		"""
+		Removes tetrahedrons reachable from the outside through faces with a VDW gap.
+		Only the faces exposed by the last removed tetrahedron are revisited.
+		"""
+		has_gap = self.VDW_gaps()
+		queue = deque(np.flatnonzero((self.faces_count == 1) & has_gap))
+		self.peeled_tetrahedrons = 0
+		self.peeling_steps = 0
+		while queue:
+			face = queue.popleft()
+			self.peeling_steps += 1
+			if self.faces_count[face] != 1:
+				continue
+			tetrahedron_indx = self.faces_tetrahedrons1[face]
+			self.peeled_tetrahedrons += 1
+			for tetrahedron_face in self.tetrahedrons_faces[tetrahedron_indx]:
+				self.update_data_dicts(tetrahedron_face, tetrahedron_indx)
+				if self.faces_count[tetrahedron_face] == 1 and has_gap[tetrahedron_face]:
+					queue.append(tetrahedron_face)
+
+	def get_stats(self):
+		"""
+		Returns the sizes of the last accessibility run: atoms, tetrahedrons and faces of the triangulation, the peeled tetrahedrons
+		and the peeling steps (exposed faces taken from the peeling queue).
+		"""
+		return {
+			'atoms': len(self.coords),
+			'tetrahedrons': len(self.tetrahedrons_faces) if self.tetrahedrons_faces is not None else 0,
+			'faces': len(self.faces) if self.faces is not None else 0,
+			'peeled_tetrahedrons': self.peeled_tetrahedrons,
+			'peeling_steps': self.peeling_steps,
+		}
 
 	def update_data_dicts(self, face, indx):
-		self.faces[face]-=1
-		if self.faces[face] == 0:
-			self.removed_faces[face] = 1
+		self.faces_count[face]-=1
+		if self.faces_count[face] == 0:
+			self.removed_faces[face] = True
 		if self.faces_tetrahedrons1[face] == indx:
 			self.faces_tetrahedrons1[face] = self.faces_tetrahedrons2[face]
 
 	def add_accessible_atm(self, atm_indx, accessible_residues):
-		atm_key = self.atm_keys[int(atm_indx)]
-		res_key, res_name, atm = atm_key.split('_')
+		res_key = self.res_keys[atm_indx]
+		atm = self.atm_names[atm_indx]
 		if res_key not in accessible_residues:
 			accessible_residues[res_key] = {}
 			accessible_residues[res_key]['accessible_atms'] = set()
@@ -107,10 +167,8 @@ class AccessibilityScorer():
 			accessible_residues[res_key]['side_chain_score'] = 1
 
 	def connect_neighbor_atms(self, atm1_indx, atm2_indx, direct_neighbors):
-		atm1_key = self.atm_keys[int(atm1_indx)]
-		res1_key, res1_name, atm1 = atm1_key.split('_')
-		atm2_key = self.atm_keys[int(atm2_indx)]
-		res2_key, res2_name, atm2 = atm2_key.split('_')
+		res1_key = self.res_keys[atm1_indx]
+		res2_key = self.res_keys[atm2_indx]
 		if res1_key != res2_key:
 			if res1_key not in direct_neighbors:
 				direct_neighbors[res1_key] = set()
@@ -118,3 +176,81 @@ class AccessibilityScorer():
 			if res2_key not in direct_neighbors:
 				direct_neighbors[res2_key] = set()
 			direct_neighbors[res2_key].add(res1_key)
+
+class AssemblyAccessibilityScorer(AccessibilityScorer):
+	"""
+	Calculates the accessibility of all the chains/domains of an assembly from one triangulation of all their atoms, in two views sharing its face table.
+	The in-context view peels the whole triangulation, so the surfaces buried between chains (or domains) are not accessible. The isolated view peels
+	only the tetrahedrons whose four atoms belong to the same chain/domain; they are the part of the triangulation of the chain/domain on its own which
+	the other chains do not cross, so it approximates separate runs of every chain/domain (exactly for a single chain/domain).
+	"""
+	def __init__(self, coords, atm_keys, atm_units, number_of_units):
+		"""
+			:param atm_units: the chain/domain index of every atom, -1 for the atoms which belong to none (e.g. linkers between domains), which only cover the others.
+			:param number_of_units: number of chains/domains.
+		"""
+		super().__init__(coords, atm_keys)
+		self.atm_units = np.asarray(atm_units)
+		self.number_of_units = number_of_units
+	
+	def get_accessible_residues_and_their_neighbors_per_unit(self):
+		"""
+		Returns the in-context and the isolated views, each a list of the (accessible_residues, direct_neighbors) of every chain/domain.
+		"""
+		tri = Delaunay(self.coords)
+		self.build_face_table(tri.simplices)
+		
+		self.peel_cavities()
+		in_context = self.get_unit_surfaces()
+		
+		tetrahedrons_units = self.atm_units[tri.simplices]
+		single_unit = (tetrahedrons_units == tetrahedrons_units[:, :1]).all(axis=1) & (tetrahedrons_units[:, 0] >= 0)
+		self.keep_tetrahedrons(single_unit)
+		self.peel_cavities()
+		isolated = self.get_unit_surfaces()
+		return in_context, isolated
+	
+	def keep_tetrahedrons(self, keep):
+		"""
+		Resets the face counts and owners of the face table to the kept tetrahedrons only, as if the others were not in the triangulation.
+		"""
+		kept = np.flatnonzero(keep).astype(np.int32)
+		kept_faces = self.tetrahedrons_faces[kept].ravel()
+		owners = np.repeat(kept, 4)
+		order = np.argsort(kept_faces, kind='stable')
+		sorted_faces = kept_faces[order]
+		first = np.ones(len(order), dtype=bool)
+		first[1:] = sorted_faces[1:] != sorted_faces[:-1]
+		
+		self.faces_count = np.bincount(kept_faces, minlength=len(self.faces)).astype(np.int8)
+		self.faces_tetrahedrons1 = np.full(len(self.faces), -1, dtype=np.int32)
+		self.faces_tetrahedrons2 = np.full(len(self.faces), -1, dtype=np.int32)
+		self.faces_tetrahedrons1[sorted_faces[first]] = owners[order][first]
+		self.faces_tetrahedrons2[sorted_faces[~first]] = owners[order][~first]
+		self.removed_faces = np.zeros(len(self.faces), dtype=bool)
+	
+	def get_unit_surfaces(self):
+		"""
+		Returns the (accessible_residues, direct_neighbors) of every chain/domain from the current state of the face table. Only residues of the same
+		chain/domain are direct neighbors.
+		"""
+		accessible_residues = [{} for _ in range(self.number_of_units)]
+		direct_neighbors = [{} for _ in range(self.number_of_units)]
+		atm_units = self.atm_units.tolist()
+		
+		for face in self.faces[(self.faces_count == 1) | self.removed_faces].tolist():
+			for atm_indx in face:
+				if atm_units[atm_indx] >= 0:
+					self.add_accessible_atm(atm_indx, accessible_residues[atm_units[atm_indx]])
+		
+		for a, b, c in self.faces[self.faces_count == 1].tolist():
+			for atm1_indx, atm2_indx in ((a, b), (a, c), (b, c)):
+				if atm_units[atm1_indx] == atm_units[atm2_indx] and atm_units[atm1_indx] >= 0:
+					self.connect_neighbor_atms(atm1_indx, atm2_indx, direct_neighbors[atm_units[atm1_indx]])
+		
+		for unit_accessible_residues, unit_direct_neighbors in zip(accessible_residues, direct_neighbors):
+			for res_key in unit_accessible_residues:
+				unit_accessible_residues[res_key]['accessible_atms'] = list(unit_accessible_residues[res_key]['accessible_atms'])
+			for res_key in unit_direct_neighbors:
+				unit_direct_neighbors[res_key] = list(unit_direct_neighbors[res_key])
+		return list(zip(accessible_residues, direct_neighbors))
@@ -0,0 +1,183 @@
+import argparse
+import concurrent.futures
+import json
+import logging
+import os
+import re
+import time
+import traceback
+
+from concurrent.futures.process import BrokenProcessPool
+
+from pipeline_starter import PipelineStarter, JobArgumentParser
+
+class BatchRunner:
+	"""
+	Runs the pipeline over a manifest of entries in a pool of worker processes.
+	Every entry writes its results to <output>/<entry id>, and its completion or failure is appended to <output>/batch_status.jsonl,
+	so an interrupted batch can be started again with the same command and only the unfinished entries are run. The entries left unfinished
+	by a broken worker pool are recorded as interrupted, which a new run always retries, unlike the failed entries.
+	"""
+
+	status_file_name = 'batch_status.jsonl'
+
+	def get_parsed_args(self):
+		parser = argparse.ArgumentParser(description='Run functional regions detector on a batch of entries.')
+		parser.add_argument('--manifest', type=str, required=True, help='Path to a manifest file, one entry per line. A line is either a UniProt accession or space separated key=value options of the pipeline (e.g. pdb_file=1abc.pdb conservations_file=1abc.json). An optional id=... names the entry output directory.')
+		parser.add_argument('--entry_workers', type=int, default=os.cpu_count(), help='Number of entries to run in parallel, each in its own process. (default: number of CPUs)')
+		parser.add_argument('--retry_failed', action='store_true', help='Run again the entries that failed in a previous run of the batch.')
+		PipelineStarter().add_pipeline_arguments(parser)
+		args = parser.parse_args()
+
+		numeric_level = getattr(logging, args.log.upper())
+		FORMAT = '%(levelname)s: %(message)s'
+		logging.basicConfig(level=numeric_level, format=FORMAT)
+		return args
+
+	def read_manifest(self, manifest_file):
+		"""
+		Reads the manifest entries as dicts of pipeline options, each with a unique 'id'.
+			:param manifest_file: path to the manifest file.
+		"""
+		entries = []
+		with open(manifest_file) as fl:
+			for line_number, line in enumerate(fl, 1):
+				line = line.split('#', 1)[0].strip()
+				if not line:
+					continue
+				entry = {}
+				for token in line.split():
+					if '=' in token:
+						key, value = token.split('=', 1)
+						entry[key] = value
+					else:
+						entry['uniprot'] = token
+				if 'id' not in entry:
+					entry['id'] = entry.get('uniprot') or entry.get('pdb') or (os.path.splitext(os.path.basename(entry['pdb_file']))[0] if 'pdb_file' in entry else 'entry_' + str(line_number))
+				entry['id'] = re.sub(r'[^\w.-]', '_', entry['id'])
+				entries.append(entry)
+
+		ids = [entry['id'] for entry in entries]
+		duplicates = sorted(set(entry_id for entry_id in ids if ids.count(entry_id) > 1))
+		if duplicates:
+			raise ValueError('Duplicate entry ids in the manifest: ' + ', '.join(duplicates))
+		return entries
+
+	def read_status(self, status_file):
+		"""
+		Returns the last recorded status of every entry of a previous run.
+		"""
+		status = {}
+		if os.path.exists(status_file):
+			with open(status_file) as fl:
+				for line in fl:
+					try:
+						record = json.loads(line)
+					except ValueError:
+						#a line cut by an interrupted write
+						continue
+					status[record['entry']] = record['status']
+		return status
+
+	def get_entry_args(self, args, entry):
+		"""
+		Builds the pipeline options of one entry by parsing the entry options with the pipeline argument parser, with the batch options as defaults,
+		so they are converted and checked as the command line options are.
+		"""
+		parser = JobArgumentParser(add_help=False)
+		PipelineStarter().add_pipeline_arguments(parser)
+		pipeline_options = [action.dest for action in parser._actions]
+		parser.set_defaults(**{key: value for key, value in vars(args).items() if key in pipeline_options})
+		parser.set_defaults(uniprot=None, pdb=None)
+		
+		argv = []
+		for key, value in entry.items():
+			if key == 'id':
+				continue
+			if key not in pipeline_options or key == 'output':
+				raise ValueError('Unknown manifest option: ' + key)
+			argv += ['--' + key, value]
+		entry_args = parser.parse_args(argv)
+		
+		error = PipelineStarter().check_args(entry_args)
+		if error:
+			raise ValueError(error)
+		return entry_args
+
+	def main(self):
+		args = self.get_parsed_args()
+		entries = self.read_manifest(args.manifest)
+
+		os.makedirs(args.output, exist_ok=True)
+		status_file = os.path.join(args.output, self.status_file_name)
+		previous_status = self.read_status(status_file)
+		skipped_status = ['done'] if args.retry_failed else ['done', 'failed']
+		pending_entries = [entry for entry in entries if previous_status.get(entry['id']) not in skipped_status]
+		logging.info('%d entries in the manifest, %d to run, results will be saved in: %s', len(entries), len(pending_entries), args.output)
+
+		number_failed = 0
+		number_interrupted = 0
+		with open(status_file, 'a') as status_fl, concurrent.futures.ProcessPoolExecutor(max_workers=max(1, args.entry_workers)) as executor:
+			futures = {}
+			for entry in pending_entries:
+				try:
+					entry_args = self.get_entry_args(args, entry)
+				except ValueError as e:
+					record = {'entry': entry['id'], 'status': 'failed', 'error': str(e), 'seconds': 0}
+					status_fl.write(json.dumps(record) + '\n')
+					status_fl.flush()
+					number_failed += 1
+					logging.error('%s failed: %s', entry['id'], e)
+					continue
+				futures[executor.submit(run_entry, entry['id'], entry_args, os.path.join(args.output, entry['id']))] = entry['id']
+
+			for future in concurrent.futures.as_completed(futures):
+				try:
+					record = future.result()
+				except BrokenProcessPool as e:
+					#a worker process died (e.g. killed for its memory), which breaks the pool: the entries it left unfinished are not at fault
+					#and are run again by the next run of the batch
+					record = {'entry': futures[future], 'status': 'interrupted', 'error': repr(e), 'seconds': 0}
+				status_fl.write(json.dumps(record) + '\n')
+				status_fl.flush()
+				if record['status'] == 'done':
+					logging.info('%s done in %f seconds', record['entry'], record['seconds'])
+				elif record['status'] == 'interrupted':
+					number_interrupted += 1
+					logging.error('%s interrupted: %s', record['entry'], record['error'])
+				else:
+					number_failed += 1
+					logging.error('%s failed: %s', record['entry'], record['error'])
+
+		logging.info('Finished the batch, %d entries failed, %d interrupted, see %s', number_failed, number_interrupted, status_file)
+
+def run_entry(entry_id, args, output_path):
+	"""
+	Runs the pipeline of one entry in a worker process and returns its status record. The entry log is saved in its output directory.
+	"""
+	start = time.time()
+	os.makedirs(output_path, exist_ok=True)
+	handler = logging.FileHandler(os.path.join(output_path, 'pipeline.log'), mode='w')
+	handler.setFormatter(logging.Formatter('%(levelname)s: %(message)s'))
+	root_logger = logging.getLogger()
+	root_logger.addHandler(handler)
+
+	record = {'entry': entry_id, 'status': 'done', 'error': None}
+	try:
+		#the options were checked by get_entry_args
+		pipelineStarterObj = PipelineStarter()
+		pipelineStarterObj.run(args, output_path)
+	except BaseException as e:
+		#the pipeline stops on bad input by sys.exit, keep the worker alive and record the failure
+		record['status'] = 'failed'
+		record['error'] = 'exit code ' + str(e.code) if isinstance(e, SystemExit) else repr(e)
+		logging.debug(traceback.format_exc())
+	finally:
+		root_logger.removeHandler(handler)
+		handler.close()
+	record['seconds'] = time.time() - start
+	return record
+
+if __name__ == "__main__":
+	batchRunnerObj = BatchRunner()
+	batchRunnerObj.main()
@@ -1,73 +1,200 @@
-import networkx as nx
 import numpy as np
+import scipy.sparse as sp
 
-from sklearn.cluster import AgglomerativeClustering
-from collections import deque
+from scipy.sparse.linalg import eigs, LinearOperator, ArpackError, ArpackNoConvergence
+
+import heapq
 
 class CentralityScorer():
 
+	def __init__(self):
+		#graph sizes and eigen-solver iterations of every (chain, domain), reported by get_stats
+		self.stats = {}
+		self.solver_iterations = 0
+
 	def eigenvector_centrality(self, merged_data, max_number_of_patches, logging):
 		for pdb_chain in merged_data:
 			for domain in merged_data[pdb_chain]:
-				previous_patches = set()
+				residue_table = merged_data[pdb_chain][domain]
+				residue_indices, conservations, adjacency = self.build_adjacency(residue_table)
+				stats = {'graph_nodes': len(residue_indices), 'graph_edges': sp.triu(adjacency).nnz, 'iterations': 0, 'eigen_solver_iterations': []}
+				self.stats[(pdb_chain, domain)] = stats
+				active = np.ones(len(residue_indices), dtype=bool)
+				previous_centrality = np.zeros(len(residue_indices))
 				for patch_indx in range(1, max_number_of_patches+1):
-					DG=nx.DiGraph()
-					for residue in merged_data[pdb_chain][domain]['residues']:
-						neighbors = merged_data[pdb_chain][domain]['residues'][residue]['direct_neighbors'] if 'direct_neighbors' in merged_data[pdb_chain][domain]['residues'][residue] else []
-						acc = merged_data[pdb_chain][domain]['residues'][residue]['accessibility'] if 'accessibility' in merged_data[pdb_chain][domain]['residues'][residue] else -1
-						cons = merged_data[pdb_chain][domain]['residues'][residue]['conservation'] if 'conservation' in merged_data[pdb_chain][domain]['residues'][residue] else 0
-						if residue not in previous_patches and acc > 0.001 and 'conservation' in merged_data[pdb_chain][domain]['residues'][residue]:
-							edges = 0
-							for nbr_ind, nbr in enumerate(neighbors):
-								if nbr in merged_data[pdb_chain][domain]['residues'] and 'conservation' in merged_data[pdb_chain][domain]['residues'][nbr]:
-									nbr_acc = merged_data[pdb_chain][domain]['residues'][nbr]['accessibility'] if 'accessibility' in merged_data[pdb_chain][domain]['residues'][nbr] else -1
-									if nbr not in previous_patches and nbr_acc > 0.001:
-										edges+=1
-							wt = 1/edges if edges else None
-							for nbr_ind, nbr in enumerate(neighbors):
-								if nbr in merged_data[pdb_chain][domain]['residues'] and 'conservation' in merged_data[pdb_chain][domain]['residues'][nbr]:
-									nbr_acc = merged_data[pdb_chain][domain]['residues'][nbr]['accessibility'] if 'accessibility' in merged_data[pdb_chain][domain]['residues'][nbr] else -1
-									if nbr not in previous_patches and nbr_acc > 0.001:
-										DG.add_weighted_edges_from([(nbr,residue,cons*wt)])
+					weighted_adjacency, nodes = self.get_weighted_adjacency(adjacency, conservations, active)
 
-
-					if len(DG) > 0:
+					if len(nodes) > 2:
 						try:
-							centrality_dict = nx.eigenvector_centrality_numpy(DG, weight='weight', max_iter=1000)
-						except:
-							logging.info("Stopped iterating after %d iterations due to no convergence (chain %s, domain %s).", patch_indx, pdb_chain, domain)
+							centrality = self.solve_centrality(weighted_adjacency, np.abs(previous_centrality[nodes]))
+						except (ArpackError, ArithmeticError, ValueError) as e:
+							logging.warning("Stopped iterating after %d iterations due to eigen-solver failure (chain %s, domain %s): %s", patch_indx, pdb_chain, domain, e)
 							break
-
-						scrs = []
-						keys = []
-						for residue, score in centrality_dict.items():
-							merged_data[pdb_chain][domain]['residues'][residue]['score_' + str(patch_indx)] = score
-							scrs.append(score)
-							keys.append(residue)
+						finally:
+							stats['eigen_solver_iterations'].append(self.solver_iterations)
+						stats['iterations'] = patch_indx
+						previous_centrality[nodes] = centrality
+						residue_table.add_scores(residue_indices[nodes], centrality)
 						
 						#cluster residues hierarchically into 2 groups based on their scores.
-						X = np.array(scrs).reshape(-1, 1)
-						clustering = AgglomerativeClustering(n_clusters=2).fit(X)
+						labels = self.ward_two_clusters(centrality)
 
 						#define a patch of high-scoring connected residues starting by the residue with the highest score
-						queue = deque()
-						max_score_index = scrs.index(max(scrs))
-						high_scores_set = set(np.array(keys)[clustering.labels_==clustering.labels_[max_score_index]])
-						residue = keys[max_score_index]
-						queue.append(residue)
-						high_scores_set.remove(residue)
-						patch = []
-						while len(queue)>0:
-							residue = queue.popleft()
-							patch.append(residue)
-							if len(high_scores_set) > 0:
-								for nbr in merged_data[pdb_chain][domain]['residues'][residue]['direct_neighbors']:
-									if nbr in high_scores_set:
-										queue.append(nbr)
-										high_scores_set.remove(nbr)
-										
-						merged_data[pdb_chain][domain]['patch_' + str(patch_indx)] = {'residues': patch}
-						previous_patches.update(patch)
+						max_score_index = np.argmax(centrality)
+						high_scores = nodes[labels == labels[max_score_index]]
+						patch = self.grow_patch(residue_table.neighbor_indptr, residue_table.neighbor_indices, residue_indices[high_scores], residue_indices[nodes[max_score_index]])
+
+						residue_table.add_patch(patch)
+						active[np.searchsorted(residue_indices, patch)] = False
+					elif len(nodes) > 0:
+						logging.info("Stopped iterating after %d iterations due to a graph of less than 3 residues (chain %s, domain %s).", patch_indx, pdb_chain, domain)
+						break
 					else:
 						logging.info("Stopped iterating after %d iterations due to null graph (chain %s, domain %s).", patch_indx, pdb_chain, domain)
 						break
+
+	def get_stats(self, pdb_chain, domain):
+		"""
+		Returns the residue graph size (nodes and undirected edges) of a chain/domain, its number of iterations and the eigen-solver iterations
+		(ARPACK matrix-vector products, or power iterations after a fallback) of every iteration.
+		"""
+		return self.stats.get((pdb_chain, domain), {})
+
+	def grow_patch(self, neighbor_indptr, neighbor_indices, high_scores, source):
+		"""
+		Returns the residues connected to the source residue through direct neighbors within the high-scoring cluster, in breadth-first order.
+		The search goes one level at a time over the direct neighbors in their listed order, so the residues are in the order a queue discovers them.
+			:param neighbor_indptr: CSR offsets of the direct neighbors of the residue table.
+			:param neighbor_indices: CSR residue indices of the direct neighbors.
+			:param high_scores: the residue indices of the high-scoring cluster.
+			:param source: the residue index of the highest score.
+		"""
+		in_cluster = np.zeros(len(neighbor_indptr)-1, dtype=bool)
+		in_cluster[high_scores] = True
+		in_cluster[source] = False
+		frontier = np.array([source])
+		patch = [frontier]
+		while len(frontier):
+			#the direct neighbors of the frontier residues, residue after residue
+			starts = neighbor_indptr[frontier]
+			lengths = neighbor_indptr[frontier+1] - starts
+			positions = np.arange(lengths.sum()) + np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+			neighbors = neighbor_indices[positions]
+			neighbors = neighbors[in_cluster[neighbors]]
+			_, first = np.unique(neighbors, return_index=True)
+			frontier = neighbors[np.sort(first)]
+			in_cluster[frontier] = False
+			patch.append(frontier)
+		return np.concatenate(patch)
+
+	def ward_two_clusters(self, scores):
+		"""
+		Labels the scores with the two clusters of AgglomerativeClustering(n_clusters=2) (Ward linkage), in O(n log n) time and O(n) memory.
+		In one dimension Ward only merges adjacent clusters of the sorted scores, so the merges are replayed on a linked list
+		of clusters with a heap of the merge costs of adjacent clusters, until the sorted scores are split in two.
+		"""
+		num_scores = len(scores)
+		labels = np.zeros(num_scores, dtype=int)
+		if num_scores < 2:
+			return labels
+		
+		order = np.argsort(scores, kind='stable')
+		sizes = [1]*num_scores
+		sums = scores[order].tolist()
+		next_cluster = list(range(1, num_scores+1))
+		previous_cluster = list(range(-1, num_scores-1))
+		versions = [0]*num_scores
+		
+		def merge_cost(i, j):
+			difference = sums[i]/sizes[i] - sums[j]/sizes[j]
+			return sizes[i]*sizes[j]/(sizes[i]+sizes[j])*difference*difference
+		
+		heap = [(merge_cost(i, i+1), i, i+1, 0, 0) for i in range(num_scores-1)]
+		heapq.heapify(heap)
+		num_clusters = num_scores
+		while num_clusters > 2:
+			cost, i, j, version_i, version_j = heapq.heappop(heap)
+			if versions[i] != version_i or versions[j] != version_j:
+				continue
+			#merge cluster j into its left neighbour i
+			sizes[i] += sizes[j]
+			sums[i] += sums[j]
+			versions[i] += 1
+			versions[j] = -1
+			next_cluster[i] = next_cluster[j]
+			if next_cluster[j] < num_scores:
+				previous_cluster[next_cluster[j]] = i
+				heapq.heappush(heap, (merge_cost(i, next_cluster[i]), i, next_cluster[i], versions[i], versions[next_cluster[i]]))
+			if previous_cluster[i] >= 0:
+				heapq.heappush(heap, (merge_cost(previous_cluster[i], i), previous_cluster[i], i, versions[previous_cluster[i]], versions[i]))
+			num_clusters -= 1
+		
+		labels[order[next_cluster[0]:]] = 1
+		return labels
+
+	def build_adjacency(self, residue_table):
+		"""
+		Indexes the residues which can be in the graph (accessible and having a conservation score) and connects them
+		to their direct neighbors in a sparse matrix: adjacency[i, j] is 1 if residue j is a direct neighbor of residue i.
+		Returns the table indices of the graph residues, their conservations and the adjacency.
+		"""
+		residue_indices = np.flatnonzero(residue_table.get_surface_mask())
+		conservations = residue_table.conservation[residue_indices]
+		adjacency = residue_table.get_neighbors_matrix()[residue_indices][:, residue_indices].tocsr()
+		adjacency.sum_duplicates()
+		adjacency.data[:] = 1
+		return residue_indices, conservations, adjacency
+
+	def get_weighted_adjacency(self, adjacency, conservations, active):
+		"""
+		Drops the residues of previous patches and weights the edge from every neighbor to a residue by conservation/edges of the residue.
+		Returns the weighted matrix (the transposed adjacency of the directed graph) and the indices of the residues having an edge.
+		"""
+		mask = sp.diags(active.astype(float))
+		masked_adjacency = (mask @ adjacency @ mask).tocsr()
+		masked_adjacency.eliminate_zeros()
+		edges = np.asarray(masked_adjacency.sum(axis=1)).ravel()
+		wt = np.divide(conservations, edges, out=np.zeros_like(conservations), where=edges > 0)
+		nodes = np.flatnonzero((edges > 0) | (np.asarray(masked_adjacency.sum(axis=0)).ravel() > 0))
+		weighted_adjacency = (sp.diags(wt) @ masked_adjacency).tocsr()[nodes][:, nodes]
+		return weighted_adjacency, nodes
+
+	def solve_centrality(self, weighted_adjacency, v0):
+		"""
+		Returns the eigenvector centrality of the nodes, normalised as networkx.eigenvector_centrality_numpy does.
+		ARPACK is warm started from v0 (the previous eigenvector), and a power iteration is used if it does not converge.
+		A small positive floor keeps every node in the start vector, otherwise a disconnected component missing from the
+		previous eigenvector would never be reached.
+		"""
+		v0 = v0 + (v0.max() if v0.any() else 1)*0.01
+		self.solver_iterations = 0
+		def matvec(x):
+			self.solver_iterations += 1
+			return weighted_adjacency @ x
+		#the same products as passing the matrix itself, counted for the metrics
+		operator = LinearOperator(weighted_adjacency.shape, matvec=matvec, dtype=weighted_adjacency.dtype)
+		try:
+			_, eigenvector = eigs(operator, k=1, which='LR', v0=v0, maxiter=1000, tol=0)
+			eigenvector = eigenvector.flatten().real
+		except ArpackNoConvergence:
+			self.solver_iterations = 0
+			eigenvector = self.power_iteration(weighted_adjacency, v0)
+		
+		norm = np.sign(eigenvector.sum())*np.linalg.norm(eigenvector)
+		if norm == 0 or not np.isfinite(norm):
+			raise ArithmeticError('the eigenvector can not be normalised')
+		return eigenvector/norm
+
+	def power_iteration(self, weighted_adjacency, v0, max_iter=10000, tol=1e-12):
+		"""
+		Shifted power iteration (M + I), which converges on non-negative matrices even when they are periodic.
+		"""
+		x = v0/np.linalg.norm(v0)
+		for i in range(max_iter):
+			self.solver_iterations += 1
+			x_next = weighted_adjacency @ x + x
+			x_next = x_next/np.linalg.norm(x_next)
+			if np.abs(x_next-x).max() < tol:
+				return x_next
+			x = x_next
+		raise ArpackNoConvergence('power iteration did not converge in %d iterations' % max_iter, x, x)
@@ -0,0 +1,61 @@
+from scipy.spatial import cKDTree
+
+import numpy as np
+
+class ContactGraphBuilder():
+	"""
+	Builds the direct neighbors of the accessible residues of a chain/domain as a residue contact graph: two accessible residues are direct neighbors
+	if any two of their heavy atoms are within the cutoff distance. The atom pairs are found in bulk with a KD-tree, as an alternative to the neighbors
+	on the surface faces of the Delaunay triangulation, and the result has the same layout as the direct_neighbors of AccessibilityScorer.
+	"""
+
+	def __init__(self, cutoff=4.5):
+		"""
+			:param cutoff: maximum heavy atom distance of two residues in contact, in angstroms.
+		"""
+		self.cutoff = cutoff
+
+	def get_direct_neighbors(self, coords, atm_keys, accessible_residues):
+		"""
+		Returns {residue: [direct neighbors]} of the accessible residues.
+			:param coords: the coordinates of the heavy atoms of the chain/domain.
+			:param atm_keys: the atom keys (resseq+icode_resname_name) of the atoms.
+			:param accessible_residues: the accessible residues, as returned by AccessibilityScorer.
+		"""
+		res_keys = np.char.partition(np.asarray(atm_keys, dtype=str), '_')[:, 0]
+		residues, atm_residues = np.unique(res_keys, return_inverse=True)
+		atm_residues = atm_residues.ravel()
+		atoms = np.flatnonzero(np.isin(residues, list(accessible_residues))[atm_residues])
+
+		pairs = cKDTree(np.asarray(coords, dtype=np.float64)[atoms]).query_pairs(self.cutoff, output_type='ndarray')
+		residue_pairs = atm_residues[atoms[pairs]].reshape(-1, 2)
+		residue_pairs = np.sort(residue_pairs[residue_pairs[:, 0] != residue_pairs[:, 1]], axis=1)
+		residue_pairs = np.unique(residue_pairs, axis=0)
+
+		direct_neighbors = {}
+		residues = residues.tolist()
+		for res1_indx, res2_indx in residue_pairs.tolist():
+			direct_neighbors.setdefault(residues[res1_indx], []).append(residues[res2_indx])
+			direct_neighbors.setdefault(residues[res2_indx], []).append(residues[res1_indx])
+		return direct_neighbors
+
+def get_edges(direct_neighbors):
+	return {(residue, neighbor) for residue in direct_neighbors for neighbor in direct_neighbors[residue] if residue < neighbor}
+
+def compare_neighbor_graphs(direct_neighbors, reference_neighbors):
+	"""
+	Compares two residue graphs in the direct_neighbors layout. Returns their numbers of edges and common edges, the Jaccard index of their edges,
+	the fraction of the edges found in the reference (precision) and the fraction of the reference edges found (recall).
+	"""
+	edges = get_edges(direct_neighbors)
+	reference_edges = get_edges(reference_neighbors)
+	common_edges = len(edges & reference_edges)
+	all_edges = len(edges | reference_edges)
+	return {
+		'edges': len(edges),
+		'reference_edges': len(reference_edges),
+		'common_edges': common_edges,
+		'jaccard': common_edges/all_edges if all_edges else 1.0,
+		'precision': common_edges/len(edges) if edges else 1.0,
+		'recall': common_edges/len(reference_edges) if reference_edges else 1.0
+	}
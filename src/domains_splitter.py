@@ -1,49 +1,144 @@
 import networkx as nx
 import numpy as np
-import json
+import scipy.sparse as sp
+import glob
+import math
+import os
+import random
+import re
+import tempfile
 
-from Bio.PDB import PDBParser
+try:
+	import igraph
+	is_igraph_installed = True
+except:
+	is_igraph_installed = False
+
+pae_keys = (b'"predicted_aligned_error"', b'"distance"', b'"pae"')
+#the smallest PAE used for the edge weights, the integer PAE files of the AlphaFold database have a 0 diagonal (and 1/0 is not a weight)
+pae_floor = 0.1
 
 #Graph-based community clustering approach to extract protein domains
 #from https://pythonawesome.com/graph-based-community-clustering-approach-to-extract-protein-domains/
 #https://github.com/tristanic/pae_to_domains
 class AlphafoldDomainsSplitter():
 
-	def get_pLDDT(self, pdb_path):
+	def get_pLDDT(self, atoms):
 
-		parser = PDBParser()
-		pLDDT = {}
+		pLDDT = dict(zip(atoms['resseq'].tolist(), atoms['bfactor'].tolist()))
 		pLDDT_list = []
-		structure = parser.get_structure('structure', pdb_path)
-		for atom in structure.get_atoms():
-			pLDDT[atom.parent.get_id()[1]] = atom.bfactor
 
 		for i in range(len(pLDDT)):
 			pLDDT_list.append(pLDDT[i+1])
 
 		return pLDDT_list
 		
+	def get_pae_cache_file(self, pae_json_file):
+		"""
+		Returns the path of the .npy side file of a PAE JSON file. The name has the size and modification time (in ns) of the JSON file,
+		so a replaced or edited JSON file does not match the side file of its older version.
+		"""
+		stat = os.stat(pae_json_file)
+		return '%s.%d-%d.npy' % (os.path.splitext(pae_json_file)[0], stat.st_size, stat.st_mtime_ns)
+
 	def parse_pae_file(self, pae_json_file):
+		"""
+		Returns the predicted aligned error matrix as float32. The matrix is streamed from the JSON file once and kept in a .npy side file,
+		which later runs memory-map instead of parsing the JSON again. If the side file can not be written (e.g. a read-only or shared input
+		directory) or read, the matrix is parsed from the JSON file and kept in memory.
+		"""
+		cache_file = self.get_pae_cache_file(pae_json_file)
+		if os.path.exists(cache_file):
+			try:
+				return np.load(cache_file, mmap_mode='r')
+			except (OSError, ValueError):
+				pass
 		
-		with open(pae_json_file, 'rt') as f:
-			data = json.load(f)[0]
+		matrix = self.stream_pae_matrix(pae_json_file)
+		
+		tmp_file = None
+		try:
+			fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(cache_file)), prefix=os.path.basename(cache_file) + '.', suffix='.tmp')
+			with os.fdopen(fd, 'wb') as fl:
+				np.save(fl, matrix)
+			os.replace(tmp_file, cache_file)
+			#remove the side files of the older versions of the JSON file
+			stem = os.path.splitext(pae_json_file)[0]
+			for old_file in glob.glob(glob.escape(stem) + '.*-*.npy'):
+				if old_file != cache_file and re.fullmatch(r'\d+-\d+', old_file[len(stem)+1:-len('.npy')]):
+					os.remove(old_file)
+		except OSError:
+			if tmp_file and os.path.exists(tmp_file):
+				try:
+					os.remove(tmp_file)
+				except OSError:
+					pass
 		
-		r1, d = data['residue1'],data['distance']
-
-		size = max(r1)
-
-		matrix = np.empty((size,size))
-
-		matrix.ravel()[:] = d
-
 		return matrix
 
-	def domains_from_pae_matrix_networkx(self, pae_json_file, pdb_path, pae_power=1, pae_cutoff=5, graph_resolution=0.4):
+	def stream_pae_matrix(self, pae_json_file, chunk_size=1 << 22):
+		"""
+		Streams the PAE values of a JSON file straight into a float32 array, without building Python objects for them.
+		Both the v1/v2 layout (flat 'distance' list) and the newer 'predicted_aligned_error' (or 'pae') matrix layout are accepted.
+		"""
+		values = []
+		with open(pae_json_file, 'rb') as fl:
+			#skip everything before the matrix key
+			buffer = b''
+			start = -1
+			while start < 0:
+				chunk = fl.read(chunk_size)
+				if not chunk:
+					raise ValueError('No predicted aligned error matrix found in %s' % pae_json_file)
+				buffer += chunk
+				found = [(buffer.find(key), key) for key in pae_keys if buffer.find(key) >= 0]
+				if found:
+					indx, key = min(found)
+					start = indx + len(key)
+				else:
+					buffer = buffer[-max(len(key) for key in pae_keys):]
+			buffer = buffer[start:]
+			while b'[' not in buffer:
+				chunk = fl.read(chunk_size)
+				if not chunk:
+					raise ValueError('No predicted aligned error matrix found in %s' % pae_json_file)
+				buffer += chunk
+			buffer = buffer[buffer.index(b'['):]
+			
+			#parse the values chunk by chunk until the brackets of the matrix are closed
+			depth = 0
+			tail = b''
+			while buffer:
+				brackets = np.frombuffer(buffer, dtype=np.uint8)
+				depths = depth + np.cumsum((brackets == ord('[')).astype(np.int64) - (brackets == ord(']')))
+				closed = np.flatnonzero(depths == 0)
+				if len(closed):
+					text = tail + buffer[:closed[0]+1].translate(None, b'[]')
+					tail = b''
+				else:
+					depth = depths[-1]
+					text = tail + buffer.translate(None, b'[]')
+					cut = text.rfind(b',')
+					text, tail = text[:cut+1], text[cut+1:]
+				if text.strip(b', \t\r\n'):
+					values.append(np.fromstring(text.decode('ascii').strip(', \t\r\n'), dtype=np.float32, sep=','))
+				if len(closed):
+					break
+				buffer = fl.read(chunk_size)
+		
+		values = np.concatenate(values) if values else np.zeros(0, dtype=np.float32)
+		size = math.isqrt(len(values))
+		if size*size != len(values):
+			raise ValueError('The predicted aligned error matrix in %s is not square' % pae_json_file)
+		
+		return values.reshape(size, size)
+
+	def domains_from_pae_matrix_networkx(self, pae_json_file, atoms, pae_power=1, pae_cutoff=5, graph_resolution=0.4):
 		
 		pae_matrix = self.parse_pae_file(pae_json_file)
-		pLDDT = self.get_pLDDT(pdb_path)
+		pLDDT = self.get_pLDDT(atoms)
 		
-		weights = 1/pae_matrix**pae_power
+		weights = 1/np.maximum(pae_matrix, pae_floor)**pae_power
 
 		g = nx.Graph()
 		edges = np.argwhere(pae_matrix < pae_cutoff)
@@ -61,3 +156,85 @@ class AlphafoldDomainsSplitter():
 			if len(c) >= 30:
 				clusters_list.append(list(c))
 		return clusters_list
+
+	def get_pae_graph(self, pae_matrix, pLDDT, pae_power=1, pae_cutoff=5):
+		"""
+		Builds the residue graph of domains_from_pae_matrix_networkx with NumPy masks instead of a Python loop over the edges.
+		Returns the edges as an upper-triangular sparse matrix (self loops on the diagonal). When both (i, j) and (j, i) pass
+		the cutoffs, the weight of (j, i) is kept, as it is the one added last to the networkx graph. PAE values below pae_floor
+		are weighted as pae_floor, so a 0 PAE does not give an infinite weight.
+		"""
+		confident = np.asarray(pLDDT) >= 70
+		mask = (pae_matrix < pae_cutoff) & confident[:, None] & confident[None, :]
+		rows, cols = np.nonzero(mask)
+		weights = 1/np.maximum(pae_matrix[rows, cols].astype(np.float64), pae_floor)**pae_power
+		keep = (rows >= cols) | ~mask[cols, rows]
+		return sp.csr_matrix((weights[keep], (np.minimum(rows, cols)[keep], np.maximum(rows, cols)[keep])), shape=pae_matrix.shape)
+
+	def louvain_communities(self, graph, graph_resolution, seed=0):
+		"""
+		Runs Louvain modularity optimisation on the sparse graph at the given resolution, through igraph if it is installed
+		and networkx otherwise. Returns the communities as lists of residue numbers (1-based).
+		"""
+		graph = graph.tocoo()
+		if is_igraph_installed:
+			g = igraph.Graph(n=graph.shape[0], edges=np.column_stack((graph.row, graph.col)).tolist())
+			igraph.set_random_number_generator(random.Random(seed))
+			try:
+				partition = g.community_multilevel(weights=graph.data.tolist(), resolution=graph_resolution)
+			finally:
+				igraph.set_random_number_generator(random)
+			return [[residue+1 for residue in community] for community in partition]
+		
+		g = nx.Graph()
+		g.add_weighted_edges_from(zip((graph.row+1).tolist(), (graph.col+1).tolist(), graph.data.tolist()))
+		return [list(community) for community in nx.algorithms.community.louvain_communities(g, weight='weight', resolution=graph_resolution, seed=seed)]
+
+	def domains_from_pae_matrix_louvain(self, pae_json_file, atoms, pae_power=1, pae_cutoff=5, graph_resolution=0.4):
+		
+		pae_matrix = self.parse_pae_file(pae_json_file)
+		pLDDT = self.get_pLDDT(atoms)
+		
+		graph = self.get_pae_graph(pae_matrix, pLDDT, pae_power, pae_cutoff)
+		return self.domains_from_pae_graph(graph, graph_resolution)
+
+	def domains_from_pae_graph(self, graph, graph_resolution=0.4):
+		"""
+		Returns the domains (communities of 30 residues or more) of a graph of get_pae_graph, so that a graph can be split at several resolutions.
+		"""
+		clusters = self.louvain_communities(graph, graph_resolution)
+		clusters_list = []
+		for c in clusters:
+			if len(c) >= 30:
+				clusters_list.append(sorted(c))
+		return clusters_list
+
+	def compare_domain_assignments(self, domains, reference_domains):
+		"""
+		Compares two domain splits over all residues, counting residues outside every domain as one extra group.
+		Returns the adjusted Rand index and the fraction of residues which land in matching domains (each domain matched
+		to the reference domain it shares most residues with).
+		"""
+		size = max([max(domain) for domain in domains + reference_domains if domain] + [0])
+		if size == 0:
+			return {'adjusted_rand_index': 1.0, 'matching_residues_fraction': 1.0}
+		
+		labels = np.zeros(size, dtype=np.int64)
+		reference_labels = np.zeros(size, dtype=np.int64)
+		for domain_indx, domain in enumerate(domains):
+			labels[np.asarray(domain, dtype=np.int64)-1] = domain_indx+1
+		for domain_indx, domain in enumerate(reference_domains):
+			reference_labels[np.asarray(domain, dtype=np.int64)-1] = domain_indx+1
+		
+		contingency = np.zeros((len(domains)+1, len(reference_domains)+1), dtype=np.int64)
+		np.add.at(contingency, (labels, reference_labels), 1)
+		pairs = lambda counts: (counts*(counts-1)//2).sum()
+		sum_pairs = pairs(contingency)
+		row_pairs = pairs(contingency.sum(axis=1))
+		col_pairs = pairs(contingency.sum(axis=0))
+		total_pairs = size*(size-1)//2
+		expected = row_pairs*col_pairs/total_pairs if total_pairs else 0
+		maximum = (row_pairs+col_pairs)/2
+		adjusted_rand_index = 1.0 if maximum == expected else float((sum_pairs-expected)/(maximum-expected))
+		
+		return {'adjusted_rand_index': adjusted_rand_index, 'matching_residues_fraction': float(contingency.max(axis=1).sum()/size)}
@@ -0,0 +1,271 @@
+import argparse
+import concurrent.futures
+import datetime
+import json
+import logging
+import os
+import time
+
+import numpy as np
+
+from accessibility_scorer import AccessibilityScorer
+from centrality_scorer import CentralityScorer
+from pdb_parser import StructureContext
+from pipeline_starter import PipelineStarter
+from residue_table import build_residue_table
+from structure_reader import iter_structure_models
+
+#the atom fields which must be the same in every frame, the coordinates are the only field allowed to change
+topology_fields = ['chain', 'resseq', 'icode', 'resname', 'name']
+
+#the topology of every (chain, domain) unit in a worker process, set once by init_frame_worker
+frame_units = []
+
+class EnsembleRunner:
+	"""
+	Runs accessibility and centrality over the frames of an ensemble: the models of multi-model structure files (e.g. NMR ensembles or the snapshots
+	of a trajectory written as MODEL records) and of several files with the same atoms (e.g. the predictions of several seeds).
+	The topology of every chain/domain (clean atom selection, atom keys, radii and residue indexing) is built once from the first frame, and only the
+	coordinates change between frames. The frames are read one at a time and scored on a process pool, and instead of the merged_data of every frame
+	only the patch frequencies of every residue are kept, which are saved in ensemble.json.
+	"""
+
+	def get_parsed_args(self):
+		parser = argparse.ArgumentParser(description='Run functional regions detector on the frames of an ensemble and report how often every residue is in a patch.')
+		parser.add_argument('--output', type=str, default='../output', help='Path to an output directory where the results will be saved.')
+		parser.add_argument('--input', type=str, default='../input', help='Path to the directory where the input files are saved.')
+		parser.add_argument('--structure_files', type=str, nargs='+', required=True, help='The file names of the frames (in PDB, mmCIF or BinaryCIF format, optionally gzip-compressed), every model of every file is a frame. All the frames should have the same atoms in the same order.')
+		parser.add_argument('--conservations_file', type=str, required=True, help='The name of conservation scores file (should be saved in the input directory).')
+		parser.add_argument('--predicted_aligned_error_file', type=str, default=None, help='The name of AlphaFold predicted aligned error file (should be saved in the input directory). If it is passed, the first frame is split into domains and every frame uses the same domains.')
+		parser.add_argument('--domain_method', type=str, default='louvain', choices=['louvain', 'greedy'], help='Community detection method used in splitting the first frame into domains. (default: louvain)')
+		parser.add_argument('--number_of_iterations', type=int, default=20, help='Maximum number of iterations (patches) per chain/domain and frame. (default: 20)')
+		parser.add_argument('--frame_step', type=int, default=1, help='Score every n-th frame only. (default: 1)')
+		parser.add_argument('--max_frames', type=int, default=None, help='Maximum number of frames to score. (default: all)')
+		parser.add_argument('--workers', type=int, default=1, help='Number of worker processes to score the frames in parallel. (default: 1)')
+		parser.add_argument('--log', type=str, default='info', choices=['debug', 'info', 'warning', 'error', 'critical'], help='Specify the logging level. (default: info)')
+		args = parser.parse_args()
+
+		numeric_level = getattr(logging, args.log.upper())
+		FORMAT = '%(levelname)s: %(message)s'
+		logging.basicConfig(level=numeric_level, format=FORMAT)
+		return args
+
+	def iter_frames(self, structure_files, frame_step=1, max_frames=None):
+		"""
+		Yields (file name, model index, atom array) of every frame to score, reading one model at a time.
+		"""
+		frame_indx = 0
+		yielded = 0
+		for structure_file in structure_files:
+			for model_indx, atoms in enumerate(iter_structure_models(structure_file)):
+				if frame_indx % frame_step == 0:
+					if max_frames is not None and yielded >= max_frames:
+						return
+					yield os.path.basename(structure_file), model_indx, atoms
+					yielded += 1
+				frame_indx += 1
+
+	def build_topology(self, structure_context, domains, conservations):
+		"""
+		Returns the topology of every (chain, domain) unit as (chain, domain, start, stop, atom keys, residue keys, chain conservations),
+		where start:stop are the rows of the unit in the frame coordinates, and the atom indices selecting the coordinates of all units from a frame.
+		"""
+		units = []
+		unit_indices = []
+		offset = 0
+		for pdb_chain in structure_context.get_chain_ids():
+			chain_cons = conservations[pdb_chain] if pdb_chain in conservations else conservations
+			for domain_indx, domain in enumerate(domains):
+				indices = structure_context.get_clean_indices(pdb_chain, domain)
+				_, atm_keys = structure_context.get_clean_coordinates(pdb_chain, domain)
+				residue_keys = list(dict.fromkeys(atm_key.split('_')[0] for atm_key in atm_keys.tolist()))
+				units.append((pdb_chain, str(domain_indx+1), offset, offset + len(indices), atm_keys, residue_keys, chain_cons))
+				unit_indices.append(indices)
+				offset += len(indices)
+		return units, np.concatenate(unit_indices) if unit_indices else np.zeros(0, dtype=np.int64)
+
+	def get_frame_coordinates(self, atoms, topology_atoms, atom_indices):
+		"""
+		Returns the coordinates of the topology atoms in one frame, after checking that the frame has the same atoms as the first one.
+		"""
+		if len(atoms) != len(topology_atoms):
+			raise ValueError('the frame has %d atoms, the first frame has %d.' % (len(atoms), len(topology_atoms)))
+		frame_atoms = atoms[atom_indices]
+		for field in topology_fields:
+			if not np.array_equal(frame_atoms[field], topology_atoms[atom_indices][field]):
+				raise ValueError('the %s of the atoms of the frame are not those of the first frame.' % field)
+		return np.ascontiguousarray(frame_atoms['coord'])
+
+	def new_statistics(self, units):
+		"""
+		Returns the empty per-residue counters of every unit.
+		"""
+		statistics = {}
+		for pdb_chain, domain_key, _, _, _, residue_keys, _ in units:
+			statistics[(pdb_chain, domain_key)] = {name: np.zeros(len(residue_keys)) for name in ('accessible', 'patch', 'top_patch', 'best_patch_sum', 'score_1_sum', 'score_1_count')}
+		return statistics
+
+	def add_frame(self, statistics, frame_results):
+		"""
+		Adds the results of one frame to the counters of every unit.
+		"""
+		for unit_key, (accessible, best_patch, score_1) in frame_results.items():
+			unit_statistics = statistics[unit_key]
+			has_score = ~np.isnan(score_1)
+			unit_statistics['accessible'] += accessible
+			unit_statistics['patch'] += best_patch > 0
+			unit_statistics['top_patch'] += best_patch == 1
+			unit_statistics['best_patch_sum'] += best_patch
+			unit_statistics['score_1_sum'][has_score] += score_1[has_score]
+			unit_statistics['score_1_count'] += has_score
+
+	def get_patch_frequencies(self, statistics, units, number_of_frames):
+		"""
+		Returns the patch frequencies of every residue of every unit, as {chain: {domain: {residue: {...}}}}: the fraction of the frames in which the residue
+		is accessible, in any patch and in the first patch, the mean index of the first patch it is in (over the frames where it is in one) and its mean
+		score of the first iteration. The residues which are never accessible nor in a patch are left out.
+		"""
+		patch_frequencies = {}
+		for pdb_chain, domain_key, _, _, _, residue_keys, _ in units:
+			unit_statistics = statistics[(pdb_chain, domain_key)]
+			residues = {}
+			for i, residue in enumerate(residue_keys):
+				if not unit_statistics['accessible'][i] and not unit_statistics['patch'][i]:
+					continue
+				residues[residue] = {
+					'accessible_frequency': unit_statistics['accessible'][i]/number_of_frames,
+					'patch_frequency': unit_statistics['patch'][i]/number_of_frames,
+					'top_patch_frequency': unit_statistics['top_patch'][i]/number_of_frames,
+					'mean_best_patch': unit_statistics['best_patch_sum'][i]/unit_statistics['patch'][i] if unit_statistics['patch'][i] else None,
+					'mean_score_1': unit_statistics['score_1_sum'][i]/unit_statistics['score_1_count'][i] if unit_statistics['score_1_count'][i] else None
+				}
+			patch_frequencies.setdefault(pdb_chain, {})[domain_key] = residues
+		return patch_frequencies
+
+	def run(self, args, output_path):
+		"""
+		Scores every frame and saves ensemble.json in the output directory. Returns its content.
+		"""
+		pipelineStarterObj = PipelineStarter()
+		structure_files = [os.path.join(args.input, structure_file) for structure_file in args.structure_files]
+		conservations_file = os.path.join(args.input, args.conservations_file)
+		for file_path in structure_files + [conservations_file]:
+			pipelineStarterObj.check_file_existence(file_path)
+		conservations = pipelineStarterObj.load_conservations(conservations_file)
+
+		frames = self.iter_frames(structure_files, max(1, args.frame_step), args.max_frames)
+		first_frame = next(frames, None)
+		if first_frame is None:
+			raise ValueError('the structure files have no atoms.')
+		structure_context = StructureContext(structure_files[0], first_frame[2])
+
+		domains = [None]
+		if args.predicted_aligned_error_file:
+			predicted_aligned_error_file = os.path.join(args.input, args.predicted_aligned_error_file)
+			pipelineStarterObj.check_file_existence(predicted_aligned_error_file)
+			domains = pipelineStarterObj.split_domains(predicted_aligned_error_file, structure_context, args.domain_method)
+
+		units, atom_indices = self.build_topology(structure_context, domains, conservations)
+		topology_atoms = structure_context.model
+		statistics = self.new_statistics(units)
+		frame_records = []
+		logging.info('Scoring the frames of %d chains/domains on %d workers...', len(units), args.workers)
+		start = time.time()
+
+		def frames_coordinates():
+			file_name, model_indx, atoms = first_frame
+			yield 0, file_name, model_indx, self.get_frame_coordinates(atoms, topology_atoms, atom_indices)
+			for frame_indx, (file_name, model_indx, atoms) in enumerate(frames, 1):
+				try:
+					coords = self.get_frame_coordinates(atoms, topology_atoms, atom_indices)
+				except ValueError as e:
+					raise ValueError('Frame %d (model %d of %s) can not be scored: %s' % (frame_indx, model_indx+1, file_name, e))
+				yield frame_indx, file_name, model_indx, coords
+
+		def add_result(frame_info, result):
+			frame_results, seconds = result
+			self.add_frame(statistics, frame_results)
+			frame_indx, file_name, model_indx = frame_info
+			frame_records.append({'frame': frame_indx, 'file': file_name, 'model': model_indx+1, 'seconds': seconds,
+				'accessible_residues': int(sum(accessible.sum() for accessible, _, _ in frame_results.values())),
+				'patches': int(sum(best_patch.max(initial=0) for _, best_patch, _ in frame_results.values()))})
+			logging.debug('Scored frame %d in %f seconds', frame_indx, seconds)
+
+		if args.workers > 1:
+			with concurrent.futures.ProcessPoolExecutor(max_workers=args.workers, initializer=init_frame_worker, initargs=(units, args.number_of_iterations)) as executor:
+				#keep a few frames per worker in flight, so that the frames are read as they are scored and not all at once
+				pending = {}
+				for frame_indx, file_name, model_indx, coords in frames_coordinates():
+					pending[executor.submit(score_frame, coords)] = (frame_indx, file_name, model_indx)
+					if len(pending) >= 2*args.workers:
+						done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+						for future in done:
+							add_result(pending.pop(future), future.result())
+				for future in concurrent.futures.as_completed(pending):
+					add_result(pending[future], future.result())
+		else:
+			init_frame_worker(units, args.number_of_iterations)
+			for frame_indx, file_name, model_indx, coords in frames_coordinates():
+				add_result((frame_indx, file_name, model_indx), score_frame(coords))
+
+		frame_records.sort(key=lambda record: record['frame'])
+		logging.info('Finished scoring %d frames in %f seconds', len(frame_records), time.time() - start)
+		ensemble = {
+			'frames': len(frame_records),
+			'domains': [[int(residue) for residue in sorted(domain)] if domain else None for domain in domains],
+			'frame_records': frame_records,
+			'patch_frequencies': self.get_patch_frequencies(statistics, units, len(frame_records))
+		}
+		with open(os.path.join(output_path, 'ensemble.json'), 'w') as fl:
+			json.dump(ensemble, fl)
+		return ensemble
+
+	def main(self):
+		args = self.get_parsed_args()
+
+		output_path = os.path.join(args.output, datetime.datetime.now().strftime('%Y%m%d%H%M%S%f'))
+		os.makedirs(output_path)
+		logging.info("The results will be saved in: %s", output_path)
+
+		self.run(args, output_path)
+
+def init_frame_worker(units, number_of_iterations):
+	"""
+	Builds the accessibility scorer of every unit once per worker process, so that the atom keys, residue keys and radii are reused by every frame.
+	"""
+	global frame_units
+	frame_units = []
+	for pdb_chain, domain_key, start, stop, atm_keys, residue_keys, chain_cons in units:
+		AccessibilityScorerObj = AccessibilityScorer(np.zeros((stop - start, 3), dtype=np.float32), atm_keys)
+		residue_index = {residue: i for i, residue in enumerate(residue_keys)}
+		frame_units.append((pdb_chain, domain_key, start, stop, AccessibilityScorerObj, residue_index, chain_cons, number_of_iterations))
+
+def score_frame(coords):
+	"""
+	Runs accessibility and centrality of every unit on the coordinates of one frame. Returns, per unit and over its topology residues, the mask of the
+	accessible residues, the index of the first patch of every residue (0 if it is in none) and the score of the first iteration, and the wall time.
+	"""
+	start = time.time()
+	frame_results = {}
+	for pdb_chain, domain_key, unit_start, unit_stop, AccessibilityScorerObj, residue_index, chain_cons, number_of_iterations in frame_units:
+		AccessibilityScorerObj.set_coordinates(coords[unit_start:unit_stop])
+		accessible_residues, direct_neighbors = AccessibilityScorerObj.get_accessible_residues_and_their_neighbors()
+		residue_table = build_residue_table(chain_cons, accessible_residues, direct_neighbors)
+		CentralityScorer().eigenvector_centrality({pdb_chain: {domain_key: residue_table}}, number_of_iterations, logging)
+
+		rows = np.array([residue_index[residue] for residue in residue_table.residue_keys], dtype=np.int64)
+		accessible = np.zeros(len(residue_index), dtype=bool)
+		accessible[rows[~np.isnan(residue_table.accessibility)]] = True
+		best_patch = np.zeros(len(residue_index), dtype=np.int32)
+		for patch_indx, patch in enumerate(residue_table.patches, 1):
+			patch_rows = rows[patch]
+			best_patch[patch_rows] = np.where(best_patch[patch_rows] == 0, patch_indx, best_patch[patch_rows])
+		score_1 = np.full(len(residue_index), np.nan)
+		if residue_table.scores:
+			score_1[rows] = residue_table.scores[0]
+		frame_results[(pdb_chain, domain_key)] = (accessible, best_patch, score_1)
+	return frame_results, time.time() - start
+
+if __name__ == "__main__":
+	ensembleRunnerObj = EnsembleRunner()
+	ensembleRunnerObj.main()
@@ -0,0 +1,129 @@
+import numpy as np
+import concurrent.futures
+import logging
+import tracemalloc
+
+from multiprocessing import shared_memory
+
+from accessibility_scorer import AccessibilityScorer
+from centrality_scorer import CentralityScorer
+from contact_graph import ContactGraphBuilder, compare_neighbor_graphs
+from patch_evaluator import PatchEvaluator
+from residue_table import build_residue_table
+from run_metrics import RunMetrics
+
+class ParallelScorer():
+
+	def __init__(self):
+		#metrics of every (chain, domain) unit measured in the worker processes
+		self.unit_metrics = {}
+
+	def score_units(self, structure_context, domains, conservations, number_of_iterations, workers, on_unit_done=None, trace_memory=False, neighbor_graph='delaunay', contact_cutoff=4.5):
+		"""
+		Runs accessibility, centrality and patch evaluation of every (chain, domain) unit on a process pool and returns merged_data (the residue tables) and the accessibility data.
+		The coordinates and atom keys of all units are copied once into shared memory blocks, so the workers receive only offsets.
+			:param structure_context: StructureContext of the structure.
+			:param domains: list of residue ranges, or [None] for the whole chains.
+			:param conservations: the 'data' of the conservations file.
+			:param number_of_iterations: maximum number of patches per unit.
+			:param workers: number of worker processes.
+			:param on_unit_done: optional function called with the chain, domain and residue table of every unit as soon as it finishes.
+			:param trace_memory: if true, the workers trace their Python memory allocations with tracemalloc for the unit metrics.
+			:param neighbor_graph: 'delaunay', 'contacts' or 'compare', the direct neighbors of the residue graph (see PipelineStarter.get_contact_neighbors).
+			:param contact_cutoff: maximum heavy atom distance of two residues in contact.
+		"""
+		units = []
+		unit_coords = []
+		unit_keys = []
+		offset = 0
+		for pdb_chain in structure_context.get_chain_ids():
+			for domain_indx, domain in enumerate(domains):
+				coords, atm_keys = structure_context.get_clean_coordinates(pdb_chain, domain)
+				units.append((pdb_chain, str(domain_indx+1), offset, offset + len(coords)))
+				unit_coords.append(coords)
+				unit_keys.append(atm_keys)
+				offset += len(coords)
+
+		#keep the layout of merged_data the same as the serial run
+		merged_data = {}
+		accessibility_data = {}
+		for pdb_chain, domain_key, _, _ in units:
+			merged_data.setdefault(pdb_chain, {})[domain_key] = None
+			accessibility_data.setdefault(pdb_chain, {})[domain_key] = None
+
+		all_coords = np.ascontiguousarray(np.concatenate(unit_coords), dtype=np.float32)
+		all_keys = np.concatenate(unit_keys)
+		coords_shm = self.share_array(all_coords)
+		keys_shm = self.share_array(all_keys)
+		try:
+			coords_spec = (coords_shm.name, all_coords.shape, all_coords.dtype.str)
+			keys_spec = (keys_shm.name, all_keys.shape, all_keys.dtype.str)
+			with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+				futures = {}
+				#the largest units first, so that a big domain does not finish last
+				for pdb_chain, domain_key, start, stop in sorted(units, key=lambda unit: unit[2] - unit[3]):
+					chain_cons = conservations[pdb_chain] if pdb_chain in conservations else conservations
+					future = executor.submit(score_unit, pdb_chain, domain_key, coords_spec, keys_spec, start, stop, chain_cons, number_of_iterations, trace_memory, neighbor_graph, contact_cutoff)
+					futures[future] = (pdb_chain, domain_key)
+				for future in concurrent.futures.as_completed(futures):
+					pdb_chain, domain_key = futures[future]
+					merged_data[pdb_chain][domain_key], accessibility_data[pdb_chain][domain_key], self.unit_metrics[(pdb_chain, domain_key)] = future.result()
+					if on_unit_done:
+						on_unit_done(pdb_chain, domain_key, merged_data[pdb_chain][domain_key])
+		finally:
+			for shm in (coords_shm, keys_shm):
+				shm.close()
+				shm.unlink()
+		return merged_data, accessibility_data
+
+	def share_array(self, array):
+		"""
+		Copies the array into a new shared memory block. The caller should close and unlink the block.
+		"""
+		shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+		np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[:] = array
+		return shm
+
+def read_shared_array(spec, start, stop):
+	"""
+	Copies the rows start:stop of an array in a shared memory block described by (name, shape, dtype).
+	"""
+	name, shape, dtype = spec
+	shm = shared_memory.SharedMemory(name=name)
+	try:
+		return np.ndarray(shape, dtype=dtype, buffer=shm.buf)[start:stop].copy()
+	finally:
+		shm.close()
+
+def score_unit(pdb_chain, domain_key, coords_spec, keys_spec, start, stop, chain_cons, number_of_iterations, trace_memory=False, neighbor_graph='delaunay', contact_cutoff=4.5):
+	"""
+	Runs the pipeline stages of one (chain, domain) unit in a worker process and returns its residue table, accessibility data and metrics.
+	The accessibility data keeps the Delaunay neighbors, also when the residue table uses the contacts.
+	The peak resident memory in the metrics is the peak of the worker process.
+	"""
+	if trace_memory and not tracemalloc.is_tracing():
+		tracemalloc.start()
+	runMetricsObj = RunMetrics()
+	with runMetricsObj.unit_stage(pdb_chain, domain_key, 'accessibility'):
+		coords = read_shared_array(coords_spec, start, stop)
+		atm_keys = read_shared_array(keys_spec, start, stop)
+
+		AccessibilityScorerObj = AccessibilityScorer(coords, atm_keys)
+		accessible_residues, direct_neighbors = AccessibilityScorerObj.get_accessible_residues_and_their_neighbors()
+	runMetricsObj.add_unit_metrics(pdb_chain, domain_key, {**AccessibilityScorerObj.get_stats(), 'accessible_residues': len(accessible_residues)})
+
+	table_neighbors = direct_neighbors
+	if neighbor_graph != 'delaunay':
+		with runMetricsObj.unit_stage(pdb_chain, domain_key, 'contact_graph'):
+			table_neighbors = ContactGraphBuilder(contact_cutoff).get_direct_neighbors(coords, atm_keys, accessible_residues)
+		if neighbor_graph == 'compare':
+			runMetricsObj.add_unit_metrics(pdb_chain, domain_key, {'neighbor_graph_agreement': compare_neighbor_graphs(table_neighbors, direct_neighbors)})
+
+	unit_data = {pdb_chain: {domain_key: build_residue_table(chain_cons, accessible_residues, table_neighbors)}}
+	centralityScorerObj = CentralityScorer()
+	with runMetricsObj.unit_stage(pdb_chain, domain_key, 'centrality'):
+		centralityScorerObj.eigenvector_centrality(unit_data, number_of_iterations, logging)
+	runMetricsObj.add_unit_metrics(pdb_chain, domain_key, centralityScorerObj.get_stats(pdb_chain, domain_key))
+	with runMetricsObj.unit_stage(pdb_chain, domain_key, 'patch_evaluation'):
+		PatchEvaluator().evaluate_patches(unit_data, number_of_iterations)
+	return unit_data[pdb_chain][domain_key], {'accessible_residues': accessible_residues, 'direct_neighbors': direct_neighbors}, runMetricsObj.get_unit_metrics(pdb_chain, domain_key)
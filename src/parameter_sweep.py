@@ -0,0 +1,181 @@
+import argparse
+import csv
+import datetime
+import itertools
+import json
+import logging
+import os
+import time
+
+from accessibility_scorer import AccessibilityScorer
+from centrality_scorer import CentralityScorer
+from pdb_parser import StructureContext
+from pipeline_starter import PipelineStarter
+from residue_table import build_residue_table
+
+sweep_parameters = ['pae_cutoff', 'graph_resolution', 'accessibility_threshold', 'number_of_iterations']
+patch_columns = ['combination'] + sweep_parameters + ['chain', 'domain', 'domain_residues', 'domain_first', 'domain_last', 'patch', 'patch_size',
+	'patch_conservation_mean', 'patch_conservation_difference', 'patch_conservation_pvalue', 'residues']
+
+class ParameterSweep:
+	"""
+	Runs the pipeline in one process over a grid of parameters: the PAE cutoff and the resolution of the domain splitting, the accessibility threshold
+	of the surface residues and the number of iterations. The pipeline runs as a graph of stages, and every stage result is kept and reused by all the
+	combinations with the same values of the parameters it depends on: the structure and the PAE matrix are read once, the PAE graph is built once per
+	PAE cutoff, the accessibility runs once per distinct chain/domain, and the centrality scores and patch evaluation run once per chain/domain and
+	accessibility threshold, for the largest number of iterations (the first patches do not depend on the later iterations, so the smaller numbers of
+	iterations take the first patches). The patches of every combination are saved in one table, sweep_patches.csv.
+	"""
+
+	def __init__(self):
+		#results of every stage by the values they depend on, and the number of runs and reuses of every stage
+		self.stage_results = {}
+		self.stage_counts = {}
+
+	def get_parsed_args(self):
+		parser = argparse.ArgumentParser(description='Run functional regions detector over a grid of parameters and save the patches of every combination in one table.')
+		parser.add_argument('--output', type=str, default='../output', help='Path to an output directory where the results will be saved.')
+		parser.add_argument('--input', type=str, default='../input', help='Path to the directory where the input files are saved.')
+		parser.add_argument('--pdb_file', type=str, required=True, help='The file name of the structure (in PDB, mmCIF or BinaryCIF format, optionally gzip-compressed) (should be saved in the input directory).')
+		parser.add_argument('--conservations_file', type=str, required=True, help='The name of conservation scores file (should be saved in the input directory).')
+		parser.add_argument('--predicted_aligned_error_file', type=str, default=None, help='The name of AlphaFold predicted aligned error file (should be saved in the input directory). Without it the chains are not split into domains and the PAE parameters are not used.')
+		parser.add_argument('--pae_cutoff', type=float, nargs='+', default=[5], help='PAE cutoffs of the residue graph of the domain splitting. (default: 5)')
+		parser.add_argument('--graph_resolution', type=float, nargs='+', default=[0.4], help='Resolutions of the Louvain community detection of the domain splitting. (default: 0.4)')
+		parser.add_argument('--accessibility_threshold', type=float, nargs='+', default=[0.001], help='Accessibility thresholds over which residues are on the surface. (default: 0.001)')
+		parser.add_argument('--number_of_iterations', type=int, nargs='+', default=[20], help='Maximum numbers of iterations per chain/domain. (default: 20)')
+		parser.add_argument('--log', type=str, default='info', choices=['debug', 'info', 'warning', 'error', 'critical'], help='Specify the logging level. (default: info)')
+		args = parser.parse_args()
+
+		numeric_level = getattr(logging, args.log.upper())
+		FORMAT = '%(levelname)s: %(message)s'
+		logging.basicConfig(level=numeric_level, format=FORMAT)
+		return args
+
+	def run_stage(self, stage, key, compute):
+		"""
+		Returns the result of a stage for the values it depends on (key), computing it only the first time.
+		"""
+		results = self.stage_results.setdefault(stage, {})
+		counts = self.stage_counts.setdefault(stage, {'runs': 0, 'reuses': 0, 'seconds': 0})
+		if key in results:
+			counts['reuses'] += 1
+			return results[key]
+		start = time.time()
+		results[key] = compute()
+		counts['runs'] += 1
+		counts['seconds'] += time.time() - start
+		return results[key]
+
+	def get_domains(self, structure_context, predicted_aligned_error_file, pae_cutoff, graph_resolution):
+		"""
+		Returns the domains of a combination as a tuple of residue tuples, or (None,) for the whole chains. The domains keep the order of the domain splitting,
+		so they are numbered as in a pipeline run with the same parameters.
+		"""
+		if not predicted_aligned_error_file:
+			return (None,)
+		from domains_splitter import AlphafoldDomainsSplitter
+		alphafoldDomainsSplitterObj = AlphafoldDomainsSplitter()
+		pae_matrix, pLDDT = self.run_stage('parse_pae', None, lambda: (alphafoldDomainsSplitterObj.parse_pae_file(predicted_aligned_error_file), alphafoldDomainsSplitterObj.get_pLDDT(structure_context.atoms)))
+		graph = self.run_stage('pae_graph', pae_cutoff, lambda: alphafoldDomainsSplitterObj.get_pae_graph(pae_matrix, pLDDT, pae_cutoff=pae_cutoff))
+		domains = self.run_stage('split_domains', (pae_cutoff, graph_resolution), lambda: alphafoldDomainsSplitterObj.domains_from_pae_graph(graph, graph_resolution))
+		if not domains:
+			return (None,)
+		return tuple(tuple(int(residue) for residue in domain) for domain in domains)
+
+	def get_accessibility(self, structure_context, pdb_chain, domain):
+		def compute():
+			coords, atm_keys = structure_context.get_clean_coordinates(pdb_chain, domain)
+			return AccessibilityScorer(coords, atm_keys).get_accessible_residues_and_their_neighbors()
+		return self.run_stage('accessibility', (pdb_chain, domain), compute)
+
+	def get_scored_table(self, structure_context, conservations, pdb_chain, domain, accessibility_threshold, max_iterations):
+		"""
+		Returns the residue table of a chain/domain with the centrality scores, patches and patch evaluation of max_iterations iterations.
+		"""
+		def compute():
+			accessible_residues, direct_neighbors = self.get_accessibility(structure_context, pdb_chain, domain)
+			chain_cons = conservations[pdb_chain] if pdb_chain in conservations else conservations
+			residue_table = build_residue_table(chain_cons, accessible_residues, direct_neighbors)
+			residue_table.accessibility_threshold = accessibility_threshold
+			unit_data = {pdb_chain: {'1': residue_table}}
+			CentralityScorer().eigenvector_centrality(unit_data, max_iterations, logging)
+			from patch_evaluator import PatchEvaluator
+			PatchEvaluator().evaluate_patches(unit_data, max_iterations)
+			return residue_table
+		return self.run_stage('centrality_and_patch_evaluation', (pdb_chain, domain, accessibility_threshold), compute)
+
+	def get_combination_rows(self, combination_indx, combination, structure_context, conservations, domains, max_iterations):
+		"""
+		Returns the rows of the patches table of one combination.
+		"""
+		rows = []
+		for pdb_chain in structure_context.get_chain_ids():
+			for domain_indx, domain in enumerate(domains):
+				residue_table = self.get_scored_table(structure_context, conservations, pdb_chain, domain, combination['accessibility_threshold'], max_iterations)
+				for patch_indx, patch in enumerate(residue_table.patches[:combination['number_of_iterations']], 1):
+					residues = [residue_table.residue_keys[i] for i in patch.tolist()]
+					rows.append({
+						'combination': combination_indx,
+						**combination,
+						'chain': pdb_chain,
+						'domain': domain_indx+1,
+						'domain_residues': len(domain) if domain else '',
+						'domain_first': domain[0] if domain else '',
+						'domain_last': domain[-1] if domain else '',
+						'patch': patch_indx,
+						'patch_size': len(residues),
+						'patch_conservation_mean': residue_table.patch_conservation_mean[patch_indx-1],
+						'patch_conservation_difference': residue_table.patch_conservation_difference[patch_indx-1],
+						'patch_conservation_pvalue': residue_table.patch_conservation_pvalue[patch_indx-1],
+						'residues': ' '.join(residues)
+					})
+		return rows
+
+	def run(self, args, output_path):
+		"""
+		Runs every combination of the grid and saves sweep_patches.csv, and sweep.json with the combinations and the runs and reuses of every stage.
+		"""
+		pipelineStarterObj = PipelineStarter()
+		pdb_file = os.path.join(args.input, args.pdb_file)
+		conservations_file = os.path.join(args.input, args.conservations_file)
+		predicted_aligned_error_file = os.path.join(args.input, args.predicted_aligned_error_file) if args.predicted_aligned_error_file else None
+		for file_path in [pdb_file, conservations_file] + ([predicted_aligned_error_file] if predicted_aligned_error_file else []):
+			pipelineStarterObj.check_file_existence(file_path)
+
+		structure_context = self.run_stage('read_structure', None, lambda: StructureContext(pdb_file))
+		conservations = self.run_stage('load_conservations', None, lambda: pipelineStarterObj.load_conservations(conservations_file))
+		max_iterations = max(args.number_of_iterations)
+
+		combinations = [dict(zip(sweep_parameters, values)) for values in itertools.product(args.pae_cutoff, args.graph_resolution, args.accessibility_threshold, args.number_of_iterations)]
+		logging.info('Running %d combinations of parameters...', len(combinations))
+		start = time.time()
+		summary = []
+		with open(os.path.join(output_path, 'sweep_patches.csv'), 'w', newline='') as fl:
+			writer = csv.DictWriter(fl, fieldnames=patch_columns)
+			writer.writeheader()
+			for combination_indx, combination in enumerate(combinations, 1):
+				domains = self.get_domains(structure_context, predicted_aligned_error_file, combination['pae_cutoff'], combination['graph_resolution'])
+				rows = self.get_combination_rows(combination_indx, combination, structure_context, conservations, domains, max_iterations)
+				writer.writerows(rows)
+				summary.append({'combination': combination_indx, **combination, 'domains': len(domains) if domains != (None,) else 0, 'patches': len(rows),
+					'best_patch_conservation_pvalue': min([row['patch_conservation_pvalue'] for row in rows], default=None)})
+				logging.debug('Combination %d %s: %d domains, %d patches', combination_indx, combination, summary[-1]['domains'], len(rows))
+
+		logging.info('Finished %d combinations in %f seconds', len(combinations), time.time() - start)
+		for stage, counts in self.stage_counts.items():
+			logging.info('%s: %d runs, %d reuses, %f seconds', stage, counts['runs'], counts['reuses'], counts['seconds'])
+		with open(os.path.join(output_path, 'sweep.json'), 'w') as fl:
+			json.dump({'combinations': summary, 'stages': self.stage_counts}, fl, indent=1)
+
+	def main(self):
+		args = self.get_parsed_args()
+
+		output_path = os.path.join(args.output, datetime.datetime.now().strftime('%Y%m%d%H%M%S%f'))
+		os.makedirs(output_path)
+		logging.info("The results will be saved in: %s", output_path)
+
+		self.run(args, output_path)
+
+if __name__ == "__main__":
+	parameterSweepObj = ParameterSweep()
+	parameterSweepObj.main()
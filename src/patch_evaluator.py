@@ -0,0 +1,61 @@
+import numpy as np
+
+from scipy.stats import mannwhitneyu, norm, rankdata
+
+class PatchEvaluator():
+
+	def evaluate_patches(self, merged_data, number_of_iterations):
+		for pdb_chain in merged_data:
+			for domain in merged_data[pdb_chain]:
+				residue_table = merged_data[pdb_chain][domain]
+				patches = residue_table.patches[:number_of_iterations]
+				if not patches:
+					continue
+
+				surface_mask = residue_table.get_surface_mask()
+				surface_index = np.cumsum(surface_mask) - 1
+				conservations = residue_table.conservation[surface_mask]
+				membership = np.zeros((len(patches), len(conservations)), dtype=bool)
+				for i, patch in enumerate(patches):
+					membership[i, surface_index[patch]] = True
+
+				means, differences, pvalues = self.evaluate(conservations, membership)
+				residue_table.patch_conservation_mean = means
+				residue_table.patch_conservation_difference = differences
+				residue_table.patch_conservation_pvalue = pvalues
+
+	def evaluate(self, conservations, membership):
+		"""
+		Compares the conservations of every patch to the rest of the surface with a one-sided ('greater') Mann-Whitney U test.
+		The surface conservations are ranked once and all patches are scored together over the patch-membership mask.
+		Returns the mean patch conservations, their differences to the non-patch means, and the p-values as lists.
+			:param conservations: the conservation scores of the surface residues.
+			:param membership: a (patches x surface residues) boolean mask.
+		"""
+		num_surface_residues = len(conservations)
+		num_patch_residues = membership.sum(axis=1)
+		num_non_patch_residues = num_surface_residues - num_patch_residues
+		sum_patch_conservation = membership @ conservations
+		sum_non_patch_conservation = conservations.sum() - sum_patch_conservation
+		means = sum_patch_conservation/num_patch_residues
+		differences = means - sum_non_patch_conservation/num_non_patch_residues
+
+		#U statistic of the patches from the rank sums in the combined (surface) sample
+		ranks = rankdata(conservations)
+		U1 = membership @ ranks - num_patch_residues*(num_patch_residues+1)/2
+
+		#normal approximation with tie and continuity corrections, as scipy.stats.mannwhitneyu does
+		_, ties = np.unique(conservations, return_counts=True)
+		tie_term = (ties**3 - ties).sum()
+		n = num_surface_residues
+		s = np.sqrt(num_patch_residues*num_non_patch_residues/12 * ((n + 1) - tie_term/(n*(n-1))))
+		with np.errstate(divide='ignore', invalid='ignore'):
+			z = (U1 - num_patch_residues*num_non_patch_residues/2 - 0.5)/s
+		pvalues = np.clip(norm.sf(z), 0, 1)
+
+		#small samples without ties use the exact distribution in scipy
+		if not (ties > 1).any():
+			for i in np.flatnonzero((num_patch_residues <= 8) | (num_non_patch_residues <= 8)):
+				_, pvalues[i] = mannwhitneyu(conservations[membership[i]], conservations[~membership[i]], alternative='greater')
+
+		return means.tolist(), differences.tolist(), pvalues.tolist()
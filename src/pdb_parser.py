@@ -1,121 +1,214 @@
-from Bio.PDB import is_aa
-from Bio.PDB.PDBIO import PDBIO
-from Bio.PDB.PDBIO import Select
-from Bio.PDB.PDBParser import PDBParser
+from numpy.lib.recfunctions import repack_fields
 
-import io
+from structure_reader import read_structure
 
-# Fixing potential issues in the PDB files (It was important when we were using DSSP-based accessibility). Currently, its main use is in selecting residues within the same domain in the predicted alphafold structures.
-class SingleChainSelect(Select):
+import numpy as np
+
+def __getattr__(name):
+	#the Biopython-based cleaning is only imported when it is used, importing Bio.PDB is a large share of the start-up time
+	if name == 'SingleChainSelect':
+		from bio_pdb_parser import SingleChainSelect
+		return SingleChainSelect
+	raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+def read_clean_pdb(pdb_file, globular, domain):
+	from bio_pdb_parser import read_clean_pdb
+	return read_clean_pdb(pdb_file, globular, domain)
+
+def read_clean_atoms(pdb_file, globular, domain):
+	
+	return StructureContext(pdb_file).get_clean_atoms(globular, domain)
+
+
+class StructureContext():
 	"""
-	Custom Bio.PDB.PDBIO.Select class to select a single chain (or domain).
-		:param Select: parent Bio.PDB.PDBIO.Select
+	Reads a structure file (PDB, mmCIF or BinaryCIF) once into an atom array and hands cleaned chain/domain views of it to all pipeline stages.
+	The cleaning follows the SingleChainSelect rules, but is applied in memory without writing and re-parsing the structure.
 	"""
-	def __init__(self, globular, domain):
+	def __init__(self, pdb_file, atoms=None):
 		"""
-		Creates a new SingleChainSelect class instance
+		Creates a new StructureContext class instance
+			:param self:
+			:param pdb_file: path to the structure file.
+			:param atoms: optional atom array of the structure (e.g. one frame of an ensemble), the file is not read if it is passed.
+		"""
+		self.pdb_file = pdb_file
+		self.atoms = read_structure(pdb_file) if atoms is None else atoms
+		self.model = self.atoms[self.atoms['model'] == self.atoms['model'][0]] if len(self.atoms) else self.atoms
+		self.clean_chains = {}
+		self.clean_chain_indices = {}
+
+	def get_chain_ids(self):
+		"""
+		Returns the ids of the chains of the first model, in order of appearance
 			:param self:
-			:param globular: a character string representing a PDB chain.
-			:param domain: a collection of residues representing a seperate domain.
 		"""
-		self.globular = globular
-		self.domain = domain
+		chain_ids, first = np.unique(self.model['chain'], return_index=True)
+		return [str(chain_id) for chain_id in chain_ids[np.argsort(first)]]
 
-	def accept_model(self, model):
+	def get_residues(self, atoms):
 		"""
-		Accepts only the first model of a PDB
+		Returns the index of the first atom of every residue and the residue index of every atom.
+		Residues are ordered as Bio.PDB orders them: by model, by chain, then by first appearance.
+		The residue names of a point mutation (residues with the same number and other names) are separate residues, as PDBIO writes them.
 			:param self:
-			:param model:
+			:param atoms: an atom array.
 		"""
-		return 1 if model.id == 0 else 0
+		_, first, inverse = np.unique(repack_fields(atoms[['model', 'chain', 'hetero', 'resseq', 'icode', 'resname']]), return_index=True, return_inverse=True)
+		_, chain_first, chain_inverse = np.unique(repack_fields(atoms[['model', 'chain']]), return_index=True, return_inverse=True)
+		inverse = inverse.ravel()
+		order = np.lexsort((first, chain_first[chain_inverse.ravel()[first]], atoms['model'][first]))
+		rank = np.empty(len(order), dtype=np.int64)
+		rank[order] = np.arange(len(order))
+		return first[order], rank[inverse]
 
-	def flag_residue_for_deletion(self, residue):
-		for atom in residue.child_list:
-			if atom.is_disordered():
-				atom = atom.disordered_get()
-				atom.altloc = "@"
+	def get_point_mutations(self, atoms, residue_starts):
+		"""
+		Returns the first residue name of every residue, and a mask of the residues which are a later name of a point mutation.
+		Bio.PDB keeps the point mutations of the standard (not hetero) residues in one DisorderedResidue.
+			:param self:
+			:param atoms: an atom array.
+			:param residue_starts: the index of the first atom of every residue, as returned by get_residues.
+		"""
+		_, first_variant, variant_group = np.unique(repack_fields(atoms[['model', 'chain', 'hetero', 'resseq', 'icode']][residue_starts]), return_index=True, return_inverse=True)
+		point_mutation = np.ones(len(residue_starts), dtype=bool)
+		point_mutation[first_variant] = False
+		point_mutation &= atoms['hetero'][residue_starts] == ' '
+		return first_variant[variant_group.ravel()], point_mutation
 
-	def accept_chain(self, chain):
+	def get_residue_names(self):
 		"""
-		Accepts one chain, and flag disordered residues for deletion (to solve issues in 1AW8, 2HAL, 4AON, 4Z0Y, 6RXH)
+		Returns the names of all the residues of the structure (in all models)
 			:param self:
-			:param chain:
 		"""
-		if chain.id != self.globular:
-			return 0
-		
+		residue_starts, residue_indices = self.get_residues(self.atoms)
+		resnames = self.atoms['resname'][residue_starts]
+		first_variants, point_mutation = self.get_point_mutations(self.atoms, residue_starts)
+		for residue in np.unique(first_variants[point_mutation]):
+			#the DisorderedResidue of a point mutation is named by the last residue name read, the later names are dropped without alternative locations
+			group_atoms = np.flatnonzero(first_variants[residue_indices] == residue)
+			if (self.atoms['altloc'][residue_indices == residue] != ' ').all():
+				resnames[residue] = self.atoms['resname'][group_atoms[-1]]
+		return resnames[~point_mutation].tolist()
+
+	def get_flagged_residues(self, atoms, residue_starts, residue_indices, disordered):
+		"""
+		Returns a mask of the disordered residues which SingleChainSelect.accept_chain flags for deletion
+			:param self:
+			:param atoms: the atom array of one chain.
+			:param residue_starts: the index of the first atom of every residue.
+			:param residue_indices: the residue index of every atom.
+			:param disordered: a mask of the atoms with an alternative location.
+		"""
+		flagged = np.zeros(len(residue_starts), dtype=bool)
 		disordered_dict = {}
-		for res in chain.get_residues():
-			if res.is_disordered():
-				resseq = str(res.get_id()[1])
-				icode = str(res.get_id()[2].strip())
-				key = resseq+icode
-				if key in disordered_dict:
-					if disordered_dict[key].get_resname() != res.get_resname():
-						if not is_aa(disordered_dict[key].get_resname(), standard=True) and is_aa(res.get_resname(), standard=True):
-							self.flag_residue_for_deletion(disordered_dict[key])
-						else:
-							self.flag_residue_for_deletion(res)
-				else:
-					disordered_dict[key] = res
-		
-		return 1
+		#only the structures with disordered residues need Biopython here
+		from Bio.PDB import is_aa
+		for residue in np.unique(residue_indices[disordered]):
+			res = atoms[residue_starts[residue]]
+			key = str(res['resseq'])+str(res['icode']).strip()
+			if key in disordered_dict:
+				dict_res = atoms[residue_starts[disordered_dict[key]]]
+				if dict_res['resname'] != res['resname']:
+					if not is_aa(str(dict_res['resname']), standard=True) and is_aa(str(res['resname']), standard=True):
+						flagged[disordered_dict[key]] = True
+					else:
+						flagged[residue] = True
+			else:
+				disordered_dict[key] = residue
+		return flagged
 
-	def accept_residue(self, residue):
+	def clean_chain(self, chain_id):
 		"""
-		Accepts all residues with backbone atoms, but flag the disordered atoms which should be kept (to solve dropping atoms ex: 1F7A, 3FMA)
+		Returns the atom array of one chain after removing waters, residues lacking a backbone atom, hydrogens
+		and the unselected (or flagged) alternative locations. The result is cached per chain.
 			:param self:
-			:param residue:
+			:param chain_id: a character string representing a PDB chain.
 		"""
+		if chain_id in self.clean_chains:
+			return self.clean_chains[chain_id]
+		
+		chain_indices = np.flatnonzero(self.model['chain'] == chain_id)
+		atoms = self.model[chain_indices]
+		residue_starts, residue_indices = self.get_residues(atoms)
+		
 		# REMOVE WATERS
-		if residue.get_full_id()[3][0] == 'W':
-			return 0
-			
+		keep_residue = atoms['hetero'][residue_starts] != 'W'
+		
+		# keep the first residue name of a point mutation, PDBIO writes all of them and only the first one is read back
+		_, point_mutation = self.get_point_mutations(atoms, residue_starts)
+		keep_residue &= ~point_mutation
+		
 		# skip residues lacking a backbone atom
-		all_atoms = [atom.get_name().strip() for atom in residue.get_atoms()]
-		if residue.get_parent().id == self.globular and ("C" not in all_atoms or "CA" not in all_atoms or "N" not in all_atoms):
-			return 0
-			
-		# flag the disordered atoms which should be kept
-		for atom in residue.child_list:
-			if atom.is_disordered():
-				atom = atom.disordered_get()
-				if atom.altloc != "@":
-					atom.altloc = " "
+		for backbone_atom in ('C', 'CA', 'N'):
+			has_atom = np.zeros(len(residue_starts), dtype=bool)
+			has_atom[residue_indices[atoms['name'] == backbone_atom]] = True
+			keep_residue &= has_atom
 		
-		# skip residues not in the specified domain.
-		if self.domain:
-			if residue.get_id()[1] in self.domain:
-				return 1
-			else:
-				return 0
-		return 1
+		# REMOVE HYDROGENS
+		keep = keep_residue[residue_indices] & (atoms['element'] != 'H')
+		
+		# keep only the alternative location with the highest occupancy (the first one on ties), unless its residue is flagged,
+		# and put it where the first alternative location of the atom is.
+		positions = np.arange(len(atoms))
+		disordered = atoms['altloc'] != ' '
+		if disordered.any():
+			flagged = self.get_flagged_residues(atoms, residue_starts, residue_indices, disordered & ~point_mutation[residue_indices])
+			indices = np.flatnonzero(disordered)
+			_, names = np.unique(atoms['name'][indices], return_inverse=True)
+			names = names.ravel()
+			order = np.lexsort((indices, -atoms['occupancy'][indices], names, residue_indices[indices]))
+			sorted_indices = indices[order]
+			group_starts = np.ones(len(order), dtype=bool)
+			group_starts[1:] = (residue_indices[sorted_indices][1:] != residue_indices[sorted_indices][:-1]) | (names[order][1:] != names[order][:-1])
+			selected = np.zeros(len(atoms), dtype=bool)
+			selected[sorted_indices[group_starts]] = True
+			group_first = np.minimum.reduceat(sorted_indices, np.flatnonzero(group_starts))
+			positions[sorted_indices[group_starts]] = group_first
+			keep &= ~disordered | (selected & ~flagged[residue_indices])
+		
+		order = np.lexsort((positions, residue_indices))
+		clean_atoms = atoms[order[keep[order]]]
+		
+		self.clean_chains[chain_id] = clean_atoms
+		self.clean_chain_indices[chain_id] = chain_indices[order[keep[order]]]
+		return clean_atoms
 
-	def accept_atom(self, atom):
+	def get_clean_atoms(self, globular, domain):
 		"""
-		Reject disordered atoms which are not flagged
+		Returns the cleaned atom array of one chain (or domain), the in-memory equivalent of read_clean_pdb
 			:param self:
-			:param atom:
+			:param globular: a character string representing a PDB chain.
+			:param domain: a collection of residues representing a seperate domain.
 		"""
-		# REMOVE HYDROGENS
-		if atom.element.strip() == 'H':
-			return 0
-			
-		if atom.is_disordered() and not atom.altloc.isspace():
-			return 0
-			
-		return 1
-
-def read_clean_pdb(pdb_file, globular, domain):
+		atoms = self.clean_chain(globular)
+		if domain:
+			return atoms[np.isin(atoms['resseq'], list(domain))]
+		return atoms
 	
-	parser = PDBParser()
-		
-	structure = parser.get_structure('structure', pdb_file)
-	pdbio = PDBIO()
-	pdbio.set_structure(structure)
-	outputStream = io.StringIO()
-	pdbio.save(outputStream, SingleChainSelect(globular, domain))
-	outputStream.seek(0)
+	def get_clean_indices(self, globular, domain):
+		"""
+		Returns the indices in the first model of the clean heavy atoms of one chain (or domain), in the order of get_clean_coordinates.
+		The same indices select the atoms of every model (or frame) having the same atoms as the first one.
+			:param globular: a character string representing a PDB chain.
+			:param domain: a collection of residues representing a seperate domain.
+		"""
+		atoms = self.clean_chain(globular)
+		indices = self.clean_chain_indices[globular]
+		keep = atoms['name'] != "H"
+		if domain:
+			keep &= np.isin(atoms['resseq'], list(domain))
+		return indices[keep]
 	
-	return parser.get_structure('structure', outputStream)[0]
-
+	def get_clean_coordinates(self, globular, domain):
+		"""
+		Returns the coordinates and the atom keys (resseq+icode_resname_name) of the clean heavy atoms of one chain (or domain), as used by AccessibilityScorer.
+			:param globular: a character string representing a PDB chain.
+			:param domain: a collection of residues representing a seperate domain.
+		"""
+		atoms = self.get_clean_atoms(globular, domain)
+		atoms = atoms[atoms['name'] != "H"]
+		
+		res_keys = np.char.add(atoms['resseq'].astype(str), np.char.strip(atoms['icode']))
+		atm_keys = np.char.add(np.char.add(np.char.add(np.char.add(res_keys, '_'), atoms['resname']), '_'), atoms['name'])
+		return atoms['coord'], atm_keys
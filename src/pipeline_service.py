@@ -0,0 +1,324 @@
+import argparse
+import datetime
+import http.server
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+import traceback
+
+from pipeline_starter import PipelineStarter, JobArgumentParser
+from stage_cache import StageCache
+
+class JobThreadFilter(logging.Filter):
+	"""
+	Keeps the log records of one job thread and of the threads it starts (named after it, e.g. the download threads), so that concurrent jobs
+	write separate logs. The first error of the job is kept, to report why it failed.
+	"""
+
+	def __init__(self, thread_name):
+		super().__init__()
+		self.thread_name = thread_name
+		self.first_error = None
+
+	def filter(self, record):
+		if record.threadName != self.thread_name and not record.threadName.startswith(self.thread_name + '-'):
+			return False
+		if record.levelno >= logging.ERROR and self.first_error is None:
+			self.first_error = record.getMessage()
+		return True
+
+class PipelineService:
+	"""
+	Long-running pipeline process with a local HTTP/JSON job API. The modules are imported once, and the stage cache is shared by all the jobs.
+	Jobs wait in a bounded queue and run on a fixed number of job threads; a job returns the same results as running pipeline_starter.py with the same options.
+
+		POST   /jobs              submit a job, the body is a JSON object of pipeline options (e.g. {"uniprot": "Q9Y2M5"})
+		GET    /jobs              list the jobs
+		GET    /jobs/<id>         job status
+		GET    /jobs/<id>/result  merged_data.json of a finished job
+		DELETE /jobs/<id>         cancel a queued or running job
+		GET    /health            service status
+
+	The API has no authentication and the jobs run with the permissions of the service, so it should only be exposed to trusted local clients.
+	The jobs can not change the directories and servers of the service, and their input files are names in the input directory.
+	"""
+
+	#options set only by the service, not by the jobs
+	service_only_options = ['output', 'input', 'cache_dir', 'cache_size', 'slim_server', 'alphafold_server', 'pdb_server']
+	#options naming a file of the input directory
+	input_file_options = ['pdb_file', 'conservations_file', 'predicted_aligned_error_file']
+
+	def __init__(self, pipeline_defaults, max_running_jobs, queue_size, job_retention=86400):
+		"""
+			:param pipeline_defaults: dict of the default pipeline options of the jobs.
+			:param max_running_jobs: number of jobs running at the same time.
+			:param queue_size: maximum number of jobs waiting to run.
+			:param job_retention: seconds a finished job is kept in the job list.
+		"""
+		self.pipeline_defaults = pipeline_defaults
+		self.job_retention = job_retention
+		self.jobs = {}
+		self.jobs_lock = threading.Lock()
+		#the queue also holds the jobs cancelled while queued until a job thread takes them off, so the limit is on the number of queued jobs
+		self.job_queue = queue.Queue()
+		self.queue_size = queue_size
+		self.queued_jobs = 0
+		#one stage cache for all the jobs with the default cache options, the jobs with other cache options use their own
+		self.shared_cache = None
+		if pipeline_defaults.get('cache_size', 0) > 0:
+			self.shared_cache = StageCache(PipelineStarter().get_cache_dir(pipeline_defaults['cache_dir'], pipeline_defaults['output']), pipeline_defaults['cache_size']*1024*1024)
+		self.job_threads = [threading.Thread(target=self.run_jobs, daemon=True, name='job-thread-' + str(i)) for i in range(max_running_jobs)]
+		for job_thread in self.job_threads:
+			job_thread.start()
+
+	def get_job_args(self, options):
+		"""
+		Parses the job options with the pipeline argument parser, so they are checked as the command line options are.
+		"""
+		if not isinstance(options, dict):
+			raise ValueError('the job should be a JSON object of pipeline options.')
+		parser = JobArgumentParser(add_help=False)
+		PipelineStarter().add_pipeline_arguments(parser)
+		parser.set_defaults(**self.pipeline_defaults)
+
+		argv = []
+		for key, value in options.items():
+			if key not in self.pipeline_defaults:
+				raise ValueError('unknown option: ' + str(key))
+			if key in self.service_only_options:
+				raise ValueError('the option %s is set by the service, not by the jobs.' % key)
+			if key in self.input_file_options and value is not None and (not isinstance(value, str) or os.path.basename(value) != value or value in ('', '.', '..')):
+				raise ValueError('the option %s should be the name of a file in the input directory of the service.' % key)
+			if isinstance(value, bool):
+				value = 'true' if value else 'false'
+			if value is not None:
+				argv += ['--' + key, str(value)]
+		args = parser.parse_args(argv)
+
+		error = PipelineStarter().check_args(args)
+		if error:
+			raise ValueError(error)
+		return args
+
+	def expire_jobs(self):
+		"""
+		Removes the jobs finished more than job_retention seconds ago from the job list (their output directories are kept). Called with the jobs lock held.
+		"""
+		expired = time.time() - self.job_retention
+		for job_id in [job_id for job_id, job in self.jobs.items() if job['finished'] is not None and job['finished'] < expired]:
+			del self.jobs[job_id]
+
+	def submit(self, options):
+		args = self.get_job_args(options)
+		with self.jobs_lock:
+			self.expire_jobs()
+			job_id = datetime.datetime.now().strftime('%Y%m%d%H%M%S%f')
+			while job_id in self.jobs or os.path.exists(os.path.join(args.output, job_id)):
+				job_id = str(int(job_id) + 1)
+			job = {'job_id': job_id, 'status': 'queued', 'error': None, 'options': options, 'output_path': os.path.join(args.output, job_id), 'submitted': time.time(), 'started': None, 'finished': None}
+			if self.queued_jobs >= self.queue_size:
+				raise OverflowError('the job queue is full, try again later.')
+			self.job_queue.put_nowait((job_id, args))
+			self.queued_jobs += 1
+			self.jobs[job_id] = job
+			return self.get_job_status(job)
+
+	def cancel(self, job_id):
+		"""
+		Cancels a queued or running job. Returns its status, or None if there is no such job.
+		"""
+		with self.jobs_lock:
+			job = self.jobs.get(job_id)
+			if job is None:
+				return None
+			if job['status'] == 'queued':
+				job['status'] = 'cancelled'
+				job['finished'] = time.time()
+				self.queued_jobs -= 1
+			elif job['status'] == 'running':
+				job['status'] = 'cancelling'
+				job['pipeline'].cancel()
+			return self.get_job_status(job)
+
+	def get_job_status(self, job):
+		return {key: value for key, value in job.items() if key != 'pipeline'}
+
+	def get_status(self, job_id):
+		"""
+		Returns the status of a job, or None if there is no such job (or it expired).
+		"""
+		with self.jobs_lock:
+			job = self.jobs.get(job_id)
+			return self.get_job_status(job) if job is not None else None
+
+	def list_jobs(self):
+		with self.jobs_lock:
+			self.expire_jobs()
+			return [self.get_job_status(job) for job in self.jobs.values()]
+
+	def run_jobs(self):
+		while True:
+			job_id, args = self.job_queue.get()
+			pipelineStarterObj = PipelineStarter()
+			with self.jobs_lock:
+				#a job cancelled while queued may have expired from the job list before it is taken off the queue
+				job = self.jobs.get(job_id)
+				if job is None or job['status'] == 'cancelled':
+					continue
+				self.queued_jobs -= 1
+				job['status'] = 'running'
+				job['started'] = time.time()
+				job['pipeline'] = pipelineStarterObj
+			self.run_job(job, args, pipelineStarterObj)
+
+	def run_job(self, job, args, pipelineStarterObj):
+		os.makedirs(job['output_path'], exist_ok=True)
+		handler = logging.FileHandler(os.path.join(job['output_path'], 'pipeline.log'), mode='w')
+		handler.setFormatter(logging.Formatter('%(levelname)s: %(message)s'))
+		jobThreadFilterObj = JobThreadFilter(threading.current_thread().name)
+		handler.addFilter(jobThreadFilterObj)
+		root_logger = logging.getLogger()
+		root_logger.addHandler(handler)
+
+		status, error = 'done', None
+		try:
+			#the stage cache (and its file hashes) is kept in memory across the jobs
+			pipelineStarterObj.stageCacheObj = self.shared_cache
+			pipelineStarterObj.run(args, job['output_path'])
+		except BaseException as e:
+			#the pipeline stops on bad input by sys.exit, keep the job thread alive and record the failure
+			if pipelineStarterObj.cancelled.is_set():
+				status, error = 'cancelled', 'the job was cancelled'
+			else:
+				status, error = 'failed', 'exit code ' + str(e.code) if isinstance(e, SystemExit) else str(e) or repr(e)
+				#the pipeline logs the reason before sys.exit
+				if isinstance(e, SystemExit) and jobThreadFilterObj.first_error:
+					error = jobThreadFilterObj.first_error
+			logging.debug(traceback.format_exc())
+		finally:
+			root_logger.removeHandler(handler)
+			handler.close()
+
+		with self.jobs_lock:
+			job['status'] = status
+			job['error'] = error
+			job['finished'] = time.time()
+			del job['pipeline']
+
+	def get_result_file(self, job):
+		"""
+		Returns the merged_data.json of a job status, or None if the job did not finish with a result.
+		"""
+		if job['status'] != 'done':
+			return None
+		result_file = os.path.join(job['output_path'], 'merged_data.json')
+		return result_file if os.path.exists(result_file) else None
+
+	def get_health(self):
+		with self.jobs_lock:
+			statuses = [job['status'] for job in self.jobs.values()]
+		return {'status': 'ok', 'queued': statuses.count('queued'), 'running': statuses.count('running') + statuses.count('cancelling'), 'job_threads': len(self.job_threads), 'queue_size': self.queue_size}
+
+class PipelineRequestHandler(http.server.BaseHTTPRequestHandler):
+
+	service = None
+
+	def log_message(self, format, *args):
+		logging.debug('%s - %s', self.address_string(), format % args)
+
+	def send_json(self, status, content):
+		body = json.dumps(content).encode()
+		self.send_response(status)
+		self.send_header('Content-Type', 'application/json')
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def get_job_path(self):
+		match = re.fullmatch(r'/jobs/(\d+)(/result)?/?', self.path.split('?', 1)[0])
+		if not match:
+			return None, None
+		return match.group(1), match.group(2)
+
+	def do_GET(self):
+		path = self.path.split('?', 1)[0].rstrip('/')
+		if path == '/health':
+			return self.send_json(200, self.service.get_health())
+		if path == '/jobs':
+			return self.send_json(200, self.service.list_jobs())
+		job_id, result = self.get_job_path()
+		job = self.service.get_status(job_id) if job_id is not None else None
+		if job is None:
+			return self.send_json(404, {'error': 'not found'})
+		if not result:
+			return self.send_json(200, job)
+
+		result_file = self.service.get_result_file(job)
+		if result_file is None:
+			return self.send_json(409, {'error': 'the job has no merged_data.json result', 'job': job})
+		self.send_response(200)
+		self.send_header('Content-Type', 'application/json')
+		self.send_header('Content-Length', str(os.path.getsize(result_file)))
+		self.end_headers()
+		with open(result_file, 'rb') as fl:
+			for chunk in iter(lambda: fl.read(1 << 20), b''):
+				self.wfile.write(chunk)
+
+	def do_POST(self):
+		if self.path.split('?', 1)[0].rstrip('/') != '/jobs':
+			return self.send_json(404, {'error': 'not found'})
+		try:
+			length = int(self.headers.get('Content-Length', 0))
+			options = json.loads(self.rfile.read(length) or b'{}')
+			return self.send_json(202, self.service.submit(options))
+		except OverflowError as e:
+			return self.send_json(503, {'error': str(e)})
+		except ValueError as e:
+			return self.send_json(400, {'error': str(e)})
+
+	def do_DELETE(self):
+		job_id, result = self.get_job_path()
+		job = self.service.cancel(job_id) if job_id is not None and not result else None
+		if job is None:
+			return self.send_json(404, {'error': 'not found'})
+		return self.send_json(200, job)
+
+class PipelineServiceStarter:
+
+	def get_parsed_args(self):
+		parser = argparse.ArgumentParser(description='Run functional regions detector as a service with an HTTP/JSON job API. The pipeline options are the defaults of the jobs.')
+		parser.add_argument('--host', type=str, default='127.0.0.1', help='Address the service listens on. (default: 127.0.0.1)')
+		parser.add_argument('--port', type=int, default=8080, help='Port the service listens on. (default: 8080)')
+		parser.add_argument('--max_running_jobs', type=int, default=2, help='Number of jobs running at the same time. (default: 2)')
+		parser.add_argument('--queue_size', type=int, default=64, help='Maximum number of jobs waiting to run, more jobs are refused with 503. (default: 64)')
+		parser.add_argument('--job_retention', type=float, default=86400, help='Seconds a finished job is kept in the job list, its output directory is kept. (default: 86400)')
+		PipelineStarter().add_pipeline_arguments(parser)
+		args = parser.parse_args()
+
+		numeric_level = getattr(logging, args.log.upper())
+		FORMAT = '%(levelname)s: %(message)s'
+		logging.basicConfig(level=numeric_level, format=FORMAT)
+		return args
+
+	def main(self):
+		args = self.get_parsed_args()
+		service_options = ['host', 'port', 'max_running_jobs', 'queue_size', 'job_retention']
+		pipeline_defaults = {key: value for key, value in vars(args).items() if key not in service_options}
+
+		PipelineRequestHandler.service = PipelineService(pipeline_defaults, max(1, args.max_running_jobs), max(1, args.queue_size), args.job_retention)
+		server = http.server.ThreadingHTTPServer((args.host, args.port), PipelineRequestHandler)
+		logging.info('Serving the pipeline on http://%s:%d, the results will be saved in: %s', args.host, server.server_address[1], args.output)
+		try:
+			server.serve_forever()
+		except KeyboardInterrupt:
+			pass
+		finally:
+			server.server_close()
+
+if __name__ == "__main__":
+	pipelineServiceStarterObj = PipelineServiceStarter()
+	pipelineServiceStarterObj.main()
@@ -1,23 +1,21 @@
-import os, sys, datetime, time, requests
+import os, sys, datetime, time
 import argparse
-from Bio.PDB import PDBParser, Selection
-from Bio.PDB.Polypeptide import three_to_one
+import concurrent.futures
+import contextlib
+import importlib.util
+import threading
 
-from scipy.stats import mannwhitneyu
-
-from pdb_parser import read_clean_pdb
-from accessibility_scorer import AccessibilityScorer
+#the modules of the optional stages (downloads, domain splitting, patch evaluation, parallel scoring, columnar output and PyMOL)
+#are imported when a run uses them, to keep the start-up time of the pipeline small
+from pdb_parser import StructureContext
+from accessibility_scorer import AccessibilityScorer, AssemblyAccessibilityScorer
 from centrality_scorer import CentralityScorer
-from domains_splitter import AlphafoldDomainsSplitter
+from stage_cache import StageCache
+from residue_table import build_residue_table, residue_tables_to_dict
+from run_metrics import RunMetrics, profile_choices
 
 import logging
 
-try:
-	from pymol import cmd
-	is_pymol_installed = True
-except:
-	is_pymol_installed = False
-
 import numpy as np
 import json
 import math
@@ -25,32 +23,112 @@ import math
 from pathlib import Path
 
 
+#PyMOL has one global session, the sessions of concurrent runs in the same process are created one by one
+pymol_lock = threading.Lock()
+
+class PipelineCancelled(Exception):
+	pass
+
+class JobArgumentParser(argparse.ArgumentParser):
+	"""
+	Parses the pipeline options of a batch entry or a service job, raising ValueError instead of exiting on bad options.
+	"""
+
+	def error(self, message):
+		raise ValueError(message)
+
 class PipelineStarter:
 
-	def get_parsed_args(self):
-		parser = argparse.ArgumentParser(description='Run functional regions detector.')
+	def __init__(self):
+		self.remoteFetcherObj = None
+		self.remote_fetcher_lock = threading.Lock()
+		self.stageCacheObj = None
+		self.runMetricsObj = None
+		self.cancelled = threading.Event()
+	
+	def get_remote_fetcher(self):
+		with self.remote_fetcher_lock:
+			if self.remoteFetcherObj is None:
+				from remote_fetcher import RemoteFetcher
+				self.remoteFetcherObj = RemoteFetcher()
+				if self.cancelled.is_set():
+					self.remoteFetcherObj.cancel()
+			return self.remoteFetcherObj
+	
+	def cancel(self):
+		"""
+		Stops a running pipeline: the downloads stop at their next step and the pipeline stops before its next stage.
+		"""
+		self.cancelled.set()
+		with self.remote_fetcher_lock:
+			if self.remoteFetcherObj is not None:
+				self.remoteFetcherObj.cancel()
+	
+	def check_cancelled(self):
+		if self.cancelled.is_set():
+			raise PipelineCancelled('the pipeline was cancelled')
+
+	def add_pipeline_arguments(self, parser):
 		parser.add_argument('--output', type=str, default='../output', help='Path to an output directory where the pipeline results will be saved.')
 		parser.add_argument('--input', type=str, default='../input', help='Path to the directory where the input files should be saved.')
 		parser.add_argument('--uniprot', type=str, default=None, help='UniProt accession, --uniprot or --pdb should be passed, not both of them.')
 		parser.add_argument('--pdb', type=str, default=None, help='PDB id, --uniprot or --pdb should be passed, not both of them.')
 		parser.add_argument('--create_pymol_session', type=str, default='true', choices=['true', 'false'], help='PyMol session will be created if this option is true and PyMol is installed. (default: true)')
-		parser.add_argument('--pdb_file', type=str, default=None, help='The file name of the resolved or predicted structure (in PDB format) (should be saved in the input directory). If it is passed, the pipeline will use it and not download a pdb file based on uniprot/pdb options.')
+		parser.add_argument('--pdb_file', type=str, default=None, help='The file name of the resolved or predicted structure (in PDB, mmCIF or BinaryCIF format, optionally gzip-compressed) (should be saved in the input directory). If it is passed, the pipeline will use it and not download a pdb file based on uniprot/pdb options.')
 		parser.add_argument('--conservations_file', type=str, default=None, help='The name of conservation scores file (should be saved in the input directory). If it is passed, the pipeline will use it and not call SLiM RESTful APIs to get the conservation scores based on uniprot/pdb options.')
 		parser.add_argument('--split_into_domains', type=str, default='true', choices=['true', 'false'], help='If true, the pipeline will split AlphaFold predicted structure into domains. (default: true)')
 		parser.add_argument('--predicted_aligned_error_file', type=str, default=None, help='The name of AlphaFold predicted aligned error file (should be saved in the input directory). If it is passed, the pipeline will use it instead of trying to download it from AlphaFold database. It is used in splitting AlphaFold predicted structure into domains.')
+		parser.add_argument('--domain_method', type=str, default='louvain', choices=['louvain', 'greedy', 'compare'], help='Community detection method used in splitting AlphaFold predicted structure into domains: louvain on a sparse graph, the greedy modularity (networkx) reference, or compare to run both, log their agreement and use louvain. (default: louvain)')
+		parser.add_argument('--accessibility_mode', type=str, default='chain', choices=['chain', 'assembly', 'assembly_isolated'], help='chain: triangulate every chain/domain on its own; assembly: triangulate all the chains together once, so the surfaces buried between chains are not accessible; assembly_isolated: use the same single triangulation, but score every chain/domain as if it was on its own. Both assembly modes save the residues buried between chains in interface_residues.json and run in the main process, without --workers. (default: chain)')
+		parser.add_argument('--neighbor_graph', type=str, default='delaunay', choices=['delaunay', 'contacts', 'compare'], help='Direct neighbors of the residue graph of the centrality scores: the residues sharing a surface face of the Delaunay triangulation, the accessible residues with heavy atoms within --contact_cutoff of each other (found with a KD-tree), or compare to calculate both, log their agreement and use the contacts. (default: delaunay)')
+		parser.add_argument('--contact_cutoff', type=float, default=4.5, help='Maximum heavy atom distance of two residues in contact with --neighbor_graph contacts or compare, in angstroms. (default: 4.5)')
 		parser.add_argument('--orthdb_taxon_id', type=str, default='metazoa', choices=['metazoa', 'qfo', 'vertebrates', 'mammalia'], help='The search database to find orthologous sequences to the query structure. It is used by SLiM tools to generate conservations. (default: metazoa)')
 		parser.add_argument('--number_of_iterations', type=int, default=20, help='Maximum number of iterations the pipeline will perform (per each chain/domain). (default: 20)')
+		parser.add_argument('--columnar_output', type=str, default='npz', choices=['none', 'npz', 'parquet'], help='Format of the columnar result files written in the results directory of the output, per chain/domain as soon as it finishes: compressed NumPy .npz, Parquet (needs pyarrow), or none. (default: npz)')
+		parser.add_argument('--visualisation_export', type=str, default='none', choices=['none', 'pdb', 'mmcif'], help='Export a visualisation which needs no PyMOL to create: a copy of the structure per property with the property in the B-factor column, in PDB or mmCIF format, and a PyMOL script loading them. (default: none)')
+		parser.add_argument('--merged_data_json', type=str, default='true', choices=['true', 'false'], help='If true, the pipeline will save all the results in merged_data.json. (default: true)')
+		parser.add_argument('--cache_dir', type=str, default=None, help='Path to a directory where downloaded files, domains and accessibility are cached between runs. The cached results are loaded with pickle, so use only a directory which no one else can write to. (default: the cache directory in the output directory)')
+		parser.add_argument('--cache_size', type=int, default=2048, help='Maximum size of the cache in MB, the least recently used entries are removed over it. 0 disables the cache. (default: 2048)')
+		parser.add_argument('--download_max_age', type=float, default=7, help='Number of days a cached download (structure, predicted aligned error or conservations) is used before it is downloaded again. 0 always downloads again. (default: 7)')
+		parser.add_argument('--workers', type=int, default=1, help='Number of worker processes to score the chains/domains of the structure in parallel. (default: 1)')
+		parser.add_argument('--profile', type=str, default='none', choices=profile_choices, help='Profile the run with cProfile (profile.pstats and profile.txt in the output), trace the Python memory allocations of every stage and chain/domain with tracemalloc (in metrics.json), or both. cProfile covers only the main process, not the --workers processes. (default: none)')
 		parser.add_argument('--log', type=str, default='info', choices=['debug', 'info', 'warning', 'error', 'critical'], help='Specify the logging level. (default: info)')
 		parser.add_argument('--slim_server', type=str, default='http://slim.icr.ac.uk/restapi/rest/get/', help='SLiM tools server url.')
-		args = parser.parse_args()
-		
+		parser.add_argument('--alphafold_server', type=str, default='https://alphafold.ebi.ac.uk/files/', help='AlphaFold database files url.')
+		parser.add_argument('--pdb_server', type=str, default='http://files.rcsb.org/download/', help='PDB files url.')
+	
+	def check_args(self, args):
+		"""
+		Validates the input options of one run and converts the true/false options to booleans. Returns an error message or None.
+		"""
 		if args.uniprot and args.pdb:
-			parser.error("--uniprot and --pdb can't be used together.")
+			return "--uniprot and --pdb can't be used together."
 		if not args.uniprot and not args.pdb and (not args.pdb_file or not args.conservations_file):
-			parser.error("at least --pdb_file and --conservations_file are required, if no --uniprot and --pdb are passed.")
+			return "at least --pdb_file and --conservations_file are required, if no --uniprot and --pdb are passed."
+		
+		args.create_pymol_session = args.create_pymol_session in ('true', True)
+		args.split_into_domains = args.split_into_domains in ('true', True)
+		args.merged_data_json = args.merged_data_json in ('true', True)
+		args.cache_dir = self.get_cache_dir(args.cache_dir, args.output)
+		if args.columnar_output == 'parquet' and importlib.util.find_spec('pyarrow') is None:
+			return "pyarrow is required for --columnar_output parquet."
+		return None
+	
+	def get_cache_dir(self, cache_dir, output):
+		"""
+		Returns the cache directory, the cache directory in the output directory by default.
+		"""
+		return cache_dir if cache_dir else os.path.join(output, 'cache')
+	
+	def get_parsed_args(self):
+		parser = argparse.ArgumentParser(description='Run functional regions detector.')
+		self.add_pipeline_arguments(parser)
+		args = parser.parse_args()
+		
+		error = self.check_args(args)
+		if error:
+			parser.error(error)
 			
-		args.create_pymol_session = True if args.create_pymol_session == 'true' else False
-		args.split_into_domains = True if args.split_into_domains == 'true' else False
 		numeric_level = getattr(logging, args.log.upper())
 		FORMAT = '%(levelname)s: %(message)s'
 		logging.basicConfig(level=numeric_level, format=FORMAT)
@@ -61,45 +139,40 @@ class PipelineStarter:
 			logging.error("Can not find the specified file path %s Make sure:\n- The name of the file is correct.\n- The file is in the input directory.\n- If you are using docker, you have copied the input directory on your local machine to the docker container by `docker cp ./input my_pocket_container:/home/submitter/`\n- If you are running on your local machine, you have passed the input file to the pipeline using --input argument.", file_path)
 			sys.exit(1)
 	
-	def download_file(self, id, output_path, file_type):
+	def download_file(self, id, output_path, file_type, alphafold_server='https://alphafold.ebi.ac.uk/files/', pdb_server='http://files.rcsb.org/download/', max_age=None):
+		"""
+		Downloads a structure or predicted aligned error file, or copies it from the cache if it was cached less than max_age seconds ago (0 downloads it again).
+		"""
 		logging.info("downloading %s, %s", id, file_type)
 		start = time.time()
 		
 		try:
 			if file_type == 'pdb_structure':
-				url = "http://files.rcsb.org/download/" + id + ".pdb"
+				url = pdb_server + id + ".pdb"
 				out_path = os.path.join(output_path, id + ".pdb")
 			elif file_type == 'alphafold_structure':
-				url = "https://alphafold.ebi.ac.uk/files/AF-" + id + "-F1-model_v2.pdb"
+				url = alphafold_server + "AF-" + id + "-F1-model_v2.pdb"
 				out_path = os.path.join(output_path, "AF-" + id + "-F1-model_v2.pdb")
 			elif file_type == 'alphafold_error':
-				url = "https://alphafold.ebi.ac.uk/files/AF-" + id + "-F1-predicted_aligned_error_v2.json"
+				url = alphafold_server + "AF-" + id + "-F1-predicted_aligned_error_v2.json"
 				out_path = os.path.join(output_path, "AF-" + id + "-F1-predicted_aligned_error_v2.json")
 			
-			resp = requests.get(url)
-			status = resp.status_code
-			
-			if status == 200:
-				content = resp.text
-				open(out_path,"w").write(content)
-			else:
-				raise Exception()
-		except:
-			logging.error('Failed to download, URL %s, try to download it manually and pass it using the options --pdb_file or --predicted_aligned_error_file.', url)
+			cache_key = self.stageCacheObj.get_key('download', url=url) if self.stageCacheObj else None
+			if cache_key and max_age != 0 and self.stageCacheObj.get_file(cache_key, out_path, max_age):
+				logging.info('Using cached %s', url)
+				return out_path
+			self.get_remote_fetcher().download(url, out_path)
+			if cache_key:
+				self.stageCacheObj.put_file(cache_key, out_path)
+		except Exception as e:
+			logging.error('Failed to download, URL %s (%s), try to download it manually and pass it using the options --pdb_file or --predicted_aligned_error_file.', url, e)
 			sys.exit(1)
 		
 		end = time.time()
 		logging.info('Finished downloading in %f seconds', end - start)
 		return out_path
 
-	def waiter(self, status):
-		if status not in ['Finished','Error','Success']:
-			return True
-		else:
-			time.sleep(1)
-			return False
-
-	def get_conservations(self, id, orthdb_taxon_id, output_path, slim_server, file_type):
+	def get_conservations(self, id, orthdb_taxon_id, output_path, slim_server, file_type, max_age=None):
 		logging.info("downloading conservations for %s %s", file_type, id)
 		start = time.time()
 		
@@ -110,46 +183,56 @@ class PipelineStarter:
 				url = slim_server + "evolution?task=get_conservation_score&orthdb_taxon_id=%s&conservation_score_type=WCS&accession=%s" % (orthdb_taxon_id, id)
 			
 			out_path = os.path.join(output_path, id + ".conservations.json")
-			is_running = True
-			while is_running:
-				resp = requests.get(url)
-				content = resp.json()
-				is_running = self.waiter(content['status'])
+			cache_key = self.stageCacheObj.get_key('download', url=url) if self.stageCacheObj else None
+			if cache_key and max_age != 0 and self.stageCacheObj.get_file(cache_key, out_path, max_age):
+				logging.info('Using cached %s', url)
+				return out_path
+			content = self.get_remote_fetcher().poll_json(url)
 
 			if content['status'] == 'Success':
 				with open(out_path, 'w') as fl:
 					json.dump(content, fl)
+				if cache_key:
+					self.stageCacheObj.put_file(cache_key, out_path)
 			else:
-				raise Exception()
-		except:
-			logging.error('Failed to download conservations, URL %s, try to download it manually and pass it using the option --conservations_file.', url)
+				raise Exception('job status ' + content['status'])
+		except Exception as e:
+			logging.error('Failed to download conservations, URL %s (%s), try to download it manually and pass it using the option --conservations_file.', url, e)
 			sys.exit(1)
 		
 		end = time.time()
 		logging.info('Finished downloading in %f seconds', end - start)
 		return out_path
 	
-	def confirm_same_sequence_is_used(self, uniprot, orthdb_taxon_id, pdb_file, slim_server):
+	def get_query_sequence(self, uniprot, orthdb_taxon_id, slim_server, max_age=None):
+		"""
+		Returns the sequence used by SLiM tools in calculating the conservations of the uniprot accession, or None if it is not available.
+		"""
+		try:
+			url = slim_server + "evolution?task=get_alignment_query_sequence_gopher&orthdb_taxon_id=%s&accession=%s" % (orthdb_taxon_id, uniprot)
+			return self.cached_stage('query_sequence', lambda: self.fetch_query_sequence(url), max_age=max_age, url=url)
+		except Exception as e:
+			logging.error('Failed to download the sequence used in calculating conservations (%s).', e)
+		return None
+	
+	def fetch_query_sequence(self, url):
+		content = self.get_remote_fetcher().poll_json(url)
+		if content['status'] != 'Success':
+			raise Exception('job status ' + content['status'])
+		return content['data']['sequence']
+	
+	def confirm_same_sequence_is_used(self, query_sequence, structure_context):
 		logging.info("checking sequence used in calculating conservations matches the pdb file")
 		start = time.time()
 		
-		parser = PDBParser()
-		structure = parser.get_structure('structure', pdb_file)
-		residues = Selection.unfold_entities(structure, 'R')
+		from Bio.PDB.Polypeptide import three_to_one
+		residue_names = structure_context.get_residue_names()
 		
 		try:
-			url = slim_server + "evolution?task=get_alignment_query_sequence_gopher&orthdb_taxon_id=%s&accession=%s" % (orthdb_taxon_id, uniprot)
-			is_running = True
-			while is_running:
-				resp = requests.get(url)
-				content = resp.json()
-				is_running = self.waiter(content['status'])
-
-			if content['status'] == 'Success' and len(content['data']['sequence']) == len(residues):
-				for residue_indx, residue in enumerate(residues):
-					resname = residue.get_resname()
+			if query_sequence is not None and len(query_sequence) == len(residue_names):
+				for residue_indx, resname in enumerate(residue_names):
 					pdb_residue = three_to_one(resname)
-					if pdb_residue != content['data']['sequence'][residue_indx]:
+					if pdb_residue != query_sequence[residue_indx]:
 						raise Exception()
 			else:
 				raise Exception()
@@ -160,11 +243,55 @@ class PipelineStarter:
 		end = time.time()
 		logging.info('Finished checking in %f seconds', end - start)
 	
-	def split_domains(self, predicted_aligned_error_file, pdb_file):
+	def measure_stage(self, stage):
+		"""
+		Returns a context measuring a stage into the run metrics, which yields the dict of the stage metrics (or None without run metrics).
+		"""
+		if self.runMetricsObj is None:
+			return contextlib.nullcontext()
+		return self.runMetricsObj.stage(stage)
+	
+	def measure_unit(self, pdb_chain, domain, stage):
+		"""
+		Returns a context measuring the stage of one chain/domain into the run metrics, which yields the dict of its metrics (or None without run metrics).
+		"""
+		if self.runMetricsObj is None:
+			return contextlib.nullcontext()
+		return self.runMetricsObj.unit_stage(pdb_chain, domain, stage)
+	
+	def cached_stage(self, stage, compute, max_age=None, **inputs):
+		"""
+		Returns the cached result of a stage run on the same inputs, or computes and caches it. Without a cache it only computes it.
+			:param stage: name of the stage.
+			:param compute: function computing the stage result.
+			:param max_age: if given, a result cached more than max_age seconds ago is computed again (0 always computes it again).
+			:param inputs: everything the stage result depends on, files by their content hash.
+		"""
+		if not self.stageCacheObj:
+			return compute()
+		cache_key = self.stageCacheObj.get_key(stage, **inputs)
+		missing = object()
+		result = self.stageCacheObj.get(cache_key, missing, max_age) if max_age != 0 else missing
+		if result is not missing:
+			logging.info('Using cached %s results', stage)
+			return result
+		result = compute()
+		self.stageCacheObj.put(cache_key, result)
+		return result
+	
+	def split_domains(self, predicted_aligned_error_file, structure_context, domain_method='louvain'):
 		logging.info("Splitting structure into domains...")
 		start = time.time()
+		from domains_splitter import AlphafoldDomainsSplitter
 		alphafoldDomainsSplitterObj = AlphafoldDomainsSplitter()
-		domains = alphafoldDomainsSplitterObj.domains_from_pae_matrix_networkx(predicted_aligned_error_file, pdb_file)
+		if domain_method == 'greedy':
+			domains = alphafoldDomainsSplitterObj.domains_from_pae_matrix_networkx(predicted_aligned_error_file, structure_context.atoms)
+		else:
+			domains = alphafoldDomainsSplitterObj.domains_from_pae_matrix_louvain(predicted_aligned_error_file, structure_context.atoms)
+		if domain_method == 'compare':
+			reference_domains = alphafoldDomainsSplitterObj.domains_from_pae_matrix_networkx(predicted_aligned_error_file, structure_context.atoms)
+			agreement = alphafoldDomainsSplitterObj.compare_domain_assignments(domains, reference_domains)
+			logging.info('Louvain found %d domains, greedy modularity found %d domains (adjusted Rand index %f, matching residues fraction %f).', len(domains), len(reference_domains), agreement['adjusted_rand_index'], agreement['matching_residues_fraction'])
 		if not domains:
 			logging.info('found no domains, will use the whole protein!')
 			domains = [None]
@@ -172,36 +299,24 @@ class PipelineStarter:
 		logging.info('Finished splitting in %f seconds', end - start)
 		return domains
 		
-	def get_accessibility(self, pdb_file, domains=[None]):
+	def get_accessibility(self, structure_context, domains=[None]):
 		logging.info("Calculating accessibility...")
 		start = time.time()
 		
-		parser = PDBParser()
-		structure = parser.get_structure('structure', pdb_file)
-		model = structure[0]
-		pdb_chains = [c.id for c in Selection.unfold_entities(model, "C")]
+		pdb_chains = structure_context.get_chain_ids()
 		
 		self.data = {}
 		
 		for pdb_chain in pdb_chains:
 			self.data[pdb_chain] = {}
 			for domain_indx, domain in enumerate(domains):
-				model = read_clean_pdb(pdb_file, pdb_chain, domain)
-				
-				atm_keys = []
-				coords = []
-
-				for r in model.get_residues():
-					res_id = r.get_full_id()[3]
-					res_key = str(res_id[1])+res_id[2].strip()
+				with self.measure_unit(pdb_chain, str(domain_indx+1), 'accessibility') as unit_metrics:
+					coords, atm_keys = structure_context.get_clean_coordinates(pdb_chain, domain)
 					
-					for atom in r.get_atoms():
-						if atom.get_name().strip() != "H":
-							atm_keys.append(res_key+'_'+r.get_resname().strip()+'_'+atom.get_name().strip())
-							coords.append(atom.get_coord())
-				
-				AccessibilityScorerObj = AccessibilityScorer(np.array(coords), np.array(atm_keys))
-				accessible_residues, direct_neighbors = AccessibilityScorerObj.get_accessible_residues_and_their_neighbors()
+					AccessibilityScorerObj = AccessibilityScorer(coords, atm_keys)
+					accessible_residues, direct_neighbors = AccessibilityScorerObj.get_accessible_residues_and_their_neighbors()
+				if unit_metrics is not None:
+					self.runMetricsObj.add_unit_metrics(pdb_chain, str(domain_indx+1), {**AccessibilityScorerObj.get_stats(), 'accessible_residues': len(accessible_residues)})
 				
 				chain_details = {
 					'accessible_residues': accessible_residues,
@@ -214,128 +329,249 @@ class PipelineStarter:
 		logging.info('Finished calculating accessibility in %f seconds', end - start)
 		return self.data
 	
-	def merge_conservations(self, conservations_file, accessibility_data):
+	def get_assembly_accessibility(self, structure_context, domains=[None]):
+		"""
+		Calculates the accessibility of all the chains/domains from one triangulation of all the chains. Returns the in-context and the isolated
+		accessibility data, both in the layout of get_accessibility, and the sizes of the triangulation.
+		"""
+		logging.info("Calculating accessibility of the whole assembly...")
+		start = time.time()
+		
+		units = []
+		unit_coords = []
+		unit_keys = []
+		unit_labels = []
+		for pdb_chain in structure_context.get_chain_ids():
+			indices = structure_context.get_clean_indices(pdb_chain, None)
+			_, atm_keys = structure_context.get_clean_coordinates(pdb_chain, None)
+			resseq = structure_context.model['resseq'][indices]
+			labels = np.full(len(indices), -1)
+			for domain_indx, domain in enumerate(domains):
+				in_domain = np.isin(resseq, list(domain)) if domain else np.ones(len(indices), dtype=bool)
+				labels[in_domain & (labels < 0)] = len(units)
+				units.append((pdb_chain, str(domain_indx+1)))
+			unit_coords.append(structure_context.model['coord'][indices])
+			unit_keys.append(atm_keys)
+			unit_labels.append(labels)
+		
+		AccessibilityScorerObj = AssemblyAccessibilityScorer(np.concatenate(unit_coords), np.concatenate(unit_keys), np.concatenate(unit_labels), len(units))
+		views = AccessibilityScorerObj.get_accessible_residues_and_their_neighbors_per_unit()
+		
+		assembly_data = {}
+		for view_name, view in zip(('in_context', 'isolated'), views):
+			assembly_data[view_name] = {}
+			for (pdb_chain, domain), (accessible_residues, direct_neighbors) in zip(units, view):
+				assembly_data[view_name].setdefault(pdb_chain, {})[domain] = {
+					'accessible_residues': accessible_residues,
+					'direct_neighbors': direct_neighbors
+				}
+		assembly_data['stats'] = AccessibilityScorerObj.get_stats()
+		
+		end = time.time()
+		logging.info('Finished calculating accessibility of %d chains/domains in %f seconds', len(units), end - start)
+		return assembly_data
+	
+	def get_interface_residues(self, assembly_data):
+		"""
+		Returns the residues of every chain/domain which are accessible on their own but buried in the assembly, as {chain: {domain: [residues]}}.
+		"""
+		interface_residues = {}
+		for pdb_chain in assembly_data['isolated']:
+			interface_residues[pdb_chain] = {}
+			for domain in assembly_data['isolated'][pdb_chain]:
+				in_context = assembly_data['in_context'][pdb_chain][domain]['accessible_residues']
+				interface_residues[pdb_chain][domain] = [residue for residue in assembly_data['isolated'][pdb_chain][domain]['accessible_residues'] if residue not in in_context]
+		return interface_residues
+	
+	def get_contact_neighbors(self, structure_context, domains, accessibility_data, cutoff, compare=False):
+		"""
+		Returns the accessibility data with the direct neighbors of every chain/domain replaced by the contacts of its accessible residues within the cutoff.
+		If compare is true, the agreement of the contacts with the Delaunay neighbors is logged and added to the metrics.
+		"""
+		logging.info("Calculating residue contacts within %f angstroms...", cutoff)
+		start = time.time()
+		from contact_graph import ContactGraphBuilder, compare_neighbor_graphs
+		contactGraphBuilderObj = ContactGraphBuilder(cutoff)
+		
+		contact_data = {}
+		for pdb_chain in accessibility_data:
+			contact_data[pdb_chain] = {}
+			for domain_key in accessibility_data[pdb_chain]:
+				accessible_residues = accessibility_data[pdb_chain][domain_key]['accessible_residues']
+				with self.measure_unit(pdb_chain, domain_key, 'contact_graph'):
+					coords, atm_keys = structure_context.get_clean_coordinates(pdb_chain, domains[int(domain_key)-1])
+					direct_neighbors = contactGraphBuilderObj.get_direct_neighbors(coords, atm_keys, accessible_residues)
+				if compare:
+					agreement = compare_neighbor_graphs(direct_neighbors, accessibility_data[pdb_chain][domain_key]['direct_neighbors'])
+					logging.info('Chain %s, domain %s: %d contacts, %d Delaunay neighbors, %d in both (Jaccard index %f, precision %f, recall %f).', pdb_chain, domain_key, agreement['edges'], agreement['reference_edges'], agreement['common_edges'], agreement['jaccard'], agreement['precision'], agreement['recall'])
+					if self.runMetricsObj is not None:
+						self.runMetricsObj.add_unit_metrics(pdb_chain, domain_key, {'neighbor_graph_agreement': agreement})
+				contact_data[pdb_chain][domain_key] = {
+					'accessible_residues': accessible_residues,
+					'direct_neighbors': direct_neighbors
+				}
+		
+		end = time.time()
+		logging.info('Finished calculating residue contacts in %f seconds', end - start)
+		return contact_data
+	
+	def load_conservations(self, conservations_file):
 		with open(conservations_file, 'r') as fl:
-			conservations = json.load(fl)['data']
+			return json.load(fl)['data']
+	
+	def merge_conservations(self, conservations_file, accessibility_data):
+		conservations = self.load_conservations(conservations_file)
 		
 		merged_data = {}
 		
 		for pdb_chain in accessibility_data:
 			merged_data[pdb_chain] = {}
+			if pdb_chain in conservations:
+				chain_cons = conservations[pdb_chain]
+			else:
+				chain_cons = conservations
 			for domain in accessibility_data[pdb_chain]:
-				merged_data[pdb_chain][domain] = {'residues':{}}
-				for residue in accessibility_data[pdb_chain][domain]['accessible_residues']:
-					if residue not in merged_data[pdb_chain][domain]['residues']:
-						merged_data[pdb_chain][domain]['residues'][residue] = {}
-					merged_data[pdb_chain][domain]['residues'][residue]['accessibility'] = accessibility_data[pdb_chain][domain]['accessible_residues'][residue]['side_chain_score']
-				
-				for residue in accessibility_data[pdb_chain][domain]['direct_neighbors']:
-					if residue not in merged_data[pdb_chain][domain]['residues']:
-						merged_data[pdb_chain][domain]['residues'][residue] = {}
-					merged_data[pdb_chain][domain]['residues'][residue]['direct_neighbors'] = accessibility_data[pdb_chain][domain]['direct_neighbors'][residue]
-					
-				if pdb_chain in conservations:
-					chain_cons = conservations[pdb_chain]
-				else:
-					chain_cons = conservations
-				for residue in merged_data[pdb_chain][domain]['residues']:
-					if residue in chain_cons:
-						merged_data[pdb_chain][domain]['residues'][residue]['conservation'] = chain_cons[residue]
+				merged_data[pdb_chain][domain] = build_residue_table(chain_cons, accessibility_data[pdb_chain][domain]['accessible_residues'], accessibility_data[pdb_chain][domain]['direct_neighbors'])
 		
 		return merged_data
 	
+	def run_parallel_scoring(self, structure_context, domains, conservations_file, number_of_iterations, workers, on_unit_done=None, neighbor_graph='delaunay', contact_cutoff=4.5):
+		logging.info("Calculating accessibility, centrality scores, patches and patch evaluation of every chain/domain on %d workers...", workers)
+		start = time.time()
+		from parallel_scorer import ParallelScorer
+		parallelScorerObj = ParallelScorer()
+		merged_data, accessibility_data = parallelScorerObj.score_units(structure_context, domains, self.load_conservations(conservations_file), number_of_iterations, workers, on_unit_done, self.runMetricsObj is not None and self.runMetricsObj.profile in ('tracemalloc', 'all'), neighbor_graph, contact_cutoff)
+		if self.runMetricsObj is not None:
+			for (pdb_chain, domain), unit_metrics in parallelScorerObj.unit_metrics.items():
+				self.runMetricsObj.add_unit_metrics(pdb_chain, domain, unit_metrics)
+		end = time.time()
+		logging.info('Finished calculating scores and patches in %f seconds', end - start)
+		return merged_data, accessibility_data
+	
 	def run_centrality_iterations(self, merged_data, number_of_iterations):
 		logging.info("Calculating centrality scores and patches through iterations...")
 		start = time.time()
 		centralityScorerObj = CentralityScorer()
-		centralityScorerObj.eigenvector_centrality(merged_data, number_of_iterations, logging)
+		for pdb_chain in merged_data:
+			for domain in merged_data[pdb_chain]:
+				with self.measure_unit(pdb_chain, domain, 'centrality'):
+					centralityScorerObj.eigenvector_centrality({pdb_chain: {domain: merged_data[pdb_chain][domain]}}, number_of_iterations, logging)
+				if self.runMetricsObj is not None:
+					self.runMetricsObj.add_unit_metrics(pdb_chain, domain, centralityScorerObj.get_stats(pdb_chain, domain))
 		end = time.time()
 		logging.info('Finished calculating scores and patches in %f seconds', end - start)
 	
 	def run_patch_evaluation(self, merged_data, number_of_iterations):
 		logging.info("Running patch evaluation...")
 		start = time.time()
+		from patch_evaluator import PatchEvaluator
+		patchEvaluatorObj = PatchEvaluator()
 		for pdb_chain in merged_data:
 			for domain in merged_data[pdb_chain]:
-				surface_residues = []
-				num_surface_residues = 0
-				sum_surface_conservation = 0
-				for residue in merged_data[pdb_chain][domain]['residues']:
-					acc = merged_data[pdb_chain][domain]['residues'][residue]['accessibility'] if 'accessibility' in merged_data[pdb_chain][domain]['residues'][residue] else -1
-					cons = merged_data[pdb_chain][domain]['residues'][residue]['conservation'] if 'conservation' in merged_data[pdb_chain][domain]['residues'][residue] else 0
-					if acc > 0.001 and 'conservation' in merged_data[pdb_chain][domain]['residues'][residue]:
-						surface_residues.append(residue)
-						num_surface_residues+=1
-						sum_surface_conservation+=cons
-				
-				for patch_indx in range(1, number_of_iterations+1):
-					patch_key = 'patch_' + str(patch_indx)
-					if patch_key in merged_data[pdb_chain][domain]:
-						patch_residues = merged_data[pdb_chain][domain][patch_key]['residues']
-						num_patch_residues = len(patch_residues)
-						patch_conservations = []
-						sum_patch_conservation = 0
-						for residue in patch_residues:
-							patch_conservations.append(merged_data[pdb_chain][domain]['residues'][residue]['conservation'])
-							sum_patch_conservation+=merged_data[pdb_chain][domain]['residues'][residue]['conservation']
-						
-						non_patch_residues = set(surface_residues) - set(patch_residues)
-						num_non_patch_residues = num_surface_residues - num_patch_residues
-						non_patch_conservations = []
-						sum_non_patch_conservation = sum_surface_conservation - sum_patch_conservation
-						for residue in non_patch_residues:
-							non_patch_conservations.append(merged_data[pdb_chain][domain]['residues'][residue]['conservation'])
-						
-						U1, p = mannwhitneyu(patch_conservations, non_patch_conservations, alternative='greater')
-						
-						merged_data[pdb_chain][domain][patch_key]['patch_conservation_mean'] = sum_patch_conservation/num_patch_residues
-						merged_data[pdb_chain][domain][patch_key]['patch_conservation_difference'] = (sum_patch_conservation/num_patch_residues)-(sum_non_patch_conservation/num_non_patch_residues)
-						merged_data[pdb_chain][domain][patch_key]['patch_conservation_pvalue'] = p
+				with self.measure_unit(pdb_chain, domain, 'patch_evaluation'):
+					patchEvaluatorObj.evaluate_patches({pdb_chain: {domain: merged_data[pdb_chain][domain]}}, number_of_iterations)
 		end = time.time()
 		logging.info('Finished patch evaluation in %f seconds', end - start)
 	
+	def run_unit_scoring(self, merged_data, number_of_iterations, on_unit_done=None):
+		"""
+		Calculates the centrality scores, patches and patch evaluation of one chain/domain after the other.
+			:param on_unit_done: optional function called with the chain, domain and residue table of every chain/domain as soon as it finishes.
+		"""
+		logging.info("Calculating centrality scores, patches and patch evaluation of every chain/domain...")
+		start = time.time()
+		from patch_evaluator import PatchEvaluator
+		centralityScorerObj = CentralityScorer()
+		patchEvaluatorObj = PatchEvaluator()
+		for pdb_chain in merged_data:
+			for domain in merged_data[pdb_chain]:
+				unit_data = {pdb_chain: {domain: merged_data[pdb_chain][domain]}}
+				with self.measure_unit(pdb_chain, domain, 'centrality'):
+					centralityScorerObj.eigenvector_centrality(unit_data, number_of_iterations, logging)
+				if self.runMetricsObj is not None:
+					self.runMetricsObj.add_unit_metrics(pdb_chain, domain, centralityScorerObj.get_stats(pdb_chain, domain))
+				self.check_cancelled()
+				with self.measure_unit(pdb_chain, domain, 'patch_evaluation'):
+					patchEvaluatorObj.evaluate_patches(unit_data, number_of_iterations)
+				if on_unit_done:
+					on_unit_done(pdb_chain, domain, merged_data[pdb_chain][domain])
+		end = time.time()
+		logging.info('Finished calculating scores and patches in %f seconds', end - start)
+	
 	def create_pymol_session(self, merged_data, pdb_file, number_of_iterations, output_path):
 		logging.info("Creating PyMol session...")
 		start = time.time()
+		from pymol import cmd
+		from structure_export import get_resi_selection
 		cmd.reinitialize()
 		pdb_file_no_ext = Path(pdb_file).stem
-		for i, prop in enumerate(["conservation"]+["score_"+str(patch_indx) for patch_indx in range(1, number_of_iterations+1)]):
-			cmd.load(pdb_file)
-			cmd.hide('everything')
-			cmd.show("surface")
-			file_chains = cmd.get_chains()
-			for pdb_chain in file_chains:
-				chain_selector = "/"+pdb_file_no_ext+"//"+pdb_chain+"/"
-				for domain in merged_data[pdb_chain]:
-					minimum = math.inf
-					to_default = []
-					for residue in merged_data[pdb_chain][domain]['residues']:
-						if prop in merged_data[pdb_chain][domain]['residues'][residue]:
-							cmd.set_atom_property(prop, merged_data[pdb_chain][domain]['residues'][residue][prop], chain_selector+residue, proptype=3)
-							if merged_data[pdb_chain][domain]['residues'][residue][prop] < minimum:
-								minimum = merged_data[pdb_chain][domain]['residues'][residue][prop]
-						else:
-							to_default.append(residue)
-					for residue in to_default:
-						cmd.set_atom_property(prop, minimum, chain_selector+residue, proptype=3)
-
-					domain_selector = pdb_chain+str(domain)+'.'+prop
-					cmd.extract(domain_selector, " ".join([chain_selector+residue for residue in merged_data[pdb_chain][domain]['residues']]))
-					cmd.spectrum("properties['"+prop+"']", "white_blue_red", domain_selector)
-					
-					if i != 0:
-						cmd.disable(domain_selector)
-				
-				if i == 0:
-					cmd.color("white", chain_selector)
-					cmd.extract(pdb_chain+'.excluded', chain_selector)
-			cmd.delete(pdb_file_no_ext)
+		props = ["conservation"]+["score_"+str(patch_indx) for patch_indx in range(1, number_of_iterations+1)]
+		cmd.load(pdb_file, pdb_file_no_ext)
+		cmd.hide('everything', pdb_file_no_ext)
+		cmd.show("surface", pdb_file_no_ext)
+		
+		#the residues of every chain, a resi range must not select the insertion code residues outside the residue tables
+		chain_keys = {}
+		cmd.iterate(pdb_file_no_ext, "chain_keys.setdefault(chain, set()).add(resi)", space={'chain_keys': chain_keys})
+		
+		#one lookup table of every property per (chain, residue), the residues without a value take the lowest value of their chain/domain
+		values = {prop: {} for prop in props}
+		units = []
+		for pdb_chain in cmd.get_chains(pdb_file_no_ext):
+			if pdb_chain not in merged_data:
+				continue
+			for domain in merged_data[pdb_chain]:
+				residue_table = merged_data[pdb_chain][domain]
+				if not len(residue_table):
+					continue
+				for prop in props:
+					column = residue_table.get_column(prop)
+					has_value = ~np.isnan(column)
+					minimum = column[has_value].min() if has_value.any() else math.inf
+					values[prop].update(zip([(pdb_chain, residue) for residue in residue_table.residue_keys], np.where(has_value, column, minimum).tolist()))
+				units.append((pdb_chain, domain, pdb_file_no_ext+" and chain "+pdb_chain+" and resi "+get_resi_selection(residue_table.residue_keys, chain_keys.get(pdb_chain, ()))))
+		
+		#assign every property to all the atoms in one alter call instead of a call per residue
+		units_selector = " or ".join("("+unit_selector+")" for _, _, unit_selector in units)
+		if units:
+			for prop in props:
+				cmd.alter(units_selector, "p."+prop+" = values.get((chain, resi), default)", space={'values': values[prop], 'default': min(values[prop].values())})
+		
+		#the chain/domain objects are extracted once for the first property and copied for the other properties, instead of reloading the structure for every property
+		for pdb_chain in cmd.get_chains(pdb_file_no_ext):
+			if pdb_chain not in merged_data:
+				continue
+			chain_selector = pdb_file_no_ext+" and chain "+pdb_chain
+			for unit_chain, domain, unit_selector in units:
+				if unit_chain == pdb_chain:
+					domain_selector = pdb_chain+str(domain)+'.'+props[0]
+					cmd.extract(domain_selector, unit_selector)
+					cmd.spectrum("properties['"+props[0]+"']", "white_blue_red", domain_selector)
+			cmd.color("white", chain_selector)
+			cmd.extract(pdb_chain+'.excluded', chain_selector)
+		
+		for prop in props[1:]:
+			for pdb_chain, domain, _ in units:
+				domain_selector = pdb_chain+str(domain)+'.'+prop
+				cmd.create(domain_selector, pdb_chain+str(domain)+'.'+props[0])
+				cmd.spectrum("properties['"+prop+"']", "white_blue_red", domain_selector)
+				cmd.disable(domain_selector)
+		cmd.delete(pdb_file_no_ext)
 				
 		cmd.zoom()
 		cmd.bg_color('white')
 		cmd.save(os.path.join(output_path, pdb_file_no_ext+'.pse'))
 		end = time.time()
 		logging.info('Finished creating PyMol session in %f seconds', end - start)
+	
+	def export_visualisation(self, merged_data, structure_context, pdb_file, number_of_iterations, output_path, output_format):
+		logging.info("Exporting the visualisation files...")
+		start = time.time()
+		from structure_export import StructureExporter
+		structureExporterObj = StructureExporter(structure_context.model, number_of_iterations)
+		export_path = structureExporterObj.export(merged_data, output_path, Path(pdb_file).stem, output_format)
+		end = time.time()
+		logging.info('Finished exporting the visualisation files to %s in %f seconds', export_path, end - start)
 		
 	def main(self):
 		args = self.get_parsed_args()
@@ -344,55 +580,179 @@ class PipelineStarter:
 		os.makedirs(output_path)
 		logging.info("The results will be saved in: %s \nIf you are using docker, copy the results to your local machine by `docker cp my_pocket_container:/home/submitter/output ./`", output_path)
 		
+		self.run(args, output_path)
+	
+	def fetch_inputs(self, args, output_path):
+		"""
+		Finds the input files passed by the user and downloads the missing ones at the same time.
+		Returns the paths of the structure, conservations and predicted aligned error (or None) files, and the sequence used in calculating the downloaded uniprot conservations (or None).
+		"""
+		pdb_file = conservations_file = predicted_aligned_error_file = None
 		if args.pdb_file:
 			pdb_file = os.path.join(args.input, args.pdb_file)
 			self.check_file_existence(pdb_file)
 			logging.info("The pipeline will use the pdb file you passed.")
-		else:
-			if args.pdb:
-				pdb_file = self.download_file(args.pdb, output_path, 'pdb_structure')
-			else:
-				pdb_file = self.download_file(args.uniprot, output_path, 'alphafold_structure')
-		
 		if args.conservations_file:
 			conservations_file = os.path.join(args.input, args.conservations_file)
 			self.check_file_existence(conservations_file)
 			logging.info("The pipeline will use the conservations file you passed.")
-		else:
-			if args.pdb:
-				conservations_file = self.get_conservations(args.pdb, args.orthdb_taxon_id, output_path, args.slim_server, 'pdb')
-			else:
-				conservations_file = self.get_conservations(args.uniprot, args.orthdb_taxon_id, output_path, args.slim_server, 'uniprot')
-				self.confirm_same_sequence_is_used(args.uniprot, args.orthdb_taxon_id, pdb_file, args.slim_server)
+		if args.split_into_domains and args.predicted_aligned_error_file:
+			predicted_aligned_error_file = os.path.join(args.input, args.predicted_aligned_error_file)
+			self.check_file_existence(predicted_aligned_error_file)
+			logging.info("The pipeline will use the predicted aligned error file you passed.")
 		
-		domains = [None]
-		predicted_aligned_error_file = None
-		if args.split_into_domains:
-			if args.predicted_aligned_error_file:
-				predicted_aligned_error_file = os.path.join(args.input, args.predicted_aligned_error_file)
-				self.check_file_existence(predicted_aligned_error_file)
-				logging.info("The pipeline will use the predicted aligned error file you passed.")
-			elif args.uniprot:
-				predicted_aligned_error_file = self.download_file(args.uniprot, output_path, 'alphafold_error')
+		#the cached downloads older than --download_max_age are downloaded again, to pick up the updates of the servers
+		max_age = args.download_max_age*24*60*60
+		
+		#the download threads are named after the calling thread, so the logs of a service job keep their records
+		with concurrent.futures.ThreadPoolExecutor(max_workers=4, thread_name_prefix=threading.current_thread().name + '-fetch') as executor:
+			futures = {}
+			if not pdb_file:
+				if args.pdb:
+					futures['pdb_file'] = executor.submit(self.download_file, args.pdb, output_path, 'pdb_structure', args.alphafold_server, args.pdb_server, max_age)
+				else:
+					futures['pdb_file'] = executor.submit(self.download_file, args.uniprot, output_path, 'alphafold_structure', args.alphafold_server, args.pdb_server, max_age)
+			if not conservations_file:
+				if args.pdb:
+					futures['conservations_file'] = executor.submit(self.get_conservations, args.pdb, args.orthdb_taxon_id, output_path, args.slim_server, 'pdb', max_age)
+				else:
+					futures['conservations_file'] = executor.submit(self.get_conservations, args.uniprot, args.orthdb_taxon_id, output_path, args.slim_server, 'uniprot', max_age)
+					futures['query_sequence'] = executor.submit(self.get_query_sequence, args.uniprot, args.orthdb_taxon_id, args.slim_server, max_age)
+			if args.split_into_domains and not predicted_aligned_error_file and args.uniprot:
+				futures['predicted_aligned_error_file'] = executor.submit(self.download_file, args.uniprot, output_path, 'alphafold_error', args.alphafold_server, args.pdb_server, max_age)
 			
-			if predicted_aligned_error_file:
-				domains = self.split_domains(predicted_aligned_error_file, pdb_file)
+			try:
+				#wait until all the downloads finish or the first one fails, in whatever order they finish
+				done, _ = concurrent.futures.wait(futures.values(), return_when=concurrent.futures.FIRST_EXCEPTION)
+				for future in done:
+					if future.exception() is not None:
+						raise future.exception()
+				results = {name: future.result() for name, future in futures.items()}
+			except BaseException:
+				#one of the downloads failed, stop the other ones instead of waiting for them
+				self.get_remote_fetcher().cancel()
+				raise
 		
-		accessibility_data = self.get_accessibility(pdb_file, domains)
-		merged_data = self.merge_conservations(conservations_file, accessibility_data)
+		pdb_file = results.get('pdb_file', pdb_file)
+		conservations_file = results.get('conservations_file', conservations_file)
+		predicted_aligned_error_file = results.get('predicted_aligned_error_file', predicted_aligned_error_file)
+		return pdb_file, conservations_file, predicted_aligned_error_file, results.get('query_sequence')
+	
+	def run(self, args, output_path):
+		"""
+		Runs the pipeline and saves its metrics record in metrics.json, also when the run fails.
+		"""
+		self.runMetricsObj = RunMetrics(args.profile)
+		self.runMetricsObj.start_run()
+		try:
+			self.run_stages(args, output_path)
+		finally:
+			self.runMetricsObj.finish_run(output_path)
+	
+	def run_stages(self, args, output_path):
+		if args.cache_size <= 0:
+			self.stageCacheObj = None
+		elif self.stageCacheObj is None or self.stageCacheObj.cache_dir != args.cache_dir or self.stageCacheObj.max_size != args.cache_size*1024*1024:
+			#a cache passed in with other options (e.g. shared by the service jobs) is left as it is
+			self.stageCacheObj = StageCache(args.cache_dir, args.cache_size*1024*1024)
+		
+		with self.measure_stage('fetch_inputs'):
+			pdb_file, conservations_file, predicted_aligned_error_file, query_sequence = self.fetch_inputs(args, output_path)
+		self.check_cancelled()
 		
-		self.run_centrality_iterations(merged_data, args.number_of_iterations)
+		with self.measure_stage('read_structure') as stage_metrics:
+			structure_context = StructureContext(pdb_file)
+			structure_hash = self.stageCacheObj.file_hash(pdb_file) if self.stageCacheObj else None
+			if stage_metrics is not None:
+				stage_metrics['atoms'] = len(structure_context.model)
+				stage_metrics['chains'] = len(structure_context.get_chain_ids())
+		
+		if args.uniprot and not args.conservations_file:
+			with self.measure_stage('confirm_sequence'):
+				self.confirm_same_sequence_is_used(query_sequence, structure_context)
+		
+		domains = [None]
+		if predicted_aligned_error_file:
+			with self.measure_stage('split_domains') as stage_metrics:
+				if args.domain_method == 'compare':
+					domains = self.split_domains(predicted_aligned_error_file, structure_context, args.domain_method)
+				else:
+					pae_hash = self.stageCacheObj.file_hash(predicted_aligned_error_file) if self.stageCacheObj else None
+					domains = self.cached_stage('split_domains', lambda: self.split_domains(predicted_aligned_error_file, structure_context, args.domain_method), structure=structure_hash, pae=pae_hash, domain_method=args.domain_method)
+				if stage_metrics is not None:
+					stage_metrics['domains'] = len(domains)
+		self.check_cancelled()
+		
+		accessibility_data = None
+		if args.accessibility_mode != 'chain':
+			with self.measure_stage('assembly_accessibility') as stage_metrics:
+				assembly_data = self.cached_stage('assembly_accessibility', lambda: self.get_assembly_accessibility(structure_context, domains), structure=structure_hash, domains=domains)
+				accessibility_data = assembly_data['in_context'] if args.accessibility_mode == 'assembly' else assembly_data['isolated']
+				if stage_metrics is not None:
+					stage_metrics.update(assembly_data['stats'])
+			with open(os.path.join(output_path, 'interface_residues.json'), 'w') as fl:
+				json.dump(self.get_interface_residues(assembly_data), fl)
+			self.check_cancelled()
+		
+		accessibility_key = self.stageCacheObj.get_key('accessibility', structure=structure_hash, domains=domains) if self.stageCacheObj and accessibility_data is None else None
+		if accessibility_key:
+			accessibility_data = self.stageCacheObj.get(accessibility_key)
+			if accessibility_data is not None:
+				logging.info('Using cached accessibility results')
+		
+		resultWriterObj = None
+		if args.columnar_output != 'none':
+			from result_store import ResultWriter
+			resultWriterObj = ResultWriter(output_path, args.columnar_output, args.number_of_iterations)
+		
+		try:
+			if accessibility_data is None and args.workers > 1 and len(structure_context.get_chain_ids())*len(domains) > 1:
+				with self.measure_stage('parallel_scoring') as stage_metrics:
+					merged_data, accessibility_data = self.run_parallel_scoring(structure_context, domains, conservations_file, args.number_of_iterations, args.workers, resultWriterObj.write_unit if resultWriterObj else None, args.neighbor_graph, args.contact_cutoff)
+					if stage_metrics is not None:
+						stage_metrics['workers'] = args.workers
+				if accessibility_key:
+					self.stageCacheObj.put(accessibility_key, accessibility_data)
+			else:
+				if args.accessibility_mode == 'chain':
+					with self.measure_stage('accessibility') as stage_metrics:
+						if stage_metrics is not None:
+							stage_metrics['cached'] = accessibility_data is not None
+						if accessibility_data is None:
+							accessibility_data = self.get_accessibility(structure_context, domains)
+							if accessibility_key:
+								self.stageCacheObj.put(accessibility_key, accessibility_data)
+					self.check_cancelled()
+				neighbor_data = accessibility_data
+				if args.neighbor_graph != 'delaunay':
+					with self.measure_stage('contact_graph'):
+						neighbor_data = self.get_contact_neighbors(structure_context, domains, accessibility_data, args.contact_cutoff, args.neighbor_graph == 'compare')
+				with self.measure_stage('merge_conservations'):
+					merged_data = self.merge_conservations(conservations_file, neighbor_data)
+				
+				#every chain/domain is scored and written before the next one starts
+				with self.measure_stage('scoring'):
+					self.run_unit_scoring(merged_data, args.number_of_iterations, resultWriterObj.write_unit if resultWriterObj else None)
+		finally:
+			#finish the Parquet files also when the run fails or is cancelled
+			if resultWriterObj:
+				resultWriterObj.close()
 		
-		self.run_patch_evaluation(merged_data, args.number_of_iterations)
+		if args.merged_data_json:
+			with self.measure_stage('merged_data_json'):
+				with open(os.path.join(output_path, 'merged_data.json'), 'w') as fl:
+					json.dump(residue_tables_to_dict(merged_data), fl)
 		
-		with open(os.path.join(output_path, 'merged_data.json'), 'w') as fl:
-			json.dump(merged_data, fl)
+		if args.visualisation_export != 'none':
+			with self.measure_stage('visualisation_export'):
+				self.export_visualisation(merged_data, structure_context, pdb_file, args.number_of_iterations, output_path, args.visualisation_export)
 		
 		if args.create_pymol_session:
-			if is_pymol_installed:
-				self.create_pymol_session(merged_data, pdb_file, args.number_of_iterations, output_path)
+			if importlib.util.find_spec('pymol') is not None:
+				with pymol_lock, self.measure_stage('pymol_session'):
+					self.create_pymol_session(merged_data, pdb_file, args.number_of_iterations, output_path)
 			else:
-				logging.warning('Pymol is not installed, no pymol session will be created!')
+				logging.warning('Pymol is not installed, no pymol session will be created! Use --visualisation_export to export files which PyMOL can load.')
 
 if __name__ == "__main__":
 	pipelineStarterObj = PipelineStarter()
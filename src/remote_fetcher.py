@@ -0,0 +1,100 @@
+import os
+import threading
+import time
+import logging
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+class FetchCancelled(Exception):
+	pass
+
+class RemoteFetcher():
+	"""
+	HTTP access of the pipeline: one pooled session shared by all the downloads, with connect/read timeouts,
+	retries with exponential backoff on connection errors and 429/5xx responses, streaming of the files to disk,
+	and polling of the SLiM tools jobs with exponential backoff between the requests.
+	"""
+
+	def __init__(self, timeout=(10, 120), retries=4, backoff_factor=0.5, pool_size=8, poll_interval=1, max_poll_interval=30, max_poll_time=3600):
+		"""
+			:param timeout: (connect, read) timeouts of every request in seconds.
+			:param retries: retries of a failed request before giving up.
+			:param backoff_factor: the retries sleep backoff_factor*2^(retry-1) seconds.
+			:param pool_size: connections kept alive per host.
+			:param poll_interval: first sleep between the requests of a running job in seconds, doubled after every request.
+			:param max_poll_interval: maximum sleep between the requests of a running job in seconds.
+			:param max_poll_time: maximum time to wait for a running job in seconds.
+		"""
+		self.timeout = timeout
+		self.poll_interval = poll_interval
+		self.max_poll_interval = max_poll_interval
+		self.max_poll_time = max_poll_time
+		self.cancelled = threading.Event()
+
+		retry = Retry(total=retries, backoff_factor=backoff_factor, status_forcelist=[429, 500, 502, 503, 504], allowed_methods=['GET'], raise_on_status=False)
+		adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+		self.session = requests.Session()
+		self.session.mount('http://', adapter)
+		self.session.mount('https://', adapter)
+
+	def cancel(self):
+		"""
+		Stops the running polls and downloads of this fetcher at their next step.
+		"""
+		self.cancelled.set()
+
+	def check_cancelled(self):
+		if self.cancelled.is_set():
+			raise FetchCancelled('the fetch was cancelled')
+
+	def download(self, url, out_path, chunk_size=1<<20):
+		"""
+		Streams the response body of url into out_path. The file is written next to out_path and renamed when it is complete,
+		so an interrupted download never leaves a partial file at out_path. The partial file is removed if the download fails or is cancelled.
+		"""
+		self.check_cancelled()
+		part_path = out_path + '.part'
+		with self.session.get(url, stream=True, timeout=self.timeout) as resp:
+			resp.raise_for_status()
+			try:
+				with open(part_path, 'wb') as fl:
+					for chunk in resp.iter_content(chunk_size=chunk_size):
+						self.check_cancelled()
+						fl.write(chunk)
+			except BaseException:
+				try:
+					os.remove(part_path)
+				except OSError:
+					pass
+				raise
+		os.replace(part_path, out_path)
+		return out_path
+
+	def get_json(self, url):
+		self.check_cancelled()
+		resp = self.session.get(url, timeout=self.timeout)
+		resp.raise_for_status()
+		return resp.json()
+
+	def poll_json(self, url, finished_status=('Finished', 'Error', 'Success')):
+		"""
+		Requests url until the 'status' of the returned JSON is a finished one, sleeping between the requests with exponential backoff.
+		Returns the last JSON content.
+		"""
+		start = time.time()
+		interval = self.poll_interval
+		while True:
+			content = self.get_json(url)
+			if content['status'] in finished_status:
+				return content
+			if time.time() - start + interval > self.max_poll_time:
+				raise TimeoutError('job is still %s after %d seconds' % (content['status'], time.time() - start))
+			logging.debug('job status is %s, requesting again in %d seconds', content['status'], interval)
+			if self.cancelled.wait(interval):
+				raise FetchCancelled('the fetch was cancelled')
+			interval = min(interval*2, self.max_poll_interval)
+
+	def close(self):
+		self.session.close()
@@ -0,0 +1,136 @@
+import numpy as np
+import scipy.sparse as sp
+
+class ResidueTable():
+	"""
+	Columnar data of the residues of one chain/domain: NumPy columns of accessibility, conservation and the centrality scores of every iteration
+	(NaN where a residue has no value), the direct neighbors as a CSR structure over the residue indices, and the patches as arrays of residue indices.
+	"""
+
+	#residues with an accessibility over it are on the surface, a table can have its own (e.g. in parameter sweeps)
+	accessibility_threshold = 0.001
+
+	def __init__(self, residue_keys, accessibility, conservation, neighbor_indptr, neighbor_indices, conservation_values=None):
+		"""
+			:param residue_keys: list of the residue keys (resseq+icode).
+			:param accessibility: side chain accessibility of every residue, NaN if it is not accessible.
+			:param conservation: conservation score of every residue, NaN if it has none.
+			:param neighbor_indptr: CSR row pointers of the direct neighbors.
+			:param neighbor_indices: CSR residue indices of the direct neighbors.
+			:param conservation_values: optional list of the conservation scores as read from the conservations file (e.g. integers), written to merged_data.json instead of the column.
+		"""
+		self.residue_keys = residue_keys
+		self.accessibility = accessibility
+		self.conservation = conservation
+		self.conservation_values = conservation_values
+		self.neighbor_indptr = neighbor_indptr
+		self.neighbor_indices = neighbor_indices
+		self.scores = []
+		self.patches = []
+		self.patch_conservation_mean = []
+		self.patch_conservation_difference = []
+		self.patch_conservation_pvalue = []
+
+	def __len__(self):
+		return len(self.residue_keys)
+
+	def get_surface_mask(self):
+		"""
+		Returns the mask of the residues which are accessible and have a conservation score.
+		"""
+		with np.errstate(invalid='ignore'):
+			return (self.accessibility > self.accessibility_threshold) & ~np.isnan(self.conservation)
+
+	def get_neighbors_matrix(self):
+		"""
+		Returns the sparse matrix of the direct neighbors: matrix[i, j] is 1 if residue j is a direct neighbor of residue i.
+		"""
+		return sp.csr_matrix((np.ones(len(self.neighbor_indices)), self.neighbor_indices, self.neighbor_indptr), shape=(len(self), len(self)))
+
+	def add_scores(self, indices, scores):
+		"""
+		Adds the centrality scores of the next iteration for the residues at indices.
+		"""
+		column = np.full(len(self), np.nan)
+		column[indices] = scores
+		self.scores.append(column)
+
+	def add_patch(self, indices):
+		self.patches.append(np.asarray(indices))
+
+	def get_column(self, prop):
+		"""
+		Returns the column of a property named as in merged_data.json ('accessibility', 'conservation' or 'score_<iteration>').
+		The scores of an iteration that did not run are all NaN.
+		"""
+		if prop.startswith('score_'):
+			iteration = int(prop[len('score_'):])
+			return self.scores[iteration-1] if iteration <= len(self.scores) else np.full(len(self), np.nan)
+		return getattr(self, prop)
+
+	def to_dict(self):
+		"""
+		Returns the merged_data.json entry of the chain/domain.
+		"""
+		accessibility = self.accessibility.tolist()
+		conservation = self.conservation_values if self.conservation_values is not None else self.conservation.tolist()
+		scores = [column.tolist() for column in self.scores]
+		indptr = self.neighbor_indptr.tolist()
+		indices = self.neighbor_indices.tolist()
+
+		residues = {}
+		for i, residue in enumerate(self.residue_keys):
+			residue_data = {}
+			if accessibility[i] == accessibility[i]:
+				residue_data['accessibility'] = accessibility[i]
+			if indptr[i] < indptr[i+1]:
+				residue_data['direct_neighbors'] = [self.residue_keys[j] for j in indices[indptr[i]:indptr[i+1]]]
+			if self.conservation[i] == self.conservation[i]:
+				residue_data['conservation'] = conservation[i]
+			for patch_indx, column in enumerate(scores, 1):
+				if column[i] == column[i]:
+					residue_data['score_' + str(patch_indx)] = column[i]
+			residues[residue] = residue_data
+
+		data = {'residues': residues}
+		for patch_indx, patch in enumerate(self.patches, 1):
+			data['patch_' + str(patch_indx)] = {'residues': [self.residue_keys[i] for i in patch.tolist()]}
+			if patch_indx <= len(self.patch_conservation_mean):
+				data['patch_' + str(patch_indx)]['patch_conservation_mean'] = self.patch_conservation_mean[patch_indx-1]
+				data['patch_' + str(patch_indx)]['patch_conservation_difference'] = self.patch_conservation_difference[patch_indx-1]
+				data['patch_' + str(patch_indx)]['patch_conservation_pvalue'] = self.patch_conservation_pvalue[patch_indx-1]
+		return data
+
+def build_residue_table(chain_cons, accessible_residues, direct_neighbors):
+	"""
+	Builds the residue table of one chain/domain from its accessibility results and the conservation scores of its chain.
+	The residues are ordered as the keys of merged_data.json: the accessible residues, then the other residues having direct neighbors.
+	"""
+	residue_keys = list(accessible_residues)
+	index = {residue: i for i, residue in enumerate(residue_keys)}
+	for residue in direct_neighbors:
+		if residue not in index:
+			index[residue] = len(residue_keys)
+			residue_keys.append(residue)
+
+	accessibility = np.full(len(residue_keys), np.nan)
+	accessibility[:len(accessible_residues)] = [accessible_residues[residue]['side_chain_score'] for residue in accessible_residues]
+	conservation_values = [chain_cons[residue] if residue in chain_cons else None for residue in residue_keys]
+	conservation = np.array([np.nan if value is None else float(value) for value in conservation_values], dtype=float)
+
+	neighbor_counts = np.zeros(len(residue_keys), dtype=np.int64)
+	for residue in direct_neighbors:
+		neighbor_counts[index[residue]] = len(direct_neighbors[residue])
+	neighbor_indptr = np.concatenate(([0], np.cumsum(neighbor_counts)))
+	neighbor_indices = np.zeros(neighbor_indptr[-1], dtype=np.int32)
+	for residue in direct_neighbors:
+		i = index[residue]
+		neighbor_indices[neighbor_indptr[i]:neighbor_indptr[i+1]] = [index[nbr] for nbr in direct_neighbors[residue]]
+
+	return ResidueTable(residue_keys, accessibility, conservation, neighbor_indptr, neighbor_indices, conservation_values)
+
+def residue_tables_to_dict(merged_data):
+	"""
+	Returns the nested dicts of merged_data.json from the residue tables of every chain/domain.
+	"""
+	return {pdb_chain: {domain: merged_data[pdb_chain][domain].to_dict() for domain in merged_data[pdb_chain]} for pdb_chain in merged_data}
@@ -0,0 +1,261 @@
+import os
+import numpy as np
+
+try:
+	import pyarrow as pa
+	import pyarrow.parquet as pq
+	is_pyarrow_installed = True
+except:
+	is_pyarrow_installed = False
+
+results_dir_name = 'results'
+residue_columns = ['residue', 'accessibility', 'conservation', 'direct_neighbors']
+patch_columns = ['patch', 'residues', 'patch_conservation_mean', 'patch_conservation_difference', 'patch_conservation_pvalue']
+
+class ResultWriter():
+	"""
+	Writes the residue tables of a run into <output>/results as columnar files while the chains/domains finish:
+	one compressed .npz file per chain/domain, or two Parquet files (residues.parquet and patches.parquet) with one row group per chain/domain.
+	"""
+
+	def __init__(self, output_path, output_format, number_of_iterations):
+		"""
+			:param output_path: the output directory of the run.
+			:param output_format: 'npz' or 'parquet'.
+			:param number_of_iterations: maximum number of iterations, the Parquet files have a score column per iteration.
+		"""
+		if output_format == 'parquet' and not is_pyarrow_installed:
+			raise ImportError('pyarrow is required to write Parquet results.')
+		self.results_path = os.path.join(output_path, results_dir_name)
+		self.output_format = output_format
+		self.number_of_iterations = number_of_iterations
+		self.residues_writer = None
+		self.patches_writer = None
+		os.makedirs(self.results_path, exist_ok=True)
+
+	def write_unit(self, pdb_chain, domain, residue_table):
+		if self.output_format == 'parquet':
+			self.write_parquet_unit(pdb_chain, domain, residue_table)
+		else:
+			self.write_npz_unit(pdb_chain, domain, residue_table)
+
+	def write_npz_unit(self, pdb_chain, domain, residue_table):
+		columns = {
+			'chain': np.array(pdb_chain),
+			'domain': np.array(domain),
+			'residue': np.array(residue_table.residue_keys, dtype=str),
+			'accessibility': residue_table.accessibility,
+			'conservation': residue_table.conservation,
+			'direct_neighbors_indptr': residue_table.neighbor_indptr,
+			'direct_neighbors_indices': residue_table.neighbor_indices,
+			'patch_indptr': np.concatenate(([0], np.cumsum([len(patch) for patch in residue_table.patches], dtype=np.int64))),
+			'patch_residue_indices': np.concatenate(residue_table.patches).astype(np.int32) if residue_table.patches else np.zeros(0, dtype=np.int32),
+			'patch_conservation_mean': np.array(residue_table.patch_conservation_mean, dtype=float),
+			'patch_conservation_difference': np.array(residue_table.patch_conservation_difference, dtype=float),
+			'patch_conservation_pvalue': np.array(residue_table.patch_conservation_pvalue, dtype=float),
+		}
+		for patch_indx, column in enumerate(residue_table.scores, 1):
+			columns['score_' + str(patch_indx)] = column
+
+		file_path = os.path.join(self.results_path, pdb_chain + '_' + domain + '.npz')
+		tmp_path = file_path + '.tmp.npz'
+		np.savez_compressed(tmp_path, **columns)
+		os.replace(tmp_path, file_path)
+
+	def write_parquet_unit(self, pdb_chain, domain, residue_table):
+		size = len(residue_table)
+		indptr = residue_table.neighbor_indptr
+		residue_keys = np.array(residue_table.residue_keys, dtype=object)
+		residues = {
+			'chain': pa.array([pdb_chain]*size, type=pa.string()),
+			'domain': pa.array([domain]*size, type=pa.string()),
+			'residue': pa.array(residue_table.residue_keys, type=pa.string()),
+			'accessibility': residue_table.accessibility,
+			'conservation': residue_table.conservation,
+			'direct_neighbors': pa.ListArray.from_arrays(pa.array(indptr, type=pa.int32()), pa.array(residue_keys[residue_table.neighbor_indices].tolist(), type=pa.string())),
+		}
+		for patch_indx in range(1, self.number_of_iterations+1):
+			residues['score_' + str(patch_indx)] = residue_table.get_column('score_' + str(patch_indx))
+		residues = pa.table(residues)
+
+		number_of_patches = len(residue_table.patches)
+		evaluated = len(residue_table.patch_conservation_mean) == number_of_patches
+		patches = pa.table({
+			'chain': pa.array([pdb_chain]*number_of_patches, type=pa.string()),
+			'domain': pa.array([domain]*number_of_patches, type=pa.string()),
+			'patch': pa.array(range(1, number_of_patches+1), type=pa.int32()),
+			'residues': pa.array([residue_keys[patch].tolist() for patch in residue_table.patches], type=pa.list_(pa.string())),
+			'patch_conservation_mean': pa.array(residue_table.patch_conservation_mean if evaluated else [None]*number_of_patches, type=pa.float64()),
+			'patch_conservation_difference': pa.array(residue_table.patch_conservation_difference if evaluated else [None]*number_of_patches, type=pa.float64()),
+			'patch_conservation_pvalue': pa.array(residue_table.patch_conservation_pvalue if evaluated else [None]*number_of_patches, type=pa.float64()),
+		})
+
+		if self.residues_writer is None:
+			self.residues_writer = pq.ParquetWriter(os.path.join(self.results_path, 'residues.parquet'), residues.schema)
+			self.patches_writer = pq.ParquetWriter(os.path.join(self.results_path, 'patches.parquet'), patches.schema)
+		self.residues_writer.write_table(residues)
+		self.patches_writer.write_table(patches)
+
+	def close(self):
+		"""
+		Finishes the Parquet files. The .npz files are complete as soon as they are written.
+		"""
+		for writer in (self.residues_writer, self.patches_writer):
+			if writer is not None:
+				writer.close()
+		self.residues_writer = None
+		self.patches_writer = None
+
+class ResultReader():
+	"""
+	Reads the columnar results of one run, or of all the runs under a directory (e.g. a batch output), loading only the requested columns, proteins and chains/domains.
+	Every result table is returned as a dict of NumPy arrays with 'protein', 'chain' and 'domain' columns; the list columns (direct_neighbors, residues) are object arrays of lists.
+	"""
+
+	def __init__(self, path):
+		"""
+			:param path: the output directory of a run, or a directory containing run output directories.
+		"""
+		self.results_paths = {}
+		for root, dirs, files in os.walk(path):
+			if os.path.basename(root) == results_dir_name:
+				protein = os.path.relpath(os.path.dirname(root), path)
+				self.results_paths[protein if protein != '.' else os.path.basename(os.path.abspath(path))] = root
+				dirs[:] = []
+		self.results_paths = dict(sorted(self.results_paths.items()))
+
+	def get_proteins(self):
+		return list(self.results_paths)
+
+	def get_units(self, protein):
+		"""
+		Returns the (chain, domain) units of a protein.
+		"""
+		results_path = self.results_paths[protein]
+		if os.path.exists(os.path.join(results_path, 'residues.parquet')):
+			table = pq.read_table(os.path.join(results_path, 'residues.parquet'), columns=['chain', 'domain'])
+			return list(dict.fromkeys(zip(table.column('chain').to_pylist(), table.column('domain').to_pylist())))
+		units = []
+		for file_name in sorted(os.listdir(results_path)):
+			if file_name.endswith('.npz') and not file_name.endswith('.tmp.npz'):
+				with np.load(os.path.join(results_path, file_name)) as data:
+					units.append((str(data['chain']), str(data['domain'])))
+		return units
+
+	def read_residues(self, columns=None, proteins=None, chains=None, domains=None):
+		"""
+		Returns the per-residue columns: residue, accessibility, conservation, direct_neighbors and score_<iteration>.
+			:param columns: names of the columns to load, all of them if None.
+			:param proteins: proteins to load, all of them if None.
+			:param chains: chains to load, all of them if None.
+			:param domains: domains to load (as '1', '2', ...), all of them if None.
+		"""
+		return self.read('residues', columns, proteins, chains, domains)
+
+	def read_patches(self, columns=None, proteins=None, chains=None, domains=None):
+		"""
+		Returns the per-patch columns: patch, residues, patch_conservation_mean, patch_conservation_difference and patch_conservation_pvalue.
+		"""
+		return self.read('patches', columns, proteins, chains, domains)
+
+	def read(self, table_name, columns, proteins, chains, domains):
+		parts = []
+		for protein in (proteins if proteins is not None else self.results_paths):
+			results_path = self.results_paths[protein]
+			parquet_file = os.path.join(results_path, table_name + '.parquet')
+			if os.path.exists(parquet_file):
+				part = self.read_parquet(parquet_file, columns, chains, domains)
+			else:
+				part = self.read_npz(results_path, table_name, columns, chains, domains)
+			if part:
+				size = len(next(iter(part.values())))
+				part['protein'] = np.array([protein]*size, dtype=object)
+				parts.append(part)
+
+		if not parts:
+			return {}
+		names = list(dict.fromkeys(name for part in parts for name in part))
+		return {name: np.concatenate([part[name] if name in part else np.full(len(part['protein']), np.nan) for part in parts]) for name in names}
+
+	def read_parquet(self, parquet_file, columns, chains, domains):
+		filters = []
+		if chains is not None:
+			filters.append(('chain', 'in', list(chains)))
+		if domains is not None:
+			filters.append(('domain', 'in', [str(domain) for domain in domains]))
+		if columns is not None:
+			available = pq.read_schema(parquet_file).names
+			columns = ['chain', 'domain'] + [name for name in columns if name in available and name not in ('chain', 'domain')]
+		table = pq.read_table(parquet_file, columns=columns, filters=filters or None)
+		part = {}
+		#no rows match the filters, as with the .npz files
+		if table.num_rows == 0:
+			return part
+		for name in table.column_names:
+			column = table.column(name)
+			if pa.types.is_list(column.type) or pa.types.is_string(column.type):
+				array = np.empty(len(column), dtype=object)
+				array[:] = column.to_pylist()
+				part[name] = array
+			else:
+				part[name] = column.to_numpy()
+		return part
+
+	def read_npz(self, results_path, table_name, columns, chains, domains):
+		parts = []
+		for file_name in sorted(os.listdir(results_path)):
+			if not file_name.endswith('.npz') or file_name.endswith('.tmp.npz'):
+				continue
+			#npz members are loaded on access, so only the requested columns are decompressed
+			with np.load(os.path.join(results_path, file_name)) as data:
+				pdb_chain, domain = str(data['chain']), str(data['domain'])
+				if (chains is not None and pdb_chain not in chains) or (domains is not None and domain not in [str(d) for d in domains]):
+					continue
+				if table_name == 'residues':
+					part = self.get_npz_residues(data, columns)
+				else:
+					part = self.get_npz_patches(data, columns)
+			size = len(next(iter(part.values()))) if part else 0
+			part['chain'] = np.array([pdb_chain]*size, dtype=object)
+			part['domain'] = np.array([domain]*size, dtype=object)
+			parts.append(part)
+
+		if not parts:
+			return {}
+		names = list(dict.fromkeys(name for part in parts for name in part))
+		return {name: np.concatenate([part[name] if name in part else np.full(len(part['chain']), np.nan) for part in parts]) for name in names}
+
+	def get_npz_residues(self, data, columns):
+		names = columns if columns is not None else residue_columns + sorted([name for name in data.files if name.startswith('score_')], key=lambda name: int(name[len('score_'):]))
+		part = {}
+		residue_keys = None
+		for name in names:
+			if name == 'residue':
+				part[name] = data['residue'].astype(object)
+			elif name == 'direct_neighbors':
+				residue_keys = data['residue'].astype(object)
+				indptr, indices = data['direct_neighbors_indptr'], data['direct_neighbors_indices']
+				part[name] = np.empty(len(residue_keys), dtype=object)
+				part[name][:] = [residue_keys[indices[indptr[i]:indptr[i+1]]].tolist() for i in range(len(residue_keys))]
+			elif name in data.files:
+				part[name] = data[name]
+			elif name.startswith('score_'):
+				part[name] = np.full(len(data['accessibility']), np.nan)
+		return part
+
+	def get_npz_patches(self, data, columns):
+		names = columns if columns is not None else patch_columns
+		indptr = data['patch_indptr']
+		part = {}
+		for name in names:
+			if name == 'patch':
+				part[name] = np.arange(1, len(indptr), dtype=np.int32)
+			elif name == 'residues':
+				residue_keys = data['residue'].astype(object)
+				indices = data['patch_residue_indices']
+				part[name] = np.empty(len(indptr)-1, dtype=object)
+				part[name][:] = [residue_keys[indices[indptr[i]:indptr[i+1]]].tolist() for i in range(len(indptr)-1)]
+			elif name in data.files:
+				column = data[name]
+				part[name] = column if len(column) == len(indptr)-1 else np.full(len(indptr)-1, np.nan)
+		return part
@@ -0,0 +1,190 @@
+import contextlib
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+
+try:
+	import resource
+	is_resource_available = True
+except:
+	is_resource_available = False
+
+profile_choices = ['none', 'cprofile', 'tracemalloc', 'all']
+#tracemalloc.reset_peak is new in Python 3.9, without it the measures have no traced peak of their own
+is_reset_peak_available = hasattr(tracemalloc, 'reset_peak')
+
+#the runs in this process (e.g. the concurrent jobs of the service), a counter of their starts and the runs tracing memory: tracemalloc has one peak for the whole process,
+#which every run resets, so a measure is traced only if no other run was active while it was measured
+active_runs_lock = threading.Lock()
+active_runs = {'count': 0, 'starts': 0, 'tracing': 0, 'started_tracemalloc': False}
+
+def get_active_runs():
+	with active_runs_lock:
+		return active_runs['count'], active_runs['starts']
+
+def get_peak_rss_mb():
+	"""
+	Returns the peak resident memory of the process in MB, or None where it is not available.
+	"""
+	if not is_resource_available:
+		return None
+	peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	#ru_maxrss is in kilobytes on Linux and in bytes on macOS
+	return peak/(1024*1024) if sys.platform == 'darwin' else peak/1024
+
+class RunMetrics():
+	"""
+	Collects the metrics record of one run: the wall time and peak memory of every stage, and per (chain, domain) the wall time and peak memory
+	of its stages with the sizes of its triangulation, cavity peeling, residue graph and eigen-solver runs. It is saved as metrics.json in the output.
+	The peak resident memory is the peak of the whole process so far; when tracemalloc is on, every measure also has the peak memory allocated by Python during it.
+	tracemalloc counts the allocations of all the threads, so the measures overlapping another run in the same process have no traced peak, and the record
+	has traced_memory_skipped set. So do all the measures before Python 3.9, which can not reset the traced peak.
+	"""
+
+	def __init__(self, profile='none'):
+		"""
+			:param profile: 'cprofile' to profile the run with cProfile, 'tracemalloc' to trace the Python allocations, 'all' for both, or 'none'.
+		"""
+		self.profile = profile
+		self.record = {'stages': [], 'units': []}
+		self.units = {}
+		self.frames = []
+		self.profiler = None
+		self.started_tracemalloc = False
+		self.start = None
+		self.running = False
+		self.run_starts = None
+
+	def start_run(self):
+		self.start = time.perf_counter()
+		with active_runs_lock:
+			active_runs['count'] += 1
+			active_runs['starts'] += 1
+			self.run_starts = active_runs['starts']
+			self.running = True
+			if self.profile in ('tracemalloc', 'all'):
+				#tracemalloc is started by the first tracing run and stopped by the last one, unless it was started outside of the runs
+				active_runs['tracing'] += 1
+				self.started_tracemalloc = True
+				if not tracemalloc.is_tracing():
+					tracemalloc.start()
+					active_runs['started_tracemalloc'] = True
+		if self.profile in ('cprofile', 'all'):
+			self.profiler = cProfile.Profile()
+			try:
+				self.profiler.enable()
+			except ValueError as e:
+				#only one profiler can run at a time, e.g. with concurrent jobs of the service
+				logging.warning('cProfile is not available for this run: %s', e)
+				self.profiler = None
+
+	def finish_run(self, output_path):
+		"""
+		Stops the profilers and saves metrics.json, and the cProfile statistics (profile.pstats and the top functions in profile.txt) if they were collected.
+		"""
+		if self.profiler is not None:
+			self.profiler.disable()
+			self.profiler.dump_stats(os.path.join(output_path, 'profile.pstats'))
+			stream = io.StringIO()
+			pstats.Stats(self.profiler, stream=stream).sort_stats('cumulative').print_stats(50)
+			with open(os.path.join(output_path, 'profile.txt'), 'w') as fl:
+				fl.write(stream.getvalue())
+			self.profiler = None
+		with active_runs_lock:
+			if self.running:
+				if tracemalloc.is_tracing() and active_runs['count'] == 1 and active_runs['starts'] == self.run_starts:
+					self.record['traced_peak_mb'] = tracemalloc.get_traced_memory()[1]/(1024*1024)
+				active_runs['count'] -= 1
+				self.running = False
+			if self.started_tracemalloc:
+				active_runs['tracing'] -= 1
+				self.started_tracemalloc = False
+				if active_runs['tracing'] == 0 and active_runs['started_tracemalloc']:
+					tracemalloc.stop()
+					active_runs['started_tracemalloc'] = False
+
+		self.record['seconds'] = time.perf_counter() - self.start if self.start is not None else None
+		self.record['peak_rss_mb'] = get_peak_rss_mb()
+		for unit in self.units.values():
+			unit['seconds'] = sum(metrics['seconds'] for metrics in unit.values() if isinstance(metrics, dict) and 'seconds' in metrics)
+		self.record['units'] = list(self.units.values())
+		with open(os.path.join(output_path, 'metrics.json'), 'w') as fl:
+			json.dump(self.record, fl, indent=1)
+
+	@contextlib.contextmanager
+	def measure(self):
+		"""
+		Measures the wall time and the peak memory of the block into the yielded dict. Measures can be nested, e.g. the units of a stage.
+		"""
+		count, starts = get_active_runs()
+		tracing = is_reset_peak_available and tracemalloc.is_tracing() and count <= 1
+		frame = {'traced_peak': 0}
+		if tracing:
+			#keep the peak of the enclosing measure before resetting it for this one
+			if self.frames:
+				self.frames[-1]['traced_peak'] = max(self.frames[-1]['traced_peak'], tracemalloc.get_traced_memory()[1])
+			tracemalloc.reset_peak()
+		self.frames.append(frame)
+		metrics = {}
+		start = time.perf_counter()
+		try:
+			yield metrics
+		finally:
+			metrics['seconds'] = time.perf_counter() - start
+			metrics['peak_rss_mb'] = get_peak_rss_mb()
+			self.frames.pop()
+			if tracing and tracemalloc.is_tracing() and get_active_runs() != (count, starts):
+				#another run started during the measure, its allocations and peak resets are mixed in
+				tracing = False
+			if self.profile in ('tracemalloc', 'all') and not tracing:
+				self.record['traced_memory_skipped'] = True
+			if tracing and tracemalloc.is_tracing():
+				traced_peak = max(frame['traced_peak'], tracemalloc.get_traced_memory()[1])
+				metrics['traced_peak_mb'] = traced_peak/(1024*1024)
+				if self.frames:
+					self.frames[-1]['traced_peak'] = max(self.frames[-1]['traced_peak'], traced_peak)
+
+	@contextlib.contextmanager
+	def stage(self, name):
+		"""
+		Measures a pipeline stage and adds it to the stages of the record, with the error if the stage failed.
+		"""
+		#the metrics are bound before the measure, which may fail before it yields its own
+		metrics = {}
+		try:
+			with self.measure() as metrics:
+				yield metrics
+		except BaseException as e:
+			metrics['error'] = repr(e)
+			raise
+		finally:
+			self.record['stages'].append({'stage': name, **metrics})
+
+	@contextlib.contextmanager
+	def unit_stage(self, pdb_chain, domain, name):
+		"""
+		Measures the stage of one (chain, domain) unit and adds it to the unit metrics, with the error if the stage failed.
+		"""
+		metrics = {}
+		try:
+			with self.measure() as metrics:
+				yield metrics
+		except BaseException as e:
+			metrics['error'] = repr(e)
+			raise
+		finally:
+			self.add_unit_metrics(pdb_chain, domain, {name: metrics})
+
+	def add_unit_metrics(self, pdb_chain, domain, metrics):
+		unit = self.units.setdefault((pdb_chain, domain), {'chain': pdb_chain, 'domain': domain})
+		unit.update(metrics)
+
+	def get_unit_metrics(self, pdb_chain, domain):
+		return self.units.get((pdb_chain, domain), {})
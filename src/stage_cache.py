@@ -0,0 +1,182 @@
+import os
+import json
+import pickle
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+import time
+
+class StageCache():
+	"""
+	On-disk cache of the downloaded files and of the results of the expensive stages.
+	Every entry is stored under the sha256 of its stage name and of the inputs it depends on (file contents by hash, parameters by value),
+	so a rerun reuses the stages whose inputs did not change. When the cache grows over max_size bytes the least recently used entries are removed.
+	The modification time of an entry is the time it was written, and its access time the time it was last used.
+	The stage results are loaded with pickle, which can run any code, so the cache directory must be trusted and writable only by its users.
+	"""
+
+	#bump it when the output of a cached stage changes, to ignore the entries of the older code
+	cache_version = 1
+
+	def __init__(self, cache_dir, max_size):
+		"""
+			:param cache_dir: directory of the cache entries.
+			:param max_size: maximum total size of the cache entries in bytes.
+		"""
+		self.cache_dir = cache_dir
+		self.max_size = max_size
+		self.file_hashes = {}
+		#total size of the entries, scanned once and then updated by every write, the cache is only scanned again to evict entries over max_size
+		self.total_size = None
+		self.lock = threading.Lock()
+		os.makedirs(cache_dir, exist_ok=True)
+
+	def file_hash(self, file_path):
+		"""
+		Returns the sha256 of the file content, computed once per file version (path, size and modification time).
+		"""
+		stat = os.stat(file_path)
+		file_id = (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+		if file_id not in self.file_hashes:
+			sha = hashlib.sha256()
+			with open(file_path, 'rb') as fl:
+				for chunk in iter(lambda: fl.read(1 << 20), b''):
+					sha.update(chunk)
+			self.file_hashes[file_id] = sha.hexdigest()
+		return self.file_hashes[file_id]
+
+	def get_key(self, stage, **inputs):
+		"""
+		Returns the cache key of a stage run on the given inputs, which should be JSON serializable (file contents should be passed by their file_hash).
+		"""
+		description = json.dumps({'stage': stage, 'version': self.cache_version, 'inputs': inputs}, sort_keys=True, default=int)
+		return hashlib.sha256(description.encode()).hexdigest()
+
+	def get_entry_path(self, key):
+		return os.path.join(self.cache_dir, key[:2], key)
+
+	def lookup(self, key, max_age=None):
+		"""
+		Returns the path of a cached entry and marks it as recently used, or None if it is not cached.
+			:param max_age: if given, an entry written more than max_age seconds ago is not used.
+		"""
+		entry_path = self.get_entry_path(key)
+		try:
+			stat = os.stat(entry_path)
+		except OSError:
+			return None
+		now = time.time()
+		if max_age is not None and now - stat.st_mtime > max_age:
+			return None
+		try:
+			os.utime(entry_path, (now, stat.st_mtime))
+		except OSError:
+			pass
+		return entry_path
+
+	def get_file(self, key, out_path, max_age=None):
+		"""
+		Copies a cached file to out_path. Returns out_path, or None if it is not cached (or older than max_age seconds).
+		"""
+		entry_path = self.lookup(key, max_age)
+		if entry_path is None:
+			return None
+		shutil.copyfile(entry_path, out_path)
+		return out_path
+
+	def put_file(self, key, file_path):
+		self.store(key, lambda tmp_path: shutil.copyfile(file_path, tmp_path))
+
+	def get(self, key, default=None, max_age=None):
+		"""
+		Returns a cached stage result, or default if it is not cached (or older than max_age seconds) or can not be read.
+		"""
+		entry_path = self.lookup(key, max_age)
+		if entry_path is None:
+			return default
+		try:
+			with open(entry_path, 'rb') as fl:
+				return pickle.load(fl)
+		except Exception as e:
+			logging.warning('Ignoring unreadable cache entry %s: %s', entry_path, e)
+			return default
+
+	def put(self, key, value):
+		def write(tmp_path):
+			with open(tmp_path, 'wb') as fl:
+				pickle.dump(value, fl, protocol=pickle.HIGHEST_PROTOCOL)
+		self.store(key, write)
+
+	def store(self, key, write):
+		"""
+		Writes a cache entry through a temporary file renamed into place, then evicts the least recently used entries if the cache is over the size limit.
+		The temporary file has a unique name, so threads and processes writing the same entry do not collide.
+		A cache that can not be written is only logged, the pipeline does not depend on it.
+		"""
+		entry_path = self.get_entry_path(key)
+		tmp_path = None
+		try:
+			os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+			fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(entry_path), prefix=key + '.', suffix='.tmp')
+			os.close(fd)
+			write(tmp_path)
+			size = os.path.getsize(tmp_path)
+			#the cache may be shared by threads, replace the entry and account its size under the lock
+			with self.lock:
+				replaced_size = os.path.getsize(entry_path) if os.path.exists(entry_path) else 0
+				os.replace(tmp_path, entry_path)
+				self.update_size(size - replaced_size)
+		except OSError as e:
+			logging.warning('Could not write cache entry %s: %s', entry_path, e)
+			if tmp_path and os.path.exists(tmp_path):
+				os.remove(tmp_path)
+
+	def update_size(self, added_size):
+		"""
+		Adds the size of a written entry to the total size, and evicts entries if the total is over the size limit. Called with the lock held.
+		"""
+		if self.total_size is None:
+			self.total_size = self.scan()[1]
+		else:
+			self.total_size += added_size
+		if self.total_size > self.max_size:
+			self.evict()
+
+	def scan(self):
+		"""
+		Returns the (last use time, size, path) of every entry and their total size.
+		"""
+		entries = []
+		total_size = 0
+		for root, _, files in os.walk(self.cache_dir):
+			for file_name in files:
+				if file_name.endswith('.tmp'):
+					continue
+				entry_path = os.path.join(root, file_name)
+				try:
+					stat = os.stat(entry_path)
+				except OSError:
+					continue
+				entries.append((stat.st_atime, stat.st_size, entry_path))
+				total_size += stat.st_size
+		return entries, total_size
+
+	def evict(self):
+		"""
+		Removes the least recently used entries until the cache is under the size limit. The entries are scanned again, as other processes
+		may have written or removed entries too.
+		"""
+		entries, total_size = self.scan()
+		entries.sort()
+		for _, size, entry_path in entries:
+			if total_size <= self.max_size:
+				break
+			try:
+				os.remove(entry_path)
+				total_size -= size
+				logging.debug('Evicted cache entry %s', entry_path)
+			except OSError:
+				pass
+		self.total_size = total_size
@@ -0,0 +1,195 @@
+import os
+import re
+
+import numpy as np
+
+#the B-factor of an exported atom is its residue value times this factor, so that the two decimals of a PDB file keep four digits of the scores
+bfactor_scale = 100
+#the values which fit in the 6 characters of the B-factor column of a PDB file
+pdb_bfactor_range = (-99.99, 999.99)
+export_dir_name = 'visualisation'
+
+def get_resi_selection(residue_keys, chain_keys=()):
+	"""
+	Returns a compact PyMOL resi expression of residue keys (resseq+icode), with the runs of consecutive residues as ranges, e.g. 1-40+42+45A.
+	A PyMOL range also selects the insertion code residues within it, so a number having an unselected insertion code residue in the chain ends the runs.
+		:param residue_keys: the residue keys to select.
+		:param chain_keys: the residue keys of the whole chain.
+	"""
+	selected = set(residue_keys)
+	split_numbers = {int(re.match(r'\d+', residue).group()) for residue in chain_keys if residue not in selected and not residue.isdigit() and residue[:1].isdigit()}
+	numbers = []
+	others = []
+	for residue in residue_keys:
+		if residue.isdigit() and int(residue) not in split_numbers:
+			numbers.append(int(residue))
+		else:
+			#insertion codes, numbers with insertion codes and negative numbers are listed one by one, PyMOL needs the minus sign escaped
+			others.append(residue.replace('-', '\\-'))
+
+	parts = []
+	numbers = sorted(set(numbers))
+	start = 0
+	for i in range(1, len(numbers)+1):
+		if i == len(numbers) or numbers[i] != numbers[i-1] + 1:
+			parts.append(str(numbers[start]) if start == i-1 else '%d-%d' % (numbers[start], numbers[i-1]))
+			start = i
+	return '+'.join(parts + others)
+
+def get_pdb_bfactor_scale(values):
+	"""
+	Returns the factor of the PDB B-factors of a property: bfactor_scale, or a smaller power of ten if the scaled values would not fit in the B-factor column.
+	The same factor is used for all the atoms, so the colours of a spectrum over the B-factors do not change.
+	"""
+	scale = bfactor_scale
+	finite = values[np.isfinite(values)]
+	if len(finite):
+		low, high = finite.min(), finite.max()
+		while scale > 1e-12 and (high*scale > pdb_bfactor_range[1] or low*scale < pdb_bfactor_range[0]):
+			scale /= 10
+	return scale
+
+def cif_quote(value):
+	"""
+	Returns a value as an mmCIF token, quoted when it has spaces or starts like a CIF keyword, and '.' when it is empty.
+	"""
+	if value == '':
+		return '.'
+	if ' ' in value or value[0] in '_#$;[]\'"' or value.lower().startswith(('data_', 'loop_', 'save_', 'global_', 'stop_')):
+		return '"' + value + '"' if '"' not in value else "'" + value + "'"
+	return value
+
+class StructureExporter():
+	"""
+	Writes the results as a visualisation which needs no PyMOL to create: one copy of the structure per property (conservation and the centrality scores
+	of every iteration) with the property in the B-factor column, and a PyMOL script (.pml) loading them with the same colours as the PyMOL session
+	and a selection per patch. The atom records are formatted once, and only the B-factor column changes between the files.
+	The B-factors are the values times bfactor_scale; in a PDB file a property with values too large for the B-factor column is scaled by a smaller
+	power of ten, given in a REMARK and in the PyMOL script.
+	"""
+
+	def __init__(self, atoms, number_of_iterations):
+		"""
+			:param atoms: the atom array of the structure (e.g. StructureContext.model).
+			:param number_of_iterations: maximum number of iterations, a file is written for every iteration.
+		"""
+		self.atoms = atoms
+		self.props = ['conservation'] + ['score_' + str(patch_indx) for patch_indx in range(1, number_of_iterations+1)]
+		self.residue_keys = np.char.add(atoms['resseq'].astype(str), np.char.strip(atoms['icode']))
+
+	def get_atom_values(self, merged_data):
+		"""
+		Returns the values of every property for every atom, as a (properties x atoms) array. As in the PyMOL session, the residues of a chain/domain
+		without a value have the lowest value of the chain/domain, and the residues outside every chain/domain have 0.
+		"""
+		residue_rows = {}
+		residue_values = []
+		for pdb_chain in merged_data:
+			for domain in merged_data[pdb_chain]:
+				residue_table = merged_data[pdb_chain][domain]
+				columns = []
+				for prop in self.props:
+					column = residue_table.get_column(prop)
+					has_value = ~np.isnan(column)
+					columns.append(np.where(has_value, column, column[has_value].min() if has_value.any() else 0))
+				for i, residue in enumerate(residue_table.residue_keys):
+					residue_rows[(pdb_chain, residue)] = len(residue_values) + i
+				residue_values.extend(np.column_stack(columns) if columns else [])
+
+		#map every atom to its residue row once, the last row is the zeros of the residues without values
+		residue_values = np.vstack(residue_values + [np.zeros(len(self.props))])
+		atom_rows = np.array([residue_rows.get(key, -1) for key in zip(self.atoms['chain'].tolist(), self.residue_keys.tolist())], dtype=np.int64)
+		return residue_values[atom_rows].T
+
+	def get_pdb_records(self):
+		"""
+		Returns the two fixed parts of the PDB record of every atom, before and after the B-factor column.
+		"""
+		if len(self.atoms) and max(len(chain) for chain in self.atoms['chain'].tolist()) > 1:
+			raise ValueError('the structure has chain ids longer than one character, which PDB files can not hold, export it as mmCIF.')
+		prefixes = []
+		suffixes = []
+		for serial, atom in enumerate(self.atoms.tolist(), 1):
+			_, hetero, chain, resseq, icode, resname, name, altloc, element, occupancy, _, (x, y, z) = atom
+			atom_name = name if len(name) >= 4 or len(element) == 2 else ' ' + name
+			prefixes.append('%-6s%5d %-4s%1s%3s %1s%4d%1s   %8.3f%8.3f%8.3f%6.2f' % ('ATOM' if hetero == ' ' else 'HETATM', serial % 100000, atom_name, altloc, resname, chain, resseq, icode, x, y, z, occupancy))
+			suffixes.append('          %2s\n' % element)
+		return prefixes, suffixes
+
+	def get_cif_records(self):
+		"""
+		Returns the _atom_site rows of every atom without the B-factor, which is the last column.
+		"""
+		rows = []
+		for serial, atom in enumerate(self.atoms.tolist(), 1):
+			_, hetero, chain, resseq, icode, resname, name, altloc, element, occupancy, _, (x, y, z) = atom
+			rows.append(' '.join(('ATOM' if hetero == ' ' else 'HETATM', str(serial), cif_quote(element), cif_quote(name), cif_quote(altloc.strip()), cif_quote(resname),
+				cif_quote(chain), str(resseq), cif_quote(icode.strip()) if icode.strip() else '?', '%.3f' % x, '%.3f' % y, '%.3f' % z, '%.2f' % occupancy, '1')) + ' ')
+		return rows
+
+	def export(self, merged_data, output_path, file_stem, output_format='pdb'):
+		"""
+		Writes <file_stem>.<property>.pdb (or .cif) for every property and <file_stem>.pml into <output_path>/visualisation. Returns the directory.
+			:param output_format: 'pdb' or 'mmcif'.
+		"""
+		export_path = os.path.join(output_path, export_dir_name)
+		os.makedirs(export_path, exist_ok=True)
+		atom_values = self.get_atom_values(merged_data)
+		extension = '.pdb' if output_format == 'pdb' else '.cif'
+		scales = {}
+
+		if output_format == 'pdb':
+			prefixes, suffixes = self.get_pdb_records()
+		else:
+			rows = self.get_cif_records()
+			header = 'data_%s\n#\nloop_\n' % file_stem + ''.join('_atom_site.%s\n' % name for name in ('group_PDB', 'id', 'type_symbol', 'label_atom_id', 'label_alt_id', 'label_comp_id',
+				'auth_asym_id', 'auth_seq_id', 'pdbx_PDB_ins_code', 'Cartn_x', 'Cartn_y', 'Cartn_z', 'occupancy', 'pdbx_PDB_model_num', 'B_iso_or_equiv'))
+
+		for prop, values in zip(self.props, atom_values):
+			scales[prop] = get_pdb_bfactor_scale(values) if output_format == 'pdb' else bfactor_scale
+			values = values*scales[prop]
+			with open(os.path.join(export_path, file_stem + '.' + prop + extension), 'w') as fl:
+				if output_format == 'pdb':
+					#the clip only catches values which round up out of the column
+					values = np.clip(values, *pdb_bfactor_range)
+					fl.write('REMARK 999 B-FACTORS ARE THE %s VALUES TIMES %g\n' % (prop.upper(), scales[prop]))
+					fl.write(''.join([prefix + '%6.2f' % value + suffix for prefix, value, suffix in zip(prefixes, values.tolist(), suffixes)]))
+					fl.write('END\n')
+				else:
+					fl.write(header)
+					fl.write(''.join([row + '%.4f\n' % value for row, value in zip(rows, values.tolist())]))
+					fl.write('#\n')
+
+		with open(os.path.join(export_path, file_stem + '.pml'), 'w') as fl:
+			fl.write(self.get_pml_script(merged_data, file_stem, extension, scales))
+		return export_path
+
+	def get_pml_script(self, merged_data, file_stem, extension, scales=None):
+		"""
+		Returns a PyMOL script which loads the exported files, colours every chain/domain by its own range of values and selects the patches of every iteration.
+		The paths are relative, run it from the visualisation directory (e.g. pymol <file_stem>.pml).
+			:param scales: the factor of the B-factors of every property, bfactor_scale by default.
+		"""
+		lines = []
+		for prop in self.props:
+			lines.append('# the B-factors of %s are its values times %g' % (prop, (scales or {}).get(prop, bfactor_scale)))
+			lines.append('load %s, %s' % (file_stem + '.' + prop + extension, prop))
+		lines += ['hide everything', 'show surface', 'color white']
+		chain_keys = {}
+		for pdb_chain, residue in set(zip(self.atoms['chain'].tolist(), self.residue_keys.tolist())):
+			chain_keys.setdefault(pdb_chain, set()).add(residue)
+		for pdb_chain in merged_data:
+			for domain in merged_data[pdb_chain]:
+				residue_table = merged_data[pdb_chain][domain]
+				if not len(residue_table):
+					continue
+				unit_selector = 'chain %s and resi %s' % (pdb_chain, get_resi_selection(residue_table.residue_keys, chain_keys.get(pdb_chain, ())))
+				for prop in self.props:
+					lines.append('spectrum b, white_blue_red, %s and %s' % (prop, unit_selector))
+				for patch_indx, patch in enumerate(residue_table.patches[:len(self.props)-1], 1):
+					patch_residues = [residue_table.residue_keys[i] for i in patch.tolist()]
+					lines.append('select %s%s.patch_%d, score_%d and chain %s and resi %s' % (pdb_chain, domain, patch_indx, patch_indx, pdb_chain, get_resi_selection(patch_residues, chain_keys.get(pdb_chain, ()))))
+		for prop in self.props[1:]:
+			lines.append('disable ' + prop)
+		lines += ['deselect', 'zoom', 'bg_color white']
+		return '\n'.join(lines) + '\n'
@@ -0,0 +1,376 @@
+import gzip
+import os
+import re
+
+import numpy as np
+
+try:
+	import msgpack
+	is_msgpack_installed = True
+except:
+	is_msgpack_installed = False
+
+# Array-backed structure reader. It loads only the atom fields the pipeline uses straight into a NumPy structured array,
+# instead of building a Bio.PDB object tree. PDB, mmCIF and BinaryCIF files are supported, optionally gzip-compressed.
+
+atom_dtype = np.dtype([
+	('model', np.int32),
+	('hetero', 'U1'),
+	('chain', 'U4'),
+	('resseq', np.int32),
+	('icode', 'U1'),
+	('resname', 'U5'),
+	('name', 'U4'),
+	('altloc', 'U1'),
+	('element', 'U2'),
+	('occupancy', np.float32),
+	('bfactor', np.float32),
+	('coord', np.float32, (3,)),
+])
+
+cif_token_pattern = re.compile(r"""'(?:[^']|'(?!\s|$))*'|"(?:[^"]|"(?!\s|$))*"|\S+""")
+
+def open_structure_file(path):
+	"""
+	Returns the raw content of a structure file, decompressing it if it is gzip-compressed
+		:param path: path to the structure file.
+	"""
+	with open(path, 'rb') as fl:
+		content = fl.read()
+	if content[:2] == b'\x1f\x8b':
+		content = gzip.decompress(content)
+	return content
+
+def get_structure_format(path, content):
+	"""
+	Returns 'pdb', 'mmcif' or 'bcif' based on the file extension, or on the content if the extension is unknown
+		:param path: path to the structure file.
+		:param content: the raw (decompressed) content of the file.
+	"""
+	name = os.path.basename(path).lower()
+	if name.endswith('.gz'):
+		name = name[:-3]
+	extension = os.path.splitext(name)[1]
+	if extension in ('.pdb', '.ent'):
+		return 'pdb'
+	if extension in ('.cif', '.mmcif'):
+		return 'mmcif'
+	if extension == '.bcif':
+		return 'bcif'
+	if content[:1] and (0x80 <= content[0] <= 0x8f or content[0] in (0xde, 0xdf)):
+		return 'bcif'
+	if content.lstrip()[:5] == b'data_':
+		return 'mmcif'
+	return 'pdb'
+
+def read_structure(path):
+	"""
+	Reads a PDB, mmCIF or BinaryCIF file (optionally gzip-compressed) into a structured array of atom_dtype
+		:param path: path to the structure file.
+	"""
+	content = open_structure_file(path)
+	structure_format = get_structure_format(path, content)
+	if structure_format == 'bcif':
+		return read_bcif(content)
+	if structure_format == 'mmcif':
+		return read_mmcif(content.decode('utf-8', 'replace'))
+	return read_pdb(content)
+
+def iter_structure_models(path):
+	"""
+	Yields the atom array of every model of a structure file, one model at a time. PDB files are read block by block, so that only one model
+	is held in memory; mmCIF and BinaryCIF files are read whole and split by model.
+		:param path: path to the structure file.
+	"""
+	with open(path, 'rb') as fl:
+		compressed = fl.read(2) == b'\x1f\x8b'
+	opener = gzip.open if compressed else open
+	with opener(path, 'rb') as fl:
+		structure_format = get_structure_format(path, fl.read(4096))
+
+	if structure_format != 'pdb':
+		atoms = read_structure(path)
+		if len(atoms):
+			models, first = np.unique(atoms['model'], return_index=True)
+			for model in models[np.argsort(first)]:
+				yield atoms[atoms['model'] == model]
+		return
+
+	model = 0
+	with opener(path, 'rb') as fl:
+		atom_lines = []
+		for line in fl:
+			record_type = line[:6]
+			if record_type == b'ATOM  ' or record_type == b'HETATM':
+				atom_lines.append(line)
+			elif record_type == b'ENDMDL' and atom_lines:
+				atoms = read_pdb(b''.join(atom_lines))
+				atoms['model'] = model
+				yield atoms
+				model += 1
+				atom_lines = []
+		if atom_lines:
+			atoms = read_pdb(b''.join(atom_lines))
+			atoms['model'] = model
+			yield atoms
+
+def guess_elements(names, fullnames):
+	"""
+	Guesses the element from the atom name, as Bio.PDB does when the element column is blank
+		:param names: stripped atom names.
+		:param fullnames: atom names with their PDB spacing.
+	"""
+	elements = []
+	for name, fullname in zip(names, fullnames):
+		if fullname[:1].isalpha() and not fullname[2:].isdigit():
+			element = name
+		elif name[:1].isdigit():
+			element = name[1:2]
+		else:
+			element = name[:1]
+		elements.append(element.upper()[:2])
+	return elements
+
+def read_pdb(content):
+	"""
+	Parses the ATOM/HETATM records of PDB-format content with fixed-width column slicing
+		:param content: PDB file content as bytes.
+	"""
+	lines = content.splitlines()
+	models = []
+	atom_lines = []
+	model = 0
+	model_open = False
+	for line in lines:
+		record_type = line[:6]
+		if record_type == b'ATOM  ' or record_type == b'HETATM':
+			model_open = True
+			atom_lines.append(line)
+			models.append(model)
+		elif record_type == b'ENDMDL':
+			if model_open:
+				model += 1
+			model_open = False
+
+	atoms = np.zeros(len(atom_lines), dtype=atom_dtype)
+	if not atom_lines:
+		return atoms
+
+	columns = np.array([line.ljust(80)[:80] for line in atom_lines], dtype='S80').view(np.uint8).reshape(-1, 80)
+	def column(start, end):
+		return np.ascontiguousarray(columns[:, start:end]).view('S%d' % (end-start)).ravel()
+	def text_column(start, end):
+		return np.char.strip(np.char.decode(column(start, end), 'ascii', 'replace'))
+	def float_column(start, end, default):
+		values = np.char.strip(column(start, end))
+		values[values == b''] = default
+		return values.astype(np.float32)
+
+	record_types = column(0, 6)
+	resnames = text_column(17, 20)
+	atoms['model'] = models
+	atoms['hetero'] = np.where(record_types == b'HETATM', np.where(np.isin(resnames, ['HOH', 'WAT']), 'W', 'H'), ' ')
+	atoms['chain'] = np.char.decode(column(21, 22), 'ascii', 'replace')
+	atoms['resseq'] = column(22, 26).astype(np.int32)
+	atoms['icode'] = np.char.decode(column(26, 27), 'ascii', 'replace')
+	atoms['resname'] = resnames
+	atoms['name'] = text_column(12, 16)
+	atoms['altloc'] = np.char.decode(column(16, 17), 'ascii', 'replace')
+	atoms['occupancy'] = float_column(54, 60, b'0')
+	atoms['bfactor'] = float_column(60, 66, b'0')
+	atoms['coord'][:, 0] = float_column(30, 38, b'0')
+	atoms['coord'][:, 1] = float_column(38, 46, b'0')
+	atoms['coord'][:, 2] = float_column(46, 54, b'0')
+
+	elements = np.char.upper(text_column(76, 78))
+	blank = elements == ''
+	if blank.any():
+		fullnames = np.char.decode(column(12, 16), 'ascii', 'replace')
+		elements[blank] = guess_elements(atoms['name'][blank], fullnames[blank])
+	atoms['element'] = elements
+
+	return atoms
+
+def get_cif_atom_site(content):
+	"""
+	Returns the _atom_site loop of mmCIF content as a dictionary of column name to list of values. A ;-delimited text field is one value
+	(its lines joined by newlines); a loop with an unterminated text field or a partial row raises ValueError
+		:param content: mmCIF file content as str.
+	"""
+	names = []
+	tokens = []
+	in_atom_site = False
+	reading_values = False
+	#the lines of a ;-delimited text field of the loop, which is one value
+	text_field = None
+	for line in content.splitlines():
+		if text_field is not None:
+			if line.startswith(';'):
+				tokens.append('\n'.join(text_field))
+				text_field = None
+				line = line[1:]
+				if not line.strip():
+					continue
+			else:
+				text_field.append(line)
+				continue
+		elif in_atom_site and line.startswith(';'):
+			reading_values = True
+			text_field = [line[1:]]
+			continue
+		if in_atom_site:
+			if line.startswith('_atom_site.') and not reading_values:
+				names.append(line.split()[0][len('_atom_site.'):])
+				continue
+			if not line or line[0] in '_#' or line.startswith('loop_') or line.startswith('data_'):
+				if reading_values:
+					break
+				continue
+			reading_values = True
+			if "'" in line or '"' in line:
+				tokens.extend(token[1:-1] if token[0] in '\'"' else token for token in cif_token_pattern.findall(line))
+			else:
+				tokens.extend(line.split())
+		elif line.startswith('_atom_site.'):
+			in_atom_site = True
+			names.append(line.split()[0][len('_atom_site.'):])
+
+	if not names:
+		return {}
+	if text_field is not None:
+		raise ValueError('Unterminated ; text field in the _atom_site loop')
+	if len(tokens) % len(names):
+		raise ValueError('The _atom_site loop has %d values, which is not a multiple of its %d columns' % (len(tokens), len(names)))
+	values = np.array(tokens, dtype=object).reshape(-1, len(names))
+	return {name: values[:, i] for i, name in enumerate(names)}
+
+def read_mmcif(content):
+	"""
+	Parses the _atom_site loop of mmCIF content
+		:param content: mmCIF file content as str.
+	"""
+	return atoms_from_cif_columns(get_cif_atom_site(content))
+
+def atoms_from_cif_columns(atom_site):
+	"""
+	Builds the atom array from _atom_site columns, following the Bio.PDB.MMCIFParser choice of label/auth fields
+		:param atom_site: a dictionary of _atom_site column name to array of values.
+	"""
+	if not atom_site:
+		return np.zeros(0, dtype=atom_dtype)
+
+	def text(name, fallback=None):
+		values = atom_site.get(name)
+		if values is None and fallback:
+			values = atom_site.get(fallback)
+		if values is None:
+			return None
+		values = np.asarray(values).astype(str)
+		return np.where(np.isin(values, ['.', '?']), '', values)
+
+	def number(name, default):
+		values = text(name)
+		if values is None:
+			return default
+		values = values.astype(object)
+		values[values == ''] = default
+		return values.astype(np.float64)
+
+	resnames = text('label_comp_id', 'auth_comp_id')
+	atoms = np.zeros(len(resnames), dtype=atom_dtype)
+
+	group = text('group_PDB')
+	if group is None:
+		group = np.full(len(atoms), 'ATOM')
+	atoms['hetero'] = np.where(group == 'HETATM', np.where(np.isin(resnames, ['HOH', 'WAT']), 'W', 'H'), ' ')
+
+	model_numbers = text('pdbx_PDB_model_num')
+	if model_numbers is not None:
+		_, first_indices, model_ids = np.unique(model_numbers, return_index=True, return_inverse=True)
+		rank = np.empty(len(first_indices), dtype=np.int32)
+		rank[np.argsort(first_indices)] = np.arange(len(first_indices))
+		atoms['model'] = rank[model_ids.ravel()]
+
+	atoms['chain'] = text('auth_asym_id', 'label_asym_id')
+	atoms['resseq'] = number('auth_seq_id', 0) if 'auth_seq_id' in atom_site else number('label_seq_id', 0)
+	icodes = text('pdbx_PDB_ins_code')
+	atoms['icode'] = np.where(icodes == '', ' ', icodes) if icodes is not None else ' '
+	atoms['resname'] = resnames
+	atoms['name'] = text('label_atom_id', 'auth_atom_id')
+	altlocs = text('label_alt_id')
+	atoms['altloc'] = np.where(altlocs == '', ' ', altlocs) if altlocs is not None else ' '
+	elements = text('type_symbol')
+	atoms['element'] = np.char.upper(elements) if elements is not None else guess_elements(atoms['name'], atoms['name'])
+	atoms['occupancy'] = number('occupancy', 1.0)
+	atoms['bfactor'] = number('B_iso_or_equiv', 0.0)
+	atoms['coord'][:, 0] = number('Cartn_x', 0.0)
+	atoms['coord'][:, 1] = number('Cartn_y', 0.0)
+	atoms['coord'][:, 2] = number('Cartn_z', 0.0)
+
+	return atoms
+
+bcif_types = {1: '<i1', 2: '<i2', 3: '<i4', 4: '<u1', 5: '<u2', 6: '<u4', 32: '<f4', 33: '<f8'}
+
+def decode_bcif_data(data, encodings):
+	"""
+	Decodes a BinaryCIF encoded column by applying its encodings in reverse order
+		:param data: the encoded bytes.
+		:param encodings: the list of encoding descriptions of the column.
+	"""
+	for encoding in reversed(encodings):
+		kind = encoding['kind']
+		if kind == 'ByteArray':
+			data = np.frombuffer(data, dtype=bcif_types[encoding['type']])
+		elif kind == 'FixedPoint':
+			data = np.asarray(data, dtype=np.float64)/encoding['factor']
+		elif kind == 'IntervalQuantization':
+			step = (encoding['max']-encoding['min'])/max(encoding['numSteps']-1, 1)
+			data = encoding['min'] + step*np.asarray(data, dtype=np.float64)
+		elif kind == 'RunLength':
+			data = np.asarray(data, dtype=np.int64)
+			data = np.repeat(data[0::2], data[1::2])
+		elif kind == 'Delta':
+			data = np.cumsum(np.asarray(data, dtype=np.int64))
+			data += encoding['origin']
+		elif kind == 'IntegerPacking':
+			data = np.asarray(data, dtype=np.int64)
+			if encoding['isUnsigned']:
+				limits = [(1 << (8*encoding['byteCount']))-1]
+			else:
+				limits = [(1 << (8*encoding['byteCount']-1))-1, -(1 << (8*encoding['byteCount']-1))]
+			# a value at a limit is continued by the next one
+			ends = ~np.isin(data, limits)
+			if len(data):
+				starts = np.concatenate(([0], np.flatnonzero(ends)[:-1]+1))
+				data = np.add.reduceat(data, starts) if len(starts) else data[:0]
+		elif kind == 'StringArray':
+			offsets = decode_bcif_data(encoding['offsets'], encoding['offsetEncoding'])
+			string_data = encoding['stringData']
+			strings = np.array([string_data[offsets[i]:offsets[i+1]] for i in range(len(offsets)-1)] + [''], dtype=object)
+			indices = decode_bcif_data(data, encoding['dataEncoding'])
+			data = strings[np.where(indices < 0, len(strings)-1, indices)]
+		else:
+			raise ValueError('Unsupported BinaryCIF encoding %s' % kind)
+	return data
+
+def read_bcif(content):
+	"""
+	Parses the _atom_site category of BinaryCIF content (requires msgpack)
+		:param content: BinaryCIF file content as bytes.
+	"""
+	if not is_msgpack_installed:
+		raise ImportError('msgpack is required to read BinaryCIF files.')
+
+	data = msgpack.unpackb(content, raw=False)
+	atom_site = {}
+	for category in data['dataBlocks'][0]['categories']:
+		if category['name'].lstrip('_') == 'atom_site':
+			for column in category['columns']:
+				values = decode_bcif_data(column['data']['data'], column['data']['encoding'])
+				if column.get('mask'):
+					mask = decode_bcif_data(column['mask']['data'], column['mask']['encoding'])
+					values = np.asarray(values, dtype=object)
+					values[mask != 0] = '?'
+				atom_site[column['name']] = np.asarray(values).astype(str)
+			break
+	return atoms_from_cif_columns(atom_site)
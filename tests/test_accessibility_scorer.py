@@ -0,0 +1,43 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+from scipy.spatial import Delaunay
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from accessibility_scorer import AccessibilityScorer, face_vertices
+
+def get_scorer(size, seed):
+	coords = np.random.default_rng(seed).normal(scale=10, size=(size, 3))
+	return AccessibilityScorer(coords, ['%d_ALA_CA' % i for i in range(size)]), Delaunay(coords).simplices
+
+def assert_face_table(accessibilityScorerObj, simplices):
+	all_faces = np.sort(simplices, axis=1)[:, face_vertices].reshape(-1, 3)
+	unique_faces, counts = np.unique(all_faces, axis=0, return_counts=True)
+	order = np.lexsort(accessibilityScorerObj.faces.T[::-1])
+	assert np.array_equal(accessibilityScorerObj.faces[order], unique_faces)
+	assert np.array_equal(accessibilityScorerObj.faces_count[order], counts)
+	#every tetrahedron points to its own faces, and every face to the tetrahedrons having it
+	assert np.array_equal(accessibilityScorerObj.faces[accessibilityScorerObj.tetrahedrons_faces].reshape(-1, 3), all_faces)
+	tetrahedrons = np.arange(len(simplices))[:, None]
+	assert ((accessibilityScorerObj.faces_tetrahedrons1[accessibilityScorerObj.tetrahedrons_faces] == tetrahedrons) | (accessibilityScorerObj.faces_tetrahedrons2[accessibilityScorerObj.tetrahedrons_faces] == tetrahedrons)).all()
+
+@pytest.mark.parametrize('size', [5, 200, 3000])
+def test_face_table(size):
+	accessibilityScorerObj, simplices = get_scorer(size, size)
+	accessibilityScorerObj.build_face_table(simplices)
+	assert_face_table(accessibilityScorerObj, simplices)
+
+def test_face_table_without_int64_keys():
+	"""
+	With more atoms than an int64 key per vertex triple can hold, the faces are deduplicated on the vertex triples, to the same table.
+	"""
+	accessibilityScorerObj, simplices = get_scorer(200, 1)
+	accessibilityScorerObj.build_face_table(simplices)
+	faces = accessibilityScorerObj.faces
+	accessibilityScorerObj.coords = np.zeros((3000000, 0))
+	accessibilityScorerObj.build_face_table(simplices)
+	assert_face_table(accessibilityScorerObj, simplices)
+	assert np.array_equal(accessibilityScorerObj.faces, faces)
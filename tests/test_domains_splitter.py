@@ -0,0 +1,25 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
+
+from domains_splitter import AlphafoldDomainsSplitter
+from structure_reader import read_structure
+from synthetic_inputs import SyntheticInputsGenerator
+
+@pytest.mark.parametrize('integer_pae', [False, True])
+def test_louvain_matches_greedy(tmp_path, integer_pae):
+	"""
+	Three domains of 250, 250 and 230 residues. With the integer PAE the diagonal is 0, which must not give infinite edge weights.
+	"""
+	pdb_file, _, pae_file = SyntheticInputsGenerator(750, integer_pae=integer_pae).write(str(tmp_path))
+	atoms = read_structure(pdb_file)
+	atoms = atoms[atoms['name'] == 'CA']
+	alphafoldDomainsSplitterObj = AlphafoldDomainsSplitter()
+	domains = alphafoldDomainsSplitterObj.domains_from_pae_matrix_louvain(pae_file, atoms)
+	reference_domains = alphafoldDomainsSplitterObj.domains_from_pae_matrix_networkx(pae_file, atoms)
+	assert sorted(len(domain) for domain in domains) == [230, 250, 250]
+	assert sorted(map(sorted, domains)) == sorted(map(sorted, reference_domains))
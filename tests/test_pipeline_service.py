@@ -0,0 +1,69 @@
+import argparse
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from pipeline_service import PipelineService
+from pipeline_starter import PipelineStarter
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+	"""
+	A service with one job thread, whose jobs wait until the test releases them instead of running the pipeline.
+	"""
+	release = threading.Event()
+	def run_job(self, job, args, pipelineStarterObj):
+		release.wait(10)
+		with self.jobs_lock:
+			job['status'] = 'done'
+			job['finished'] = 0
+			del job['pipeline']
+	monkeypatch.setattr(PipelineService, 'run_job', run_job)
+
+	parser = argparse.ArgumentParser()
+	PipelineStarter().add_pipeline_arguments(parser)
+	pipeline_defaults = vars(parser.parse_args(['--output', str(tmp_path / 'output'), '--input', str(tmp_path / 'input'), '--cache_size', '0']))
+	service = PipelineService(pipeline_defaults, 1, 2)
+	yield service
+	release.set()
+
+def wait_for_status(service, job_id, status):
+	for _ in range(500):
+		if service.get_status(job_id)['status'] == status:
+			return
+		threading.Event().wait(0.01)
+	raise AssertionError('the job is not ' + status)
+
+def test_cancelled_jobs_leave_the_queue(service):
+	options = {'pdb_file': 'structure.pdb', 'conservations_file': 'conservations.json'}
+	running = service.submit(options)
+	wait_for_status(service, running['job_id'], 'running')
+	queued = [service.submit(options) for _ in range(2)]
+	with pytest.raises(OverflowError):
+		service.submit(options)
+
+	#the cancelled jobs are still in the job queue, but no longer count against its size
+	for job in queued:
+		assert service.cancel(job['job_id'])['status'] == 'cancelled'
+	assert service.get_health()['queued'] == 0
+	for _ in range(2):
+		assert service.submit(options)['status'] == 'queued'
+	with pytest.raises(OverflowError):
+		service.submit(options)
+
+@pytest.mark.parametrize('options', [
+	{'pdb_file': 'structure.pdb', 'conservations_file': 'conservations.json', 'input': '/'},
+	{'pdb_file': 'structure.pdb', 'conservations_file': 'conservations.json', 'cache_dir': '/tmp'},
+	{'pdb_file': 'structure.pdb', 'conservations_file': 'conservations.json', 'output': '/tmp'},
+	{'pdb_file': 'structure.pdb', 'conservations_file': 'conservations.json', 'slim_server': 'http://127.0.0.1/'},
+	{'pdb_file': '../structure.pdb', 'conservations_file': 'conservations.json'},
+	{'pdb_file': '/etc/structure.pdb', 'conservations_file': 'conservations.json'},
+	{'pdb_file': 'structure.pdb', 'conservations_file': 'conservations.json', 'predicted_aligned_error_file': '..'},
+])
+def test_restricted_options(service, options):
+	with pytest.raises(ValueError):
+		service.submit(options)
@@ -0,0 +1,172 @@
+import argparse
+import http.server
+import json
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+pytest.importorskip('requests')
+
+from remote_fetcher import RemoteFetcher, FetchCancelled
+from pipeline_starter import PipelineStarter
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+	"""
+	Serves the routes of the stand-in server: /file streams a file body, /job answers 'running' until its 'done_after' request,
+	/flaky fails with 503 before serving the file, and everything else is 404. Every request is recorded with its time.
+	"""
+
+	def do_GET(self):
+		server = self.server
+		with server.lock:
+			server.requests.append((self.path, time.monotonic()))
+			count = sum(1 for path, _ in server.requests if path == self.path)
+		route = self.path.split('?')[0]
+		if route == '/file':
+			self.send_response(200)
+			self.send_header('Content-Length', str(len(server.file_body)))
+			self.end_headers()
+			half = len(server.file_body)//2
+			self.wfile.write(server.file_body[:half])
+			self.wfile.flush()
+			#the rest of the file is sent when the test lets it go
+			server.release_file.wait(10)
+			self.wfile.write(server.file_body[half:])
+		elif route == '/flaky' and count == 1:
+			self.send_error(503)
+		elif route == '/flaky':
+			self.send_json_body(200, b'flaky done')
+		elif route.endswith('/evolution') or route == '/job':
+			status = 'Success' if server.done_after and count >= server.done_after else 'running'
+			self.send_json_body(200, json.dumps({'status': status, 'data': {}}).encode())
+		else:
+			self.send_error(404)
+
+	def send_json_body(self, code, body):
+		self.send_response(code)
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, format, *args):
+		pass
+
+@pytest.fixture
+def server():
+	server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+	server.daemon_threads = True
+	server.lock = threading.Lock()
+	server.requests = []
+	server.file_body = os.urandom(1 << 16)
+	server.release_file = threading.Event()
+	server.done_after = 3
+	server.url = 'http://127.0.0.1:%d' % server.server_address[1]
+	thread = threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True)
+	thread.start()
+	yield server
+	server.release_file.set()
+	server.shutdown()
+	server.server_close()
+
+def test_streamed_download(server, tmp_path):
+	remoteFetcherObj = RemoteFetcher(timeout=(5, 10))
+	out_path = str(tmp_path / 'structure.pdb')
+	download = threading.Thread(target=remoteFetcherObj.download, args=(server.url + '/file', out_path))
+	download.start()
+	try:
+		#while the body is streamed, only the .part file exists
+		deadline = time.monotonic() + 5
+		while not os.path.exists(out_path + '.part') and time.monotonic() < deadline:
+			time.sleep(0.01)
+		assert os.path.exists(out_path + '.part')
+		assert not os.path.exists(out_path)
+	finally:
+		server.release_file.set()
+		download.join(10)
+	with open(out_path, 'rb') as fl:
+		assert fl.read() == server.file_body
+	assert not os.path.exists(out_path + '.part')
+
+def test_cancelled_download(server, tmp_path):
+	remoteFetcherObj = RemoteFetcher(timeout=(5, 10))
+	out_path = str(tmp_path / 'structure.pdb')
+	errors = []
+	def download():
+		try:
+			remoteFetcherObj.download(server.url + '/file', out_path)
+		except FetchCancelled as e:
+			errors.append(e)
+	download_thread = threading.Thread(target=download)
+	download_thread.start()
+	try:
+		deadline = time.monotonic() + 5
+		while not os.path.exists(out_path + '.part') and time.monotonic() < deadline:
+			time.sleep(0.01)
+		assert os.path.exists(out_path + '.part')
+		remoteFetcherObj.cancel()
+	finally:
+		server.release_file.set()
+		download_thread.join(10)
+	assert len(errors) == 1
+	assert not os.path.exists(out_path + '.part')
+	assert not os.path.exists(out_path)
+
+def test_retry_on_server_error(server, tmp_path):
+	remoteFetcherObj = RemoteFetcher(timeout=(5, 10), backoff_factor=0)
+	out_path = str(tmp_path / 'flaky.txt')
+	remoteFetcherObj.download(server.url + '/flaky', out_path)
+	with open(out_path, 'rb') as fl:
+		assert fl.read() == b'flaky done'
+	assert [path for path, _ in server.requests] == ['/flaky', '/flaky']
+
+def test_poll_backoff(server):
+	remoteFetcherObj = RemoteFetcher(timeout=(5, 10), poll_interval=0.1, max_poll_interval=0.15)
+	content = remoteFetcherObj.poll_json(server.url + '/job')
+	assert content['status'] == 'Success'
+	times = [request_time for _, request_time in server.requests]
+	assert len(times) == 3
+	#the first sleep is poll_interval, the second is doubled and capped by max_poll_interval
+	assert 0.1 <= times[1] - times[0] < 0.15 + 1
+	assert 0.15 <= times[2] - times[1] < 0.15 + 1
+
+def test_poll_timeout(server):
+	server.done_after = None
+	remoteFetcherObj = RemoteFetcher(timeout=(5, 10), poll_interval=0.05, max_poll_time=0.3)
+	with pytest.raises(TimeoutError):
+		remoteFetcherObj.poll_json(server.url + '/job')
+
+def test_cancelled_poll(server):
+	server.done_after = None
+	remoteFetcherObj = RemoteFetcher(timeout=(5, 10), poll_interval=30)
+	threading.Timer(0.2, remoteFetcherObj.cancel).start()
+	start = time.monotonic()
+	with pytest.raises(FetchCancelled):
+		remoteFetcherObj.poll_json(server.url + '/job')
+	assert time.monotonic() - start < 10
+
+def test_failed_download_cancels_the_others(server, tmp_path):
+	"""
+	The structure download fails while the SLiM tools jobs are still running, which stops their polls instead of waiting for them.
+	"""
+	server.done_after = None
+	pipelineStarterObj = PipelineStarter()
+	parser = argparse.ArgumentParser()
+	pipelineStarterObj.add_pipeline_arguments(parser)
+	args = parser.parse_args(['--uniprot', 'P00000', '--split_into_domains', 'false', '--input', str(tmp_path),
+		'--alphafold_server', server.url + '/missing/', '--slim_server', server.url + '/slim/'])
+	assert pipelineStarterObj.check_args(args) is None
+
+	start = time.monotonic()
+	with pytest.raises(SystemExit):
+		pipelineStarterObj.fetch_inputs(args, str(tmp_path))
+	#the polls sleep at least a second after their first request, without the cancel they would keep polling for an hour
+	assert time.monotonic() - start < 10
+	assert pipelineStarterObj.get_remote_fetcher().cancelled.is_set()
+	paths = [path for path, _ in server.requests]
+	assert sum(1 for path in paths if path.startswith('/slim/')) <= 4
+	assert not [name for name in os.listdir(tmp_path) if name.endswith('.json')]
@@ -0,0 +1,108 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from residue_table import ResidueTable
+from result_store import ResultWriter, ResultReader
+
+number_of_iterations = 2
+
+def get_residue_table(rng, size, number_of_scores, evaluated):
+	residue_keys = [str(i+1) for i in range(size)]
+	accessibility = rng.random(size)
+	accessibility[-2:] = np.nan
+	conservation = rng.random(size)
+	conservation[0] = np.nan
+	neighbor_counts = rng.integers(0, 4, size=size)
+	neighbor_indptr = np.concatenate(([0], np.cumsum(neighbor_counts)))
+	neighbor_indices = rng.integers(0, size, size=neighbor_indptr[-1]).astype(np.int32)
+	residue_table = ResidueTable(residue_keys, accessibility, conservation, neighbor_indptr, neighbor_indices)
+	for _ in range(number_of_scores):
+		indices = np.flatnonzero(~np.isnan(accessibility))
+		residue_table.add_scores(indices, rng.random(len(indices)))
+		residue_table.add_patch(rng.choice(indices, size=3, replace=False))
+	if evaluated:
+		residue_table.patch_conservation_mean = rng.random(number_of_scores).tolist()
+		residue_table.patch_conservation_difference = rng.random(number_of_scores).tolist()
+		residue_table.patch_conservation_pvalue = rng.random(number_of_scores).tolist()
+	return residue_table
+
+def write_runs(path, output_format):
+	"""
+	Writes the results of two runs: P1 with chains A and B, P2 with chain A, and returns their merged_data.
+	The chain B has only one iteration and no patch evaluation.
+	"""
+	rng = np.random.default_rng(0)
+	runs = {
+		'P1': {'A': {'1': get_residue_table(rng, 12, 2, True)}, 'B': {'1': get_residue_table(rng, 9, 1, False)}},
+		'P2': {'A': {'1': get_residue_table(rng, 7, 2, True)}},
+	}
+	for protein, merged_data in runs.items():
+		resultWriterObj = ResultWriter(os.path.join(path, protein), output_format, number_of_iterations)
+		try:
+			for pdb_chain in merged_data:
+				for domain in merged_data[pdb_chain]:
+					resultWriterObj.write_unit(pdb_chain, domain, merged_data[pdb_chain][domain])
+		finally:
+			resultWriterObj.close()
+	return runs
+
+def get_rows(table, protein, pdb_chain, domain):
+	rows = (table['protein'] == protein) & (table['chain'] == pdb_chain) & (table['domain'] == domain)
+	return {name: column[rows] for name, column in table.items()}
+
+def assert_residues(residues, runs):
+	for protein, merged_data in runs.items():
+		for pdb_chain in merged_data:
+			for domain, residue_table in merged_data[pdb_chain].items():
+				rows = get_rows(residues, protein, pdb_chain, domain)
+				assert rows['residue'].tolist() == residue_table.residue_keys
+				for name in residues:
+					if name in ('accessibility', 'conservation') or name.startswith('score_'):
+						assert np.allclose(rows[name], residue_table.get_column(name), equal_nan=True)
+				if 'direct_neighbors' in residues:
+					indptr, indices = residue_table.neighbor_indptr, residue_table.neighbor_indices
+					assert rows['direct_neighbors'].tolist() == [[residue_table.residue_keys[j] for j in indices[indptr[i]:indptr[i+1]]] for i in range(len(residue_table))]
+
+def assert_patches(patches, runs):
+	for protein, merged_data in runs.items():
+		for pdb_chain in merged_data:
+			for domain, residue_table in merged_data[pdb_chain].items():
+				rows = get_rows(patches, protein, pdb_chain, domain)
+				number_of_patches = len(residue_table.patches)
+				assert rows['patch'].tolist() == list(range(1, number_of_patches+1))
+				assert rows['residues'].tolist() == [[residue_table.residue_keys[i] for i in patch] for patch in residue_table.patches]
+				for name in ('patch_conservation_mean', 'patch_conservation_difference', 'patch_conservation_pvalue'):
+					expected = getattr(residue_table, name) or [np.nan]*number_of_patches
+					assert np.allclose(rows[name].astype(float), expected, equal_nan=True)
+
+@pytest.mark.parametrize('output_format', ['npz', 'parquet'])
+def test_round_trip(tmp_path, output_format):
+	if output_format == 'parquet':
+		pytest.importorskip('pyarrow')
+	runs = write_runs(str(tmp_path), output_format)
+	resultReaderObj = ResultReader(str(tmp_path))
+	assert resultReaderObj.get_proteins() == ['P1', 'P2']
+	assert resultReaderObj.get_units('P1') == [('A', '1'), ('B', '1')]
+
+	residues = resultReaderObj.read_residues()
+	assert set(residues) == {'protein', 'chain', 'domain', 'residue', 'accessibility', 'conservation', 'direct_neighbors', 'score_1', 'score_2'}
+	assert len(residues['residue']) == 12 + 9 + 7
+	assert_residues(residues, runs)
+	assert_patches(resultReaderObj.read_patches(), runs)
+
+	#only the requested columns, proteins and chains are loaded
+	residues = resultReaderObj.read_residues(columns=['residue', 'score_2'])
+	assert set(residues) == {'protein', 'chain', 'domain', 'residue', 'score_2'}
+	assert_residues(residues, runs)
+	residues = resultReaderObj.read_residues(proteins=['P1'], chains=['B'])
+	assert set(residues['protein']) == {'P1'} and set(residues['chain']) == {'B'}
+	assert_residues(residues, {'P1': {'B': runs['P1']['B']}})
+	patches = resultReaderObj.read_patches(proteins=['P2'], domains=[1])
+	assert set(patches['protein']) == {'P2'}
+	assert_patches(patches, {'P2': runs['P2']})
+	assert resultReaderObj.read_residues(chains=['C']) == {}
@@ -0,0 +1,70 @@
+import json
+import os
+import sys
+import tracemalloc
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import run_metrics
+from run_metrics import RunMetrics
+
+def test_overlapping_runs(tmp_path):
+	"""
+	The measures of a traced run taken while another run is active in the process have no traced peak, the others have one.
+	"""
+	traced_run = RunMetrics('tracemalloc')
+	traced_run.start_run()
+	with traced_run.stage('alone'):
+		pass
+	other_run = RunMetrics()
+	other_run.start_run()
+	with traced_run.stage('overlapping'):
+		pass
+	with other_run.stage('other'):
+		pass
+	other_run.finish_run(str(tmp_path))
+	with open(os.path.join(tmp_path, 'metrics.json')) as fl:
+		other_record = json.load(fl)
+	assert tracemalloc.is_tracing()
+	with traced_run.stage('after'):
+		pass
+	traced_run.finish_run(str(tmp_path))
+	with open(os.path.join(tmp_path, 'metrics.json')) as fl:
+		record = json.load(fl)
+
+	assert ['traced_peak_mb' in stage for stage in record['stages']] == [True, False, True]
+	assert record['traced_memory_skipped']
+	assert 'traced_peak_mb' not in record
+	assert 'traced_memory_skipped' not in other_record
+	assert not tracemalloc.is_tracing()
+
+def test_without_reset_peak(tmp_path, monkeypatch):
+	monkeypatch.setattr(run_metrics, 'is_reset_peak_available', False)
+	runMetricsObj = RunMetrics('tracemalloc')
+	runMetricsObj.start_run()
+	with runMetricsObj.stage('stage'):
+		pass
+	runMetricsObj.finish_run(str(tmp_path))
+	with open(os.path.join(tmp_path, 'metrics.json')) as fl:
+		record = json.load(fl)
+	assert 'traced_peak_mb' not in record['stages'][0]
+	assert record['traced_memory_skipped']
+
+def test_failed_measure(tmp_path, monkeypatch):
+	"""
+	A measure failing before it yields raises its own error, and the stage is recorded with it.
+	"""
+	def get_active_runs():
+		raise RuntimeError('no runs')
+	monkeypatch.setattr(run_metrics, 'get_active_runs', get_active_runs)
+	runMetricsObj = RunMetrics()
+	with pytest.raises(RuntimeError):
+		with runMetricsObj.stage('stage'):
+			pass
+	with pytest.raises(RuntimeError):
+		with runMetricsObj.unit_stage('A', 'D1', 'scoring'):
+			pass
+	assert runMetricsObj.record['stages'] == [{'stage': 'stage', 'error': "RuntimeError('no runs')"}]
+	assert runMetricsObj.get_unit_metrics('A', 'D1')['scoring'] == {'error': "RuntimeError('no runs')"}
@@ -0,0 +1,35 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from stage_cache import StageCache
+
+def test_max_age(tmp_path):
+	stageCacheObj = StageCache(str(tmp_path / 'cache'), 1 << 20)
+	key = stageCacheObj.get_key('download', url='http://example.org/file')
+	stageCacheObj.put(key, 'content')
+	assert stageCacheObj.get(key, max_age=60) == 'content'
+
+	#an entry written two hours ago is too old for a max_age of an hour, also after it was used
+	entry_path = stageCacheObj.get_entry_path(key)
+	written = time.time() - 2*60*60
+	os.utime(entry_path, (written, written))
+	assert stageCacheObj.get(key) == 'content'
+	assert stageCacheObj.get(key, max_age=60*60) is None
+	assert stageCacheObj.get(key, max_age=3*60*60) == 'content'
+
+def test_evicts_least_recently_used(tmp_path):
+	stageCacheObj = StageCache(str(tmp_path / 'cache'), 2500)
+	keys = [stageCacheObj.get_key('stage', index=index) for index in range(3)]
+	for index, key in enumerate(keys[:2]):
+		stageCacheObj.put(key, b'x'*1000)
+		past = time.time() - 100 + index
+		os.utime(stageCacheObj.get_entry_path(key), (past, past))
+	#using the older entry makes the other one the least recently used
+	assert stageCacheObj.get(keys[0]) == b'x'*1000
+	stageCacheObj.put(keys[2], b'x'*1000)
+	assert stageCacheObj.get(keys[0]) is not None
+	assert stageCacheObj.get(keys[1]) is None
+	assert stageCacheObj.get(keys[2]) is not None
@@ -0,0 +1,66 @@
+import os
+import sys
+import warnings
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from pdb_parser import StructureContext
+
+pytest.importorskip('Bio.PDB')
+
+input_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'input')
+sample_pdb_file = os.path.join(input_path, 'AF-Q9Y2M5-F1-model_v2.pdb')
+
+pytestmark = pytest.mark.skipif(not os.path.exists(sample_pdb_file), reason='the sample protein is not in the input directory')
+
+def write_point_mutation(out_file, mutant, occupancies, mutant_first=False, mutant_record='ATOM  ', altlocs=True):
+	"""
+	Writes the sample protein with a point mutation of residue 10: its atoms, and the backbone atoms of the mutant residue.
+	"""
+	with open(sample_pdb_file) as fl:
+		lines = fl.read().splitlines()
+	residue = [line for line in lines if line.startswith('ATOM') and int(line[22:26]) == 10]
+	wild_type = [line[:16] + ('A' if altlocs else ' ') + line[17:54] + '%6.2f' % occupancies[0] + line[60:] for line in residue]
+	mutated = [mutant_record + line[6:16] + ('B' if altlocs else ' ') + mutant + line[20:54] + '%6.2f' % occupancies[1] + line[60:]
+		for line in residue if line[12:16].strip() in ('N', 'CA', 'C', 'O')]
+	start = lines.index(residue[0])
+	lines[start:start+len(residue)] = mutated + wild_type if mutant_first else wild_type + mutated
+	with open(out_file, 'w') as fl:
+		fl.write('\n'.join(lines) + '\n')
+
+def bio_clean_atoms(pdb_file):
+	from bio_pdb_parser import read_clean_pdb
+	atoms = []
+	for atom in read_clean_pdb(pdb_file, 'A', None).get_atoms():
+		if atom.element == 'H':
+			continue
+		residue = atom.get_parent()
+		atoms.append((str(residue.id[1]) + residue.id[2].strip() + '_' + residue.get_resname() + '_' + atom.get_id(), tuple(np.round(atom.coord, 3))))
+	return atoms
+
+@pytest.mark.parametrize('mutant, occupancies, mutant_first, mutant_record, altlocs', [
+	('GLY', (0.6, 0.4), False, 'ATOM  ', True),
+	('GLY', (0.4, 0.6), False, 'ATOM  ', True),
+	('GLY', (0.4, 0.6), True, 'ATOM  ', True),
+	('MSE', (0.6, 0.4), True, 'ATOM  ', True),
+	('MSE', (0.4, 0.6), False, 'HETATM', True),
+	('GLY', (1.0, 1.0), False, 'ATOM  ', False),
+])
+def test_point_mutation(tmp_path, mutant, occupancies, mutant_first, mutant_record, altlocs):
+	from Bio.PDB import Selection
+	from Bio.PDB.PDBParser import PDBParser
+
+	pdb_file = str(tmp_path / 'mutant.pdb')
+	write_point_mutation(pdb_file, mutant, occupancies, mutant_first, mutant_record, altlocs)
+	with warnings.catch_warnings():
+		warnings.simplefilter('ignore')
+		reference_atoms = bio_clean_atoms(pdb_file)
+		reference_names = [residue.get_resname() for residue in Selection.unfold_entities(PDBParser().get_structure('structure', pdb_file), 'R')]
+
+	structure_context = StructureContext(pdb_file)
+	coords, atm_keys = structure_context.get_clean_coordinates('A', None)
+	assert [(str(key), tuple(np.round(coord, 3))) for key, coord in zip(atm_keys, coords)] == reference_atoms
+	assert structure_context.get_residue_names() == reference_names
@@ -0,0 +1,45 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from residue_table import ResidueTable
+from structure_export import StructureExporter, get_pdb_bfactor_scale
+from structure_reader import read_structure
+
+small_cif_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'small_structure.cif')
+
+def test_bfactor_scale():
+	assert get_pdb_bfactor_scale(np.array([0.0, 0.5, 9.9999])) == 100
+	assert get_pdb_bfactor_scale(np.array([0.0, 10.0])) == 10
+	assert get_pdb_bfactor_scale(np.array([-5.0, 1.0])) == 10
+	assert get_pdb_bfactor_scale(np.array([0.0, 123456.0])) == 0.001
+
+def test_large_scores_keep_the_pdb_columns(tmp_path):
+	"""
+	Scores too large for the B-factor column are scaled down for the whole file, the columns after it do not move.
+	"""
+	atoms = read_structure(small_cif_file)
+	residue_keys = ['1', '2', '3', '4', '4A', '6']
+	residue_table = ResidueTable(residue_keys, np.full(6, 0.5), np.array([0.1, 0.2, 0.3, 0.4, 0.5, 0.6]), np.zeros(7, dtype=np.int32), np.zeros(0, dtype=np.int32))
+	residue_table.add_scores(np.arange(6), np.array([0.0, 1.0, 5.0, 12.5, 250.0, 9999.0]))
+	structureExporterObj = StructureExporter(atoms, 1)
+	export_path = structureExporterObj.export({'A': {'1': residue_table}}, str(tmp_path), 'small', 'pdb')
+
+	with open(os.path.join(export_path, 'small.score_1.pdb')) as fl:
+		lines = fl.read().splitlines()
+	assert lines[0] == 'REMARK 999 B-FACTORS ARE THE SCORE_1 VALUES TIMES 0.1'
+	atom_lines = [line for line in lines if line.startswith(('ATOM', 'HETATM'))]
+	assert len(atom_lines) == len(atoms)
+	assert [line[76:78].strip() for line in atom_lines] == atoms['element'].tolist()
+	bfactors = np.array([float(line[60:66]) for line in atom_lines])
+	in_chain_a = (atoms['chain'] == 'A') & (atoms['hetero'] == ' ')
+	assert bfactors.max() == 999.9
+	assert np.isclose(bfactors[in_chain_a & (atoms['resseq'] == 4) & (atoms['icode'] == 'A')], 25.0).all()
+
+	with open(os.path.join(export_path, 'small.conservation.pdb')) as fl:
+		assert fl.readline() == 'REMARK 999 B-FACTORS ARE THE CONSERVATION VALUES TIMES 100\n'
+	with open(os.path.join(export_path, 'small.pml')) as fl:
+		assert '# the B-factors of score_1 are its values times 0.1' in fl.read().splitlines()
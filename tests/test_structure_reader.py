@@ -0,0 +1,88 @@
+import gzip
+import os
+import shutil
+import sys
+import warnings
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from structure_reader import read_structure, get_cif_atom_site
+
+pytest.importorskip('Bio.PDB')
+
+#small_structure.cif has two chains of the first residues of the sample protein, with an insertion code, alternative locations,
+#a ligand with a quoted atom name, a water and a ;-delimited text field before the _atom_site loop. small_structure.bcif is the same
+#_atom_site category written by biotite, with every BinaryCIF encoding (ByteArray, FixedPoint, IntervalQuantization, RunLength, Delta,
+#IntegerPacking, StringArray) and masked columns.
+data_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+small_cif_file = os.path.join(data_path, 'small_structure.cif')
+small_bcif_file = os.path.join(data_path, 'small_structure.bcif')
+
+def bio_atoms(cif_file):
+	"""
+	Returns the atoms of every alternative location read by Bio.PDB.MMCIFParser, sorted, in the fields of the structure reader.
+	"""
+	from Bio.PDB.MMCIFParser import MMCIFParser
+	with warnings.catch_warnings():
+		warnings.simplefilter('ignore')
+		structure = MMCIFParser(QUIET=True).get_structure('structure', cif_file)
+	atoms = []
+	for model_indx, model in enumerate(structure):
+		for atom in model.get_atoms():
+			for child in (atom.disordered_get_list() if atom.is_disordered() else [atom]):
+				residue = child.get_parent()
+				chain = residue.get_parent()
+				atoms.append((model_indx, residue.id[0][0], chain.id, residue.id[1], residue.id[2], residue.get_resname(), child.get_id(), child.get_altloc(),
+					child.element, round(float(child.occupancy), 2), round(float(child.bfactor), 2), tuple(round(float(coord), 3) for coord in child.coord)))
+	return sorted(atoms)
+
+def reader_atoms(structure_file):
+	atoms = read_structure(structure_file)
+	return sorted((int(atom['model']), str(atom['hetero']), str(atom['chain']), int(atom['resseq']), str(atom['icode']), str(atom['resname']), str(atom['name']), str(atom['altloc']),
+		str(atom['element']), round(float(atom['occupancy']), 2), round(float(atom['bfactor']), 2), tuple(round(float(coord), 3) for coord in atom['coord'])) for atom in atoms)
+
+def test_mmcif():
+	assert reader_atoms(small_cif_file) == bio_atoms(small_cif_file)
+
+@pytest.mark.parametrize('file_name', ['small_structure.cif.gz', 'small_structure.gz'])
+def test_gzip_mmcif(tmp_path, file_name):
+	gz_file = str(tmp_path / file_name)
+	with open(small_cif_file, 'rb') as fl, gzip.open(gz_file, 'wb') as gz_fl:
+		shutil.copyfileobj(fl, gz_fl)
+	assert reader_atoms(gz_file) == bio_atoms(small_cif_file)
+
+def test_bcif():
+	pytest.importorskip('msgpack')
+	assert reader_atoms(small_bcif_file) == bio_atoms(small_cif_file)
+
+def test_text_field():
+	content = '\n'.join([
+		'data_TEXT',
+		'loop_',
+		'_atom_site.group_PDB',
+		'_atom_site.label_atom_id',
+		'_atom_site.label_comp_id',
+		'ATOM CA',
+		';GLY',
+		';',
+		"HETATM \"C1'\"",
+		';a value',
+		'over two lines',
+		'; ',
+		'#',
+	])
+	atom_site = get_cif_atom_site(content)
+	assert list(atom_site['group_PDB']) == ['ATOM', 'HETATM']
+	assert list(atom_site['label_atom_id']) == ['CA', "C1'"]
+	assert list(atom_site['label_comp_id']) == ['GLY', 'a value\nover two lines']
+
+@pytest.mark.parametrize('lines', [
+	['ATOM CA', ';GLY'],
+	['ATOM CA GLY', 'ATOM CB'],
+])
+def test_broken_loop(lines):
+	content = '\n'.join(['data_BROKEN', 'loop_', '_atom_site.group_PDB', '_atom_site.label_atom_id', '_atom_site.label_comp_id'] + lines)
+	with pytest.raises(ValueError):
+		get_cif_atom_site(content)
@@ -0,0 +1,64 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from centrality_scorer import CentralityScorer
+
+sklearn_cluster = pytest.importorskip('sklearn.cluster')
+
+input_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'input')
+sample_pdb_file = os.path.join(input_path, 'AF-Q9Y2M5-F1-model_v2.pdb')
+sample_conservations_file = os.path.join(input_path, 'Q9Y2M5.conservations.json')
+
+def sklearn_labels(scores):
+	return sklearn_cluster.AgglomerativeClustering(n_clusters=2, linkage='ward').fit_predict(np.asarray(scores).reshape(-1, 1))
+
+def assert_same_split(scores):
+	"""
+	The labels of the two implementations may be swapped, the splits should be the same.
+	"""
+	labels = CentralityScorer().ward_two_clusters(np.asarray(scores, dtype=float))
+	reference_labels = sklearn_labels(scores)
+	assert np.array_equal(labels, reference_labels) or np.array_equal(labels, 1 - reference_labels)
+
+@pytest.mark.parametrize('seed', range(50))
+def test_random_scores(seed):
+	rng = np.random.default_rng(seed)
+	size = int(rng.integers(2, 400))
+	scores = rng.choice([rng.random(size), rng.normal(size=size), rng.exponential(size=size)])
+	assert_same_split(scores)
+
+@pytest.mark.parametrize('seed', range(50))
+def test_scores_with_ties(seed):
+	rng = np.random.default_rng(1000 + seed)
+	size = int(rng.integers(3, 300))
+	#few distinct values, so that most scores are duplicated
+	scores = rng.choice(np.round(rng.random(int(rng.integers(2, 12))), 3), size=size)
+	if len(np.unique(scores)) < 2:
+		scores[0] += 1
+	assert_same_split(scores)
+
+def test_two_distinct_values():
+	assert_same_split([0.1]*5 + [0.9]*3)
+
+def test_single_score():
+	assert np.array_equal(CentralityScorer().ward_two_clusters(np.array([0.5])), [0])
+
+@pytest.mark.skipif(not os.path.exists(sample_pdb_file), reason='the sample protein is not in the input directory')
+def test_sample_protein_scores():
+	from pdb_parser import StructureContext
+	from pipeline_starter import PipelineStarter
+
+	pipelineStarterObj = PipelineStarter()
+	accessibility_data = pipelineStarterObj.get_accessibility(StructureContext(sample_pdb_file))
+	merged_data = pipelineStarterObj.merge_conservations(sample_conservations_file, accessibility_data)
+	pipelineStarterObj.run_centrality_iterations(merged_data, 5)
+
+	residue_table = merged_data['A']['1']
+	assert residue_table.scores
+	for column in residue_table.scores:
+		assert_same_split(column[~np.isnan(column)])